@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 
-import os, queue, sys
+import itertools, os, queue, sys
 from message.Message import MessageType
 
 from util.util import log_print
@@ -23,6 +23,13 @@ class Kernel:
     # delivery timestamp.
     self.messages = queue.PriorityQueue()
 
+    # Sequence number of the next queued event.  Each queue entry is an envelope
+    # (deliverAt, (recipient, type, sequence, msg)): events due at the same time
+    # are handled by recipient, event type and then in the order they were queued,
+    # so the Message itself carries no ordering and one Message may be queued
+    # for several recipients.
+    self.eventSequence = itertools.count()
+
     # currentTime is None until after kernelStarting() event completes
     # for all agents.  This is a pd.Timestamp that includes the date.
     self.currentTime = None
@@ -51,7 +58,7 @@ class Kernel:
   def runner(self, agents = [], startTime = None, stopTime = None,
              num_simulations = 1, defaultComputationDelay = 1,
              defaultLatency = 1, agentLatency = None, latencyNoise = [ 1.0 ],
-             agentLatencyModel = None, skip_log = False,
+             agentLatencyModel = None, agentQueueModels = None, skip_log = False,
              seed = None, oracle = None, log_dir = None):
 
     # agents must be a list of agents for the simulation,
@@ -126,6 +133,13 @@ class Kernel:
     # list index = ns extra delay, value = probability of this delay.
     self.latencyNoise = latencyNoise
 
+    # Optional ingress service queues, as a dictionary from agent id to a
+    # model.QueueModel.  An agent with a queue model can only be handed one
+    # message at a time; messages that arrive while it is busy wait in the
+    # model's buffer and are released by SERVICE events.  Agents without an
+    # entry receive messages as before.
+    self.agentQueueModels = agentQueueModels if agentQueueModels else {}
+
     # The kernel maintains an accumulating additional delay parameter
     # for the current agent.  This is applied to each message sent
     # and upon return from wakeup/receiveMessage, in addition to the
@@ -190,7 +204,7 @@ class Kernel:
       while not self.messages.empty() and self.currentTime and (self.currentTime <= self.stopTime):
         # Get the next message in timestamp order (delivery time) and extract it.
         self.currentTime, event = self.messages.get()
-        msg_recipient, msg_type, msg = event
+        msg_recipient, msg_type, _, msg = event
 
         # Periodically print the simulation time and total messages, even if muted.
         if ttl_messages % 100000 == 0:
@@ -216,8 +230,7 @@ class Kernel:
           # delay the wakeup until the agent can act again.
           if self.agentCurrentTimes[agent] > self.currentTime:
             # Push the wakeup call back into the PQ with a new time.
-            self.messages.put((self.agentCurrentTimes[agent],
-                              (msg_recipient, msg_type, msg)))
+            self.messages.put((self.agentCurrentTimes[agent], event))
             log_print ("Agent in future: wakeup requeued for {}",
                        self.fmtTime(self.agentCurrentTimes[agent]))
             continue
@@ -245,12 +258,27 @@ class Kernel:
           # delay the message until the agent can act again.
           if self.agentCurrentTimes[agent] > self.currentTime:
             # Push the message back into the PQ with a new time.
-            self.messages.put((self.agentCurrentTimes[agent],
-                              (msg_recipient, msg_type, msg)))
+            self.messages.put((self.agentCurrentTimes[agent], event))
             log_print ("Agent in future: message requeued for {}",
                        self.fmtTime(self.agentCurrentTimes[agent]))
             continue
 
+          # If the agent has an ingress queue, the message either waits for
+          # the busy server or is admitted now and occupies it for a sampled
+          # service time.  A SERVICE event releases the next waiting message.
+          # While messages are waiting, only SERVICE events admit: a message
+          # arriving exactly when the server frees up would otherwise jump the
+          # buffer and be served alongside the one its SERVICE event releases.
+          if agent in self.agentQueueModels:
+            queue_model = self.agentQueueModels[agent]
+            if queue_model.is_busy(self.currentTime) or queue_model.buffer:
+              queue_model.enqueue(self.currentTime, msg)
+              log_print ("Agent ingress busy until {}: message queued, queue length {}",
+                         self.fmtTime(queue_model.busy_until), len(queue_model.buffer))
+              continue
+
+            self.queueEvent(queue_model.admit(self.currentTime, self.currentTime), msg_recipient, MessageType.SERVICE)
+
           # Set agent's current time to global current time for start
           # of processing.
           self.agentCurrentTimes[agent] = self.currentTime
@@ -265,6 +293,38 @@ class Kernel:
           log_print ("After receiveMessage return, agent {} delayed from {} to {}",
                      agent, self.fmtTime(self.currentTime), self.fmtTime(self.agentCurrentTimes[agent]))
 
+        elif msg_type == MessageType.SERVICE:
+
+          # Whose ingress server just became free?
+          agent = msg_recipient
+          queue_model = self.agentQueueModels[agent]
+
+          # Nothing waiting: the server simply goes idle.
+          if not queue_model.buffer: continue
+
+          # Do not release a message to an agent that is still in the future.
+          if self.agentCurrentTimes[agent] > self.currentTime:
+            self.messages.put((self.agentCurrentTimes[agent], event))
+            log_print ("Agent in future: ingress release requeued for {}",
+                       self.fmtTime(self.agentCurrentTimes[agent]))
+            continue
+
+          arrivalTime, queued_msg = queue_model.dequeue()
+          self.queueEvent(queue_model.admit(self.currentTime, arrivalTime), msg_recipient, MessageType.SERVICE)
+
+          log_print ("Ingress released message for agent {} after waiting {}",
+                     agent, self.currentTime - arrivalTime)
+
+          self.agentCurrentTimes[agent] = self.currentTime
+
+          agents[agent].receiveMessage(self.currentTime, queued_msg)
+
+          self.agentCurrentTimes[agent] += pd.Timedelta(self.agentComputationDelays[agent] +
+                                                        self.currentAgentAdditionalDelay)
+
+          log_print ("After receiveMessage return, agent {} delayed from {} to {}",
+                     agent, self.fmtTime(self.currentTime), self.fmtTime(self.agentCurrentTimes[agent]))
+
         else:
           raise ValueError("Unknown message type found in queue",
                            "currentTime:", self.currentTime,
@@ -308,6 +368,16 @@ class Kernel:
     self.custom_state['kernel_event_queue_elapsed_wallclock'] = eventQueueWallClockElapsed
     self.custom_state['kernel_slowest_agent_finish_time'] = max(self.agentCurrentTimes)
 
+    # Ingress queue wait statistics for every agent that had a queue model.
+    if self.agentQueueModels:
+      self.custom_state['kernel_queue_stats'] = {}
+      for agent, queue_model in self.agentQueueModels.items():
+        stats = queue_model.stats()
+        self.custom_state['kernel_queue_stats'][agent] = stats
+        print ("Ingress queue for agent {}: served {}, delayed {}, mean wait {}, max wait {}, max queue length {}".format(
+               agent, stats['served'], stats['delayed'], stats['mean_wait'], stats['max_wait'],
+               stats['max_queue_length']))
+
     # Agents will request the Kernel to serialize their agent logs, usually
     # during kernelTerminating, but the Kernel must write out the summary
     # log itself.
@@ -388,7 +458,7 @@ class Kernel:
                  self.fmtTime(deliverAt))
 
     # Finally drop the message in the queue with priority == delivery time.
-    self.messages.put((deliverAt, (recipient, MessageType.MESSAGE, msg)))
+    self.queueEvent(deliverAt, recipient, MessageType.MESSAGE, msg)
 
     log_print ("Sent time: {}, current time {}, computation delay {}", sentTime, self.currentTime, self.agentComputationDelays[sender])
     log_print ("Message queued: {}", msg)
@@ -418,8 +488,12 @@ class Kernel:
     log_print ("Kernel adding wakeup for agent {} at time {}",
                sender, self.fmtTime(requestedTime))
 
-    self.messages.put((requestedTime,
-                      (sender, MessageType.WAKEUP, None)))
+    self.queueEvent(requestedTime, sender, MessageType.WAKEUP)
+
+
+  def queueEvent(self, deliverAt, recipient, msgType, msg = None):
+    # Put an event in the queue inside a new envelope; see eventSequence.
+    self.messages.put((deliverAt, (recipient, msgType, next(self.eventSequence), msg)))
 
 
   def getAgentComputeDelay(self, sender = None):
@@ -148,6 +148,12 @@ class Agent:
   def sendMessage (self, recipientID, msg, delay = 0, tag = "communication"):
     self.kernel.sendMessage(self.id, recipientID, msg, delay = delay, tag = tag)
 
+  def broadcastMessage (self, recipientIDs, msg, delay = 0, tag = "communication"):
+    # Send one message to every recipient.  The Kernel keeps a separate delivery
+    # envelope per recipient, so the message (usually a SharedMessage) is not copied.
+    for recipientID in recipientIDs:
+      self.sendMessage(recipientID, msg, delay = delay, tag = tag)
+
   def setWakeup (self, requestedTime):
     self.kernel.setWakeup(self.id, requestedTime)
 
@@ -0,0 +1,605 @@
+from agent.Agent import Agent
+from message.Message import Message, SharedMessage
+import logging
+import math
+import os
+import pandas as pd
+import random
+from model.BlotterModel import TradeBlotter
+from model.MatchingModel import BucketList
+from model.SnapshotModel import load_books, save_snapshot
+from model.SymbolModel import SymbolBooks
+from util import param, util
+
+class AuctionServiceAgent(Agent):
+    """
+    The order intake, book and iteration logic shared by the service agents of the IDP and
+    the non-private auction: soliciting and placing orders, order handles with cancel and
+    modify, the price-level cursors of pair-by-pair matching, evictions, snapshots and the
+    cost model.  Subclasses add their matching protocol: the aggProcessingMap of their
+    rounds, receive_reply for the client replies other than ORDER/CANCEL/MODIFY, and the
+    per-iteration state of their own in end_iteration.
+    """
+    def __init__(self, id, name, type,
+                 random_state=None,
+                 msg_fwd_delay=1000000,
+                 round_time=pd.Timedelta("10s"),
+                 iterations=1,
+                 num_clients=10,
+                 parallel_mode=1,
+                 debug_mode=0,
+                 book_engine="bucket",
+                 tick_ladder=(0, 1, 1024),
+                 persistent_book=False,
+                 order_quorum=1.0,
+                 order_deadline=None,
+                 max_poll_interval=pd.Timedelta("16s"),
+                 stream_orders=False,
+                 order_acks=False,
+                 snapshot_dir=None,
+                 warm_start=None,
+                 blotter_dir=None,
+                 blotter_chunk=65536,
+                 cost_model=None,
+                 match_timeout=param.wt_auction_match,
+                 wait_times=None,
+                 users={}):
+
+        # Base class init.
+        super().__init__(id, name, type, random_state)
+
+        self.logger = logging.getLogger(self.__class__.__module__)
+        self.logger.setLevel(logging.INFO)
+
+        if debug_mode:
+            logging.basicConfig()
+
+        # System parameters.
+        self.msg_fwd_delay = msg_fwd_delay  # time to forward a peer-to-peer client relay message
+        self.round_time = round_time        # default waiting time per round
+        self.no_of_iterations = iterations  # number of iterations
+        self.parallel_mode = int(parallel_mode)  # workers for the IDP fused-reveal identities; 1 (or True) runs serially
+        self.executor = None
+        self.book_engine = book_engine      # order book implementation: "bucket", "tick" or "columnar"
+        self.tick_ladder = tick_ladder      # (min price, tick size, ticks) of the "tick" book
+        self.persistent_book = persistent_book  # keep the residual book between iterations
+        self.order_quorum = order_quorum    # share of num_clients whose orders are enough to start matching
+        self.order_deadline = order_deadline  # start matching this long after soliciting orders, or None to wait
+        self.max_poll_interval = max_poll_interval  # cap on the backoff between re-solicitations
+        self.stream_orders = stream_orders  # insert orders into the book as ORDER messages arrive
+        self.order_acks = order_acks        # send clients their order handles, for cancel and modify
+        self.cost_model = cost_model  # model.CostModel for deterministic compute delays; None measures wall time
+        self.snapshot_dir = snapshot_dir    # write a book and trade snapshot here after every iteration
+        self.warm_start = warm_start        # snapshot whose book the first iteration starts from
+        # Every executed trade, in typed columns written out in chunks to blotter_dir
+        self.blotter = TradeBlotter(blotter_dir, name.replace(' ', '_'), blotter_chunk)
+        self.match_time = None              # when the MATCH request of the current pair went out
+        self.match_timeout = match_timeout  # wait for MATCH statuses before evicting a silent client
+        self.wait_times = wait_times        # model.WaitModel.WaitTimes for round waits; None keeps 1s/3s
+        self.evicted = set()                # clients evicted in this iteration; their late replies are dropped
+        self.dropouts = {'match': 0}        # evictions per phase over the run
+
+        # Input parameters.
+        self.num_clients = num_clients      # number of users per training round
+        self.users = users   # the list of user IDs
+        # Read keys.
+        self.server_key = util.read_key("pki_files/server_key.pem")
+        self.system_sk = util.read_sk("pki_files/system_pk.pem")
+
+        # agent accumulation of elapsed times by category of tasks
+        self.elapsed_time = {'PLACE': pd.Timedelta(0),
+                             'MATCH': pd.Timedelta(0),
+                             }
+
+        self.current_iteration = 1  # Single iteration
+        self.current_round = 0
+        self.recv_user_orders = []
+        self.books = SymbolBooks(book_engine, tick_ladder)  # symbol -> (buy_list, sell_list)
+        self.symbol_queue = []    # symbols still to match in this iteration, last one next
+        self.current_symbol = ""  # symbol whose books are buy_list/sell_list
+        self.buy_list = BucketList()
+        self.sell_list = BucketList()
+        self.total_orders = 0
+        self.executed_orders = 0
+        self.current_buy_price = None
+        self.current_sell_price = None
+        self.current_buy_order = None
+        self.current_sell_order = None
+        self.current_buy_order_origin = None
+        self.current_sell_order_origin = None
+        self.current_buy_order_status = None
+        self.current_sell_order_status = None
+        self.execute_user_orders = []  # this iteration's trades; self.blotter keeps the whole run
+        self.clients_sent_orders = 0  # Track clients who have sent their orders
+        self.responders = 0       # bitmap over client ids of the clients that sent this iteration's orders
+        self.solicit_start = None  # time this iteration's orders were first requested
+        self.poll_interval = pd.Timedelta("1s")  # wait before re-soliciting the missing clients
+        self.cancel_clients = []  # Clients whose resting orders are cancelled before their new batch
+        self.next_handle = 0      # handle of the next order placed in the book
+        self.dt_protocol_start = None
+        if warm_start:
+            # Snapshot orders keep their index in the snapshot as handle.
+            self.books, snapshot_meta = load_books(warm_start, book_engine, tick_ladder)
+            self.next_handle = snapshot_meta['orders']
+
+    def kernelStarting(self, startTime):
+
+        if __debug__:
+            self.agent_print(f"Initialize: {self.dt_protocol_start}")
+        for category in self.elapsed_time:
+            self.kernel.custom_state['srv_' + category.lower()] = pd.Timedelta(0)
+        self.kernel.custom_state['srv_dropouts'] = self.dropouts
+
+        self.setComputationDelay(0)
+        super().kernelStarting(startTime)
+
+    def kernelStopping(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for category, elapsed in self.elapsed_time.items():
+            self.kernel.custom_state['srv_' + category.lower()] += elapsed / self.no_of_iterations
+
+        super().kernelStopping()
+
+    def kernelTerminating(self):
+        # Not in kernelStopping, which wakeup also calls after the last iteration.
+        self.blotter.flush()
+        summary = self.blotter.summary()
+        if summary['trades']:
+            self.agent_print(f"Trades {summary['trades']}, fill rate {summary['fill_rate']:.3f}, "
+                             f"buy VWAP {summary['buy_vwap']:.4f}, sell VWAP {summary['sell_vwap']:.4f}, "
+                             f"mean match latency {pd.Timedelta(int(summary['mean_latency_ns']), unit='ns')}, "
+                             f"{summary['clients_filled']} clients filled")
+        super().kernelTerminating()
+
+    def wakeup(self, currentTime):
+        """
+        The wakeup function is called at the end of each round to execute
+        the appropriate function based on the current round (initialize, match, or execute).
+        """
+        super().wakeup(currentTime)
+
+        # Check if we should process based on the current round
+        if self.current_iteration <= self.no_of_iterations and self.current_round < len(self.aggProcessingMap):
+            if __debug__:
+                self.agent_print(f"wakeup in iteration {self.current_iteration} at function {self.namedict[self.current_round]}; current time is {currentTime}")
+            self.aggProcessingMap[self.current_round](currentTime)
+        else:
+            if __debug__:
+                self.agent_print("All orders processed.")
+            self.kernelStopping()  # End simulation when all orders are processed
+
+    def receiveMessage(self, currentTime, msg):
+        """Receive client messages (ORDER, CANCEL and MODIFY here, the rest in receive_reply)."""
+        super().receiveMessage(currentTime, msg)
+
+        if msg.body['msg'] == "ORDER":
+            if msg.body.get('iteration', self.current_iteration) != self.current_iteration:
+                return  # late batch for an auction that has already run
+            if self.current_round != 0 or self.responders >> msg.body['sender'] & 1:
+                return  # duplicate, or arrived after matching started without it
+            self.responders |= 1 << msg.body['sender']
+            new_orders = msg.body['orders']
+            if self.stream_orders:
+                self.place_orders(msg.body['sender'], new_orders, msg.body.get('cancel'))
+            else:
+                if msg.body.get('cancel'):
+                    self.cancel_clients.append(msg.body['sender'])
+                self.recv_user_orders.extend(new_orders) # Store received orders
+            self.clients_sent_orders += 1
+            if self.clients_sent_orders == self.quorum_size():
+                self.setWakeup(currentTime + self.round_wait(pd.Timedelta('1s')))  # Proceed to matching quickly
+            if __debug__:
+                self.logger.info(f"Received order from client at {currentTime}")
+        elif msg.body['msg'] in ("CANCEL", "MODIFY"):
+            self.amend_order(msg.body)
+        else:
+            self.receive_reply(currentTime, msg.body)
+
+    def receive_reply(self, currentTime, body):
+        """A client's reply in the matching protocol of the subclass."""
+        pass
+
+    def initialize(self, currentTime):
+        """
+        This is the first phase where the server expects to receive all orders from clients.
+        Once all orders are received, the server sorts them and moves to the matching phase.
+        """
+        # Initialize custom state properties
+        if not self.orders_complete(currentTime):
+            if __debug__:
+                self.agent_print(f"Waiting for orders from clients. Received from {self.clients_sent_orders} out of {self.num_clients}")
+            self.solicit_orders(currentTime)
+            self.dt_protocol_start = pd.Timestamp('now')
+        else:
+            # Orders received, sort them and move to the matching phase
+            self.recordTime(self.dt_protocol_start, "PLACE")
+            # With streaming intake the book was built and acknowledged as the orders came in.
+            if not self.stream_orders:
+                self.total_orders = len(self.recv_user_orders)
+                first_handle = self.next_handle
+                if (self.persistent_book and self.current_iteration > 1) or (self.warm_start and self.current_iteration == 1):
+                    self.update_book()
+                else:
+                    # A bulk build hands out the arrival index in the batch as handle.
+                    self.books.build(self.recv_user_orders)
+                    self.charge('insert', len(self.recv_user_orders))
+                    first_handle = 0
+                    self.next_handle = len(self.recv_user_orders)
+                self.acknowledge_orders(first_handle)
+                # The book holds the orders from now on; a columnar book keeps no order tuples.
+                self.recv_user_orders = []
+            self.symbol_queue = self.books.symbols()[::-1]
+            self.select_symbol()
+            if __debug__:
+                self.agent_print("Buy Orders:")
+                current = self.buy_list.head
+                while current:
+                    print(f"Price: {current.price}, Orders: {current.orders}")
+                    current = current.next
+
+                # Iterate through the sell list
+                print("Sell Orders:")
+                current = self.sell_list.head
+                while current:
+                    print(f"Price: {current.price}, Orders: {current.orders}")
+                    current = current.next
+
+            self.current_round = 1  # Move to matching round
+            self.setWakeup(currentTime + self.round_wait(pd.Timedelta('1s')))
+            self.dt_protocol_start = pd.Timestamp('now')
+
+    def evict_client(self, client_id, phase):
+        """
+        A client missed the deadline of a phase (a key of self.dropouts): count the dropout,
+        drop its later replies in this iteration and purge all of its resting orders through
+        the client index, as for a fake order.
+        """
+        if __debug__:
+            self.agent_print(f"Client {client_id} missed the {phase} deadline; evicting its orders")
+        self.dropouts[phase] += 1
+        self.evicted.add(client_id)
+        self.charge('purge', self.books.remove_client_orders(client_id))
+
+    # ======================== UTIL ========================
+    def choose_side(self):
+        """
+        The side_to_start of a fresh cursor walk: its list is walked from the head (best price)
+        and the other one from the tail.
+        """
+        return random.choice(["buy", "sell"])
+
+    def update_current_price(self, side):
+        if side == 'buy' and self.current_buy_price is not None and not self.current_buy_price.orders:
+            self.buy_list.remove_price(self.current_buy_price)
+            self.current_buy_price = self.buy_list.head if self.current_buy_order_origin == "head" else self.buy_list.tail
+        elif side == 'sell' and self.current_sell_price is not None and not self.current_sell_price.orders:
+            self.sell_list.remove_price(self.current_sell_price)
+            self.current_sell_price = self.sell_list.head if self.current_sell_order_origin == "head" else self.sell_list.tail
+        else:
+            return
+        self.charge('level')
+        if self.persistent_book:
+            self.skip_resting_levels()
+
+    def skip_resting_levels(self):
+        """
+        Persistent book only: levels that cannot cross the opposite best price stay in the book
+        for the next iteration, so instead of walking the tail-origin side past them (and
+        deleting them), start it at its last level that still crosses.
+        """
+        if self.current_buy_order_origin == "head" and self.buy_list.head is not None:
+            self.current_sell_price = self.sell_list.last_crossing(self.buy_list.head.price)
+        elif self.current_sell_order_origin == "head" and self.sell_list.head is not None:
+            self.current_buy_price = self.buy_list.last_crossing(self.sell_list.head.price)
+
+    def discard_non_crossing(self):
+        """
+        The head-origin cursor is the top of its side of the book, and the tail-origin cursor
+        does not cross it.  Neither does any level between that cursor and the tail, nor will
+        they cross a later head, which is only worse.  Move the tail-origin cursor straight to
+        its last level that crosses (a binary search in the price index, None if there is
+        none) and drop the levels behind it in one cut; a persistent book keeps them resting.
+        """
+        if self.current_buy_order_origin == "head":
+            best, tail_list = self.current_buy_price, self.sell_list
+        else:
+            best, tail_list = self.current_sell_price, self.buy_list
+        frontier = tail_list.last_crossing(best.price)
+        if self.persistent_book:
+            self.charge('level')
+        else:
+            removed = tail_list.truncate(frontier)
+            self.charge('level', max(len(removed), 1))
+            if __debug__:
+                self.agent_print(f"Removing {len(removed)} {'sell' if tail_list is self.sell_list else 'buy'} price levels as they cannot be matched with price {best.price}.")
+        if tail_list is self.sell_list:
+            self.current_sell_price = frontier
+        else:
+            self.current_buy_price = frontier
+
+    def round_wait(self, default):
+        """
+        Wait before the next wakeup: the fixed default, or with wait_times the time the replies
+        the next round needs take to arrive (none in rounds 0 and 1).
+        """
+        if self.wait_times is None:
+            return default
+        if self.current_round >= 2:
+            return self.wait_times.wait(self.expected_replies())
+        return self.wait_times.step
+
+    def expected_replies(self):
+        """Client replies the current round waits for: the two statuses of the pair in flight."""
+        return 2
+
+    def observe_reply(self, currentTime, sent):
+        if self.wait_times is not None and sent is not None:
+            self.wait_times.observe(currentTime - sent)
+
+    def quorum_size(self):
+        return max(1, math.ceil(self.order_quorum * self.num_clients))
+
+    def orders_complete(self, currentTime):
+        """
+        Whether to stop waiting for orders: every client answered, a quorum did, or the
+        deadline after the first solicitation passed.
+        """
+        if self.clients_sent_orders >= self.quorum_size():
+            return True
+        return (self.solicit_start is not None and self.order_deadline is not None
+                and currentTime - self.solicit_start >= self.order_deadline)
+
+    def solicit_orders(self, currentTime):
+        """
+        Request this iteration's orders: from every user the first time, afterwards only from
+        the users missing in the responders bitmap, doubling the wait between requests up to
+        max_poll_interval.
+        """
+        if self.solicit_start is None:
+            self.solicit_start = currentTime
+            self.poll_interval = self.wait_times.wait(len(self.users)) if self.wait_times else pd.Timedelta("1s")
+            targets = self.users
+        else:
+            targets = [user_id for user_id in self.users if not self.responders >> user_id & 1]
+            self.poll_interval = min(2 * self.poll_interval, self.max_poll_interval)
+        self.broadcastMessage(targets,
+                              SharedMessage({"msg": "SEND_ORDERS",  # Message requesting orders
+                                             "sender": self.id,
+                                             "iteration": self.current_iteration,
+                                             "total": self.num_clients}),
+                              tag="comm_output_server")
+        if self.order_deadline is not None:
+            # Do not sleep through the deadline.
+            next_poll = min(currentTime + self.poll_interval, self.solicit_start + self.order_deadline)
+        else:
+            next_poll = currentTime + self.poll_interval
+        self.setWakeup(max(next_poll, currentTime + pd.Timedelta("1ns")))
+
+    def update_book(self):
+        """
+        Persistent book only: apply the new batch to the residual book from the previous
+        iteration.  Clients that asked to cancel lose all their resting orders first, then the
+        new orders are inserted level by level, so the cost follows the new flow rather than
+        the size of the book.
+        """
+        for client_id in self.cancel_clients:
+            self.charge('purge', self.books.remove_client_orders(client_id))
+        for order in self.recv_user_orders:
+            self.books.insert(order, self.next_handle)
+            self.next_handle += 1
+        self.charge('insert', len(self.recv_user_orders))
+
+    def select_symbol(self):
+        """
+        Point buy_list/sell_list and the matching state at the next symbol of this iteration.
+        Symbols are matched one after another in sorted order.  Returns False if none is left.
+        """
+        if not self.symbol_queue:
+            return False
+        self.current_symbol = self.symbol_queue.pop()
+        self.buy_list, self.sell_list = self.books[self.current_symbol]
+        self.current_buy_price = None
+        self.current_sell_price = None
+        self.current_buy_order = None
+        self.current_sell_order = None
+        return True
+
+    def acknowledge_orders(self, first_handle):
+        """
+        Tell every client the handles of the orders it placed in this batch, in the order it
+        sent them.  Batch orders got consecutive handles starting at first_handle.  Only with
+        order_acks: clients that never amend an order need no handles.
+        """
+        if not self.order_acks:
+            return
+        handles = {}
+        for handle, order in enumerate(self.recv_user_orders, first_handle):
+            handles.setdefault(order[2][0], []).append(handle)
+        for client_id, client_handles in handles.items():
+            self.send_order_ack(client_id, client_handles)
+
+    def send_order_ack(self, client_id, handles):
+        self.sendMessage(client_id,
+                         Message({"msg": "ORDER_ACK",
+                                  "iteration": self.current_iteration,
+                                  "handles": handles,
+                                  "sender": 0}),
+                         tag="comm_output_server")
+
+    def place_orders(self, client_id, orders, cancel):
+        """
+        Streaming intake: insert a client's batch into the book as soon as it arrives and
+        acknowledge its handles (with order_acks), so the book is built while the server still waits for the
+        other clients and no batch is kept around.  A cancel flag first removes the client's
+        resting orders, as update_book does for a batch.
+        """
+        dt_protocol_start = pd.Timestamp('now')
+        if cancel:
+            self.charge('purge', self.books.remove_client_orders(client_id))
+        first_handle = self.next_handle
+        for order in orders:
+            self.books.insert(order, self.next_handle)
+            self.next_handle += 1
+        self.charge('insert', len(orders))
+        self.total_orders += len(orders)
+        if self.order_acks:
+            self.send_order_ack(client_id, list(range(first_handle, self.next_handle)))
+        self.recordTime(dt_protocol_start, "PLACE")
+
+    def amend_order(self, body):
+        """
+        Apply a client's CANCEL or MODIFY of one resting order, identified by its handle and
+        side.  Refused if the book for that iteration is not built, the order is no longer
+        resting or belongs to another client, or it is part of a pair currently in flight.
+        """
+        client_id = body['sender']
+        handle = body['handle']
+        if body.get('iteration') != self.current_iteration or (self.current_round == 0 and not self.stream_orders):
+            return self.reject_amendment(client_id, body, "no book")
+
+        symbol = body.get('symbol', "")
+        if symbol not in self.books:
+            return self.reject_amendment(client_id, body, "not resting")
+        buy_list, sell_list = self.books[symbol]
+        price_list = buy_list if body['side'] == 'B' else sell_list
+        entry = price_list.locate(handle)
+        if entry is None:
+            return self.reject_amendment(client_id, body, "not resting")
+        node, position = entry
+        if node.orders.at(position)[0] != client_id:
+            return self.reject_amendment(client_id, body, "not owner")
+        if self.in_flight("buy" if body['side'] == 'B' else "sell", node, position):
+            return self.reject_amendment(client_id, body, "in flight")
+
+        if body['msg'] == "CANCEL":
+            price_list.cancel(handle)
+            self.charge('purge')
+            self.sendMessage(client_id,
+                             Message({"msg": "CANCEL_ACK",
+                                      "iteration": self.current_iteration,
+                                      "handle": handle,
+                                      "sender": 0}),
+                             tag="comm_output_server")
+        else:
+            new_handle = self.next_handle
+            self.next_handle += 1
+            price_list.modify(handle, body['price'], new_handle)
+            self.charge('insert')
+            self.sendMessage(client_id,
+                             Message({"msg": "ORDER_ACK",
+                                      "iteration": self.current_iteration,
+                                      "handles": [new_handle],
+                                      "replaces": handle,
+                                      "sender": 0}),
+                             tag="comm_output_server")
+
+    def in_flight(self, side, node, position):
+        """
+        Whether the resting order at position of level node is the side's order of the pair
+        currently in flight, which a cancel or modify must not pull from under the clients.
+        """
+        if side == "buy":
+            current_price, current_order = self.current_buy_price, self.current_buy_order
+        else:
+            current_price, current_order = self.current_sell_price, self.current_sell_order
+        return current_order is not None and node is current_price and position == node.orders.head_position()
+
+    def reject_amendment(self, client_id, body, reason):
+        if __debug__:
+            self.agent_print(f"Rejected {body['msg']} of order {body['handle']} from client {client_id}: {reason}")
+        self.sendMessage(client_id,
+                         Message({"msg": "ORDER_REJECT",
+                                  "iteration": self.current_iteration,
+                                  "request": body['msg'],
+                                  "handle": body['handle'],
+                                  "reason": reason,
+                                  "sender": 0}),
+                         tag="comm_output_server")
+
+    def end_iteration(self):
+        """
+        Close the current auction and reset the per-iteration state, so the next wakeup
+        solicits a new batch of orders.  The book is discarded unless it is persistent.
+        """
+        if self.snapshot_dir:
+            self.save_snapshot()
+        self.blotter.add_orders(self.total_orders)
+        self.current_iteration += 1
+        self.current_round = 0
+        self.recv_user_orders = []
+        self.cancel_clients = []
+        self.clients_sent_orders = 0
+        self.responders = 0
+        self.solicit_start = None
+        self.total_orders = 0
+        self.executed_orders = 0
+        self.current_buy_price = None
+        self.current_sell_price = None
+        self.current_buy_order = None
+        self.current_sell_order = None
+        self.current_buy_order_status = None
+        self.current_sell_order_status = None
+        self.execute_user_orders = []
+        self.match_time = None
+        self.evicted = set()
+        if not self.persistent_book:
+            self.books = SymbolBooks(self.book_engine, self.tick_ladder)
+            self.buy_list = BucketList()
+            self.sell_list = BucketList()
+        else:
+            # The book's order indexes would otherwise keep every order it ever held.
+            self.books.prune_indexes()
+
+    def remove_fake_orders(self, price_list, client_name):
+        """
+        Remove all fake orders from the specified price list for the given client.
+        """
+        self.charge('purge', price_list.remove_client_orders(client_name))
+
+    def save_snapshot(self):
+        """
+        Write the book as left by this iteration and the trades it executed to
+        <snapshot_dir>/<agent name>_iteration_<n>.snap.  See model/SnapshotModel.py for the layout.
+        """
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = os.path.join(self.snapshot_dir, f"{self.name.replace(' ', '_')}_iteration_{self.current_iteration}.snap")
+        save_snapshot(path, self.books, self.execute_user_orders,
+                      iteration=self.current_iteration, next_handle=self.next_handle)
+        if __debug__:
+            self.agent_print(f"Saved snapshot {path}")
+
+    def sendMessage(self, recipientID, msg, delay=0, tag="communication"):
+        self.charge('message')
+        super().sendMessage(recipientID, msg, delay=delay, tag=tag)
+
+    def charge(self, operation, count=1):
+        if self.cost_model is not None:
+            self.cost_model.charge(operation, count)
+
+    def compute_delay(self, dt_protocol_start):
+        """
+        The server compute time of the current step: the wall time since dt_protocol_start, or
+        with a cost model the calibrated cost of the operations charged since the last step.
+        """
+        if self.cost_model is None:
+            return pd.Timestamp('now') - dt_protocol_start
+        return self.cost_model.take()
+
+    def recordTime(self, startTime, categoryName):
+        # Accumulate into time log.
+        dt_protocol_end = pd.Timestamp('now')
+        if __debug__:
+            self.agent_print(f"Category name: {categoryName}, end time {dt_protocol_end}")
+        self.elapsed_time[categoryName] += dt_protocol_end - startTime
+
+    def agent_print(*args, **kwargs):
+        """
+        Custom print function that adds a [Server] header before printing.
+
+        Args:
+            *args: Any positional arguments that the built-in print function accepts.
+            **kwargs: Any keyword arguments that the built-in print function accepts.
+        """
+        print(*args, **kwargs)
@@ -15,7 +15,8 @@ class ClientAgent(Agent):
     def __str__(self):
         return "[client]"
 
-    def __init__(self, id, name, type, random_state, iterations=1):
+    def __init__(self, id, name, type, random_state, iterations=1, cancel_prob=0.0, modify_prob=0.0,
+                 symbol=None, dropout_prob=0.0):
 
         # Set logger
         super().__init__(id, name, type, random_state)
@@ -26,6 +27,8 @@ class ClientAgent(Agent):
         """Read keys."""
         # Read system-wide pk
         self.system_pk = util.read_pk(f"pki_files/system_pk.pem")
+        # Server pk, to encrypt the identity sent with a fused reveal
+        self.server_pk = util.read_pk(f"pki_files/server_key.pem")
 
         # sk is used to establish pairwise secret with neighbors' public keys
         self.key = util.read_key(f"pki_files/client{self.id}.pem")
@@ -44,10 +47,21 @@ class ClientAgent(Agent):
         self.current_iteration = 1
         self.current_base = 0
         self.sent_orders = False
+        self.last_price = None  # price of the previous batch, to re-quote in a persistent book
+        self.side = None
+        self.symbol = symbol  # instrument this client trades; None for the single default book
+        self.order_handles = set()  # handles of this client's resting orders, from ORDER_ACK
+        self.cancel_prob = cancel_prob  # chance to cancel each acknowledged order
+        self.modify_prob = modify_prob  # chance to reprice each acknowledged order
+        self.rejected_amendments = 0
+        self.dropout_prob = dropout_prob  # chance to go silent for the rest of the auction at each request
+        self.dropped = False
         self.order_status = {}
         self.total_orders = 0
         self.matched_orders = 0
         self.executed_orders = 0
+        self.executions = set()   # ids of the executions counted in executed_orders this auction
+        self.aborted = set()      # ids of executions aborted before their EXECUTE arrived
         self.dt_protocol_start = None
 
         # State flag
@@ -101,25 +115,52 @@ class ClientAgent(Agent):
 
         if msg.body['msg'] == "SEND_ORDERS":
             self.dt_protocol_start = pd.Timestamp('now')
+            if msg.body.get('iteration', self.current_iteration) > self.current_iteration:
+                # A new auction: send a fresh batch.
+                self.current_iteration = msg.body['iteration']
+                self.sent_orders = False
+                self.matched_orders = 0
+                self.dropped = False
+                self.executions.clear()
+                self.aborted.clear()
             if not self.sent_orders:
                 self.send_orders(currentTime,msg.body['total'])
             self.recordTime(self.dt_protocol_start, 'PLACE')
             self.dt_protocol_start = pd.Timestamp('now')
 
+        elif msg.body['msg'] == "EXECUTE_ABORT":
+            self.abort_execution(msg.body['execution'])
+
+        elif msg.body['msg'] in ("MATCH", "EXECUTE") and self.drop_out():
+            return
+
         elif msg.body['msg'] == "MATCH":
-            self.match_orders(msg.body['buy_order'],msg.body['sell_order'])
+            self.match_orders(msg.body['buy_order'],msg.body['sell_order'],msg.body.get('pair'),msg.body.get('fused', False))
             if (self.matched_orders == self.total_orders):
                 self.recordTime(self.dt_protocol_start, 'MATCH')
 
         elif msg.body['msg'] == "EXECUTE":
-            self.execute_orders(msg.body['buy_order'],msg.body['sell_order'],msg.body['buy_price'],msg.body['sell_price'])
+            self.execute_orders(msg.body['buy_order'],msg.body['sell_order'],msg.body['buy_price'],msg.body['sell_price'],msg.body.get('pair'),msg.body.get('notice', False),msg.body.get('execution'))
             self.recordTime(self.dt_protocol_start, 'EXECUTE')
 
+        elif msg.body['msg'] == "ORDER_ACK":
+            self.order_handles.discard(msg.body.get('replaces'))
+            self.order_handles.update(msg.body['handles'])
+            if 'replaces' not in msg.body:
+                self.amend_orders(msg.body['handles'])
+
+        elif msg.body['msg'] == "CANCEL_ACK":
+            self.order_handles.discard(msg.body['handle'])
+
+        elif msg.body['msg'] == "ORDER_REJECT":
+            self.rejected_amendments += 1
+
     ###################################
     # Round logics
     ###################################
     def send_orders(self, currentTime, total):
-        aes_key = self.aes.generate_aes_key()
+        # One key for the whole run: orders resting from earlier batches must stay readable.
+        aes_key = self.aes_key if self.aes_key is not None else self.aes.generate_aes_key()
         total_orders = 8
         # Randomly determine the number of real orders (between 5 and 7)
         num_real = random.randint(5, 7)
@@ -141,31 +182,41 @@ class ClientAgent(Agent):
         encrypted_name = self.aes.encrypt_with_aes(aes_key, client_name)
         encrypted_status_true = self.aes.encrypt_with_aes(aes_key, str(status_true))
         encrypted_status_false = self.aes.encrypt_with_aes(aes_key, str(status_false))
+        tag = (self.symbol,) if self.symbol is not None else ()
         orders = []
         for order_id in range(0, num_real):
-            order = (price, buy_sell, (self.id, encrypted_name, encrypted_status_true))
+            order = (price, buy_sell, (self.id, encrypted_name, encrypted_status_true)) + tag
             orders.append(order)
         for order_id in range(0, num_fake):
-            order = (price, buy_sell, (self.id, encrypted_name, encrypted_status_false))
+            order = (price, buy_sell, (self.id, encrypted_name, encrypted_status_false)) + tag
             orders.append(order)
         self.total_orders = len(orders)
+        self.side = buy_sell
+        # A changed price withdraws whatever is still resting from earlier batches.
+        cancel = self.last_price is not None and self.last_price != price
+        self.last_price = price
         self.aes_key = aes_key
         # Send the orders to the server
         self.sendMessage(self.serviceAgentID,
                          Message({"msg": "ORDER",
+                                  "sender": self.id,
                                   "iteration": self.current_iteration,
                                   "orders": orders,
+                                  "cancel": cancel,
                                   }),
                          tag="comm_order_generation")
         self.sent_orders = True
 
-    def match_orders(self, order1, order2):
+    def match_orders(self, order1, order2, pair=None, fused=False):
         # Function to send the execution message
         def send_execution_message(order, type):
             id, encrypted_name, encrypted_status = order
 
             status = self.aes.decrypt_with_aes(self.aes_key, encrypted_status)
             status = True if status == "True" else False
+            # Fused reveal: the identity travels with the status, readable only by the server,
+            # which opens it if both orders of the pair are real.
+            identity = self.aes.encrypt_to_key(self.server_pk, self.name) if fused else None
             # Send message to server to indicate whether the order was real or not
             self.sendMessage(self.serviceAgentID,
                              Message({
@@ -173,6 +224,9 @@ class ClientAgent(Agent):
                                  "iteration": self.current_iteration,
                                  "order": order,
                                  "type": type,
+                                 "pair": pair,  # echoed so a pipelining server can tell pairs apart
+                                 "identity": identity,
+                                 "sender": self.id,
                                  "status": status  # Send decrypted status back to server
                              }),
                              tag="comm_order_match")
@@ -184,9 +238,11 @@ class ClientAgent(Agent):
         elif client_name_order_2 is not None and client_name_order_2 == self.name:  # Check if the agent name matches
             send_execution_message(order2, "sell")
 
-    def execute_orders(self, order1, order2, buy_price, sell_price):
+    def execute_orders(self, order1, order2, buy_price, sell_price, pair=None, notice=False, execution=None):
         # Function to send the name reveal message
         def send_execution_message(name, type, price):
+            if notice:
+                return  # fused reveal: the server knows the name already
             self.sendMessage(self.serviceAgentID,
                              Message({
                                  "msg": "EXECUTE",
@@ -194,19 +250,71 @@ class ClientAgent(Agent):
                                  "name": name,
                                  "type": type,
                                  "price" : price,
+                                 "pair": pair,
+                                 "sender": self.id,
                                  "status": True  # Send decrypted status back to server
                              }),
                              tag="comm_order_execute")
 
+        if execution in self.aborted:
+            self.aborted.discard(execution)  # the server gave up on it already
+            return
+
         client_name_order_1 = self.aes.decrypt_with_aes(self.aes_key, order1[1])
         client_name_order_2 = self.aes.decrypt_with_aes(self.aes_key, order2[1])
         if client_name_order_1 is not None and client_name_order_1 == self.name:
             self.executed_orders += 1
+            self.executions.add(execution)
             send_execution_message(client_name_order_1, "buy", buy_price)
         elif client_name_order_2 is not None and client_name_order_2 == self.name:
             self.executed_orders += 1
+            self.executions.add(execution)
             send_execution_message(client_name_order_2, "sell", sell_price)
 
+    def abort_execution(self, execution):
+        """
+        The server aborted an execution because a counterparty did not reveal its name in
+        time: take back the fill if it was counted, or skip the EXECUTE if it is still on its
+        way.
+        """
+        if execution in self.executions:
+            self.executions.discard(execution)
+            self.executed_orders -= 1
+        else:
+            self.aborted.add(execution)
+
+
+    def amend_orders(self, handles):
+        """
+        Cancel or reprice a random share of freshly acknowledged orders, to generate cancel and
+        modify traffic.  A repriced order moves one tick away from the batch price.  Draws
+        nothing unless amendments are enabled, so runs without them keep their random stream.
+        """
+        if not self.cancel_prob and not self.modify_prob:
+            return
+        for handle in handles:
+            draw = self.random_state.rand()
+            if draw < self.cancel_prob:
+                body = {"msg": "CANCEL"}
+            elif draw < self.cancel_prob + self.modify_prob:
+                body = {"msg": "MODIFY", "price": self.last_price + int(self.random_state.choice([-1, 1]))}
+            else:
+                continue
+            body.update({"sender": self.id,
+                         "iteration": self.current_iteration,
+                         "handle": handle,
+                         "side": self.side,
+                         "symbol": self.symbol if self.symbol is not None else ""})
+            self.sendMessage(self.serviceAgentID, Message(body), tag="comm_order_amend")
+
+    def drop_out(self):
+        """
+        Whether the client ignores this request: once it drops out it stays silent until the
+        next auction asks for orders.
+        """
+        if not self.dropped and self.dropout_prob and self.random_state.rand() < self.dropout_prob:
+            self.dropped = True
+        return self.dropped
 
     # ======================== UTIL ========================
     def recordTime(self, startTime, categoryName):
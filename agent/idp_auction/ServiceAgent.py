@@ -1,12 +1,12 @@
-from agent.Agent import Agent
-from message.Message import Message
-import logging
+from agent.AuctionServiceAgent import AuctionServiceAgent
+from message.Message import Message, SharedMessage
 import pandas as pd
-import random
-from model.MatchingModel import BucketList, create_sorted_lists
-from util import util
+from itertools import chain, repeat
+from model.SymbolModel import create_executor
+from util import param
+from util.aes import aes
 
-class ServiceAgent(Agent):
+class ServiceAgent(AuctionServiceAgent):
     def __init__(self, id, name, type,
                  random_state=None,
                  msg_fwd_delay=1000000,
@@ -15,57 +15,74 @@ class ServiceAgent(Agent):
                  num_clients=10,
                  parallel_mode=1,
                  debug_mode=0,
+                 book_engine="bucket",
+                 tick_ladder=(0, 1, 1024),
+                 persistent_book=False,
+                 order_quorum=1.0,
+                 order_deadline=None,
+                 max_poll_interval=pd.Timedelta("16s"),
+                 stream_orders=False,
+                 order_acks=False,
+                 snapshot_dir=None,
+                 warm_start=None,
+                 blotter_dir=None,
+                 blotter_chunk=65536,
+                 pipeline_depth=1,
+                 fused_reveal=False,
+                 cost_model=None,
+                 match_timeout=param.wt_auction_match,
+                 wait_times=None,
+                 execute_timeout=param.wt_auction_execute,
                  users={}):
 
-        # Base class init.
-        super().__init__(id, name, type, random_state)
-
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-
-        if debug_mode:
-            logging.basicConfig()
+        # Base class init: the order intake, book and iteration state.
+        super().__init__(id, name, type, random_state,
+                         msg_fwd_delay=msg_fwd_delay,
+                         round_time=round_time,
+                         iterations=iterations,
+                         num_clients=num_clients,
+                         parallel_mode=parallel_mode,
+                         debug_mode=debug_mode,
+                         book_engine=book_engine,
+                         tick_ladder=tick_ladder,
+                         persistent_book=persistent_book,
+                         order_quorum=order_quorum,
+                         order_deadline=order_deadline,
+                         max_poll_interval=max_poll_interval,
+                         stream_orders=stream_orders,
+                         order_acks=order_acks,
+                         snapshot_dir=snapshot_dir,
+                         warm_start=warm_start,
+                         blotter_dir=blotter_dir,
+                         blotter_chunk=blotter_chunk,
+                         cost_model=cost_model,
+                         match_timeout=match_timeout,
+                         wait_times=wait_times,
+                         users=users)
 
         # System parameters.
-        self.msg_fwd_delay = msg_fwd_delay  # time to forward a peer-to-peer client relay message
-        self.round_time = round_time        # default waiting time per round
-        self.no_of_iterations = iterations  # number of iterations
-        self.parallel_mode = parallel_mode  # parallel
-
-        # Input parameters.
-        self.num_clients = num_clients      # number of users per training round
-        self.users = users   # the list of user IDs
-        # Read keys.
-        self.server_key = util.read_key("pki_files/server_key.pem")
-        self.system_sk = util.read_sk("pki_files/system_pk.pem")
+        self.execute_time = None            # when the EXECUTE requests of the current round went out
+        self.execute_timeout = execute_timeout  # wait for EXECUTE names before evicting a silent client
+        self.dropouts['execute'] = 0
+        self.pipeline_depth = pipeline_depth  # candidate pairs in flight per matching round
+        self.fused_reveal = fused_reveal    # clients send their identity, encrypted to the server key, with the status
+        self.aes = aes()
 
         # agent accumulation of elapsed times by category of tasks
-        self.elapsed_time = {'PLACE': pd.Timedelta(0),
-                             'MATCH': pd.Timedelta(0),
-                             'REVEAL': pd.Timedelta(0),
-                             'EXECUTE': pd.Timedelta(0)
-                             }
-
-        self.current_iteration = 1  # Single iteration
-        self.current_round = 0
-        self.recv_user_orders = []
-        self.buy_list = BucketList()
-        self.sell_list = BucketList()
-        self.total_orders = 0
-        self.executed_orders = 0
-        self.current_buy_price = None
-        self.current_sell_price = None
-        self.current_buy_order = None
-        self.current_sell_order = None
-        self.current_buy_order_origin = None
-        self.current_sell_order_origin = None
-        self.current_buy_order_status = None
-        self.current_sell_order_status = None
+        self.elapsed_time.update({'REVEAL': pd.Timedelta(0),
+                                  'EXECUTE': pd.Timedelta(0)})
+
         self.current_buy_order_name = None
         self.current_sell_order_name = None
-        self.execute_user_orders = []
-        self.clients_sent_orders = 0  # Track clients who have sent their orders
-        self.dt_protocol_start = None
+        self.current_buy_order_identity = None
+        self.current_sell_order_identity = None
+        self.pipeline = []        # in-flight pairs of a pipelined matching round, in book order
+        self.pipeline_pairs = {}  # pair id -> entry of self.pipeline awaiting replies
+        self.trailing_levels = [] # levels the plan dropped behind its last pair, removed once every pair commits
+        self.next_pair = 0        # id of the next candidate pair sent to clients
+        self.next_execution = 0   # id of the next EXECUTE, so an abort can name the one it undoes
+        self.current_execution = None
+        self.executing = []       # executed pairs of a pipelined round awaiting client names
 
         # Map the message processing functions
         self.aggProcessingMap = {
@@ -81,126 +98,60 @@ class ServiceAgent(Agent):
             2: "reveal orders",
             3: "execute orders"
         }
-
-    def kernelStarting(self, startTime):
-
-        if __debug__:
-            self.agent_print(f"Initialize: {self.dt_protocol_start}")
-        self.kernel.custom_state['srv_place'] = pd.Timedelta(0)
-        self.kernel.custom_state['srv_match'] = pd.Timedelta(0)
-        self.kernel.custom_state['srv_reveal'] = pd.Timedelta(0)
-        self.kernel.custom_state['srv_execute'] = pd.Timedelta(0)
-
-        self.setComputationDelay(0)
-        super().kernelStarting(startTime)
-
-    def kernelStopping(self):
-        self.kernel.custom_state['srv_place'] += (
-                self.elapsed_time['PLACE'] / self.no_of_iterations)
-        self.kernel.custom_state['srv_match'] += (
-                self.elapsed_time['MATCH'] / self.no_of_iterations)
-        self.kernel.custom_state['srv_reveal'] += (
-                self.elapsed_time['REVEAL'] / self.no_of_iterations)
-        self.kernel.custom_state['srv_execute'] += (
-                self.elapsed_time['EXECUTE'] / self.no_of_iterations)
-
-        super().kernelStopping()
-
-    def wakeup(self, currentTime):
-        """
-        The wakeup function is called at the end of each round to execute
-        the appropriate function based on the current round (initialize, match, or execute).
-        """
-        super().wakeup(currentTime)
-
-        # Check if we should process based on the current round
-        if self.current_iteration <= self.no_of_iterations and self.current_round < len(self.aggProcessingMap):
-            if __debug__:
-                self.agent_print(f"wakeup in iteration {self.current_iteration} at function {self.namedict[self.current_round]}; current time is {currentTime}")
-            self.aggProcessingMap[self.current_round](currentTime)
-        else:
-            if __debug__:
-                self.agent_print("All orders processed.")
-            self.kernelStopping()  # End simulation when all orders are processed
-
-    def receiveMessage(self, currentTime, msg):
-        """Receive client messages (ORDER)."""
-        super().receiveMessage(currentTime, msg)
-
-        if msg.body['msg'] == "ORDER":
-            new_orders = msg.body['orders']
-            self.recv_user_orders.extend(new_orders) # Store received orders
-            self.clients_sent_orders += 1
-            if self.clients_sent_orders == self.num_clients:
-                self.setWakeup(currentTime + pd.Timedelta('1s'))  # Proceed to matching quickly
-            if __debug__:
-                self.logger.info(f"Received order from client at {currentTime}")
-        elif msg.body['msg'] == "MATCH":
-            type = msg.body['type']
+        if pipeline_depth > 1:
+            self.aggProcessingMap.update({1: self.match_pipelined,
+                                          2: self.reveal_pipelined,
+                                          3: self.execute_pipelined})
+
+    def receive_reply(self, currentTime, body):
+        """Receive client replies (MATCH and EXECUTE)."""
+        if body['msg'] in ("MATCH", "EXECUTE") and body.get('sender') in self.evicted:
+            return  # late reply of a client that missed its deadline
+        elif body['msg'] == "MATCH" and body.get('pair') is not None:
+            entry = self.pipeline_pairs.get(body['pair'])
+            if entry is not None:  # replies for rolled back pairs are dropped
+                self.observe_reply(currentTime, entry["matched_at"])
+                entry[body['type'] + "_status"] = body['status']
+                entry[body['type'] + "_identity"] = body.get('identity')
+        elif body['msg'] == "EXECUTE" and body.get('pair') is not None:
+            entry = self.pipeline_pairs.get(body['pair'])
+            if entry is not None:
+                self.observe_reply(currentTime, self.execute_time)
+                entry[body['type'] + "_name"] = body['name']
+        elif body['msg'] == "MATCH":
+            type = body['type']
+            if body['order'] != (self.current_buy_order if type == "buy" else self.current_sell_order):
+                return  # reply for a pair given up on
+            self.observe_reply(currentTime, self.match_time)
             if type == "buy":
-                self.current_buy_order_status = msg.body['status']
+                self.current_buy_order_status = body['status']
+                self.current_buy_order_identity = body.get('identity')
             elif type == "sell":
-                self.current_sell_order_status = msg.body['status']
+                self.current_sell_order_status = body['status']
+                self.current_sell_order_identity = body.get('identity')
             if __debug__:
-                self.agent_print(f"Received match from client {msg.body['order']} {msg.body['type']} {msg.body['status']}")
-        elif msg.body['msg'] == "EXECUTE":
-            type = msg.body['type']
+                self.agent_print(f"Received match from client {body['order']} {body['type']} {body['status']}")
+        elif body['msg'] == "EXECUTE":
+            type = body['type']
+            self.observe_reply(currentTime, self.execute_time)
             if type == "buy":
-                self.current_buy_order_name = msg.body['name']
+                self.current_buy_order_name = body['name']
             elif type == "sell":
-                self.current_sell_order_name = msg.body['name']
+                self.current_sell_order_name = body['name']
             if __debug__:
-                self.agent_print(f"Received execute from client {msg.body['name']} {msg.body['type']} {msg.body['price']}")
+                self.agent_print(f"Received execute from client {body['name']} {body['type']} {body['price']}")
 
     def initialize(self, currentTime):
-        """
-        This is the first phase where the server expects to receive all orders from clients.
-        Once all orders are received, the server sorts them and moves to the matching phase.
-        """
-        # Initialize custom state properties
         self.dt_protocol_start = pd.Timestamp('now')
-        if self.clients_sent_orders < self.num_clients:
-            if __debug__:
-                self.agent_print(f"Waiting for orders from clients. Received from {self.clients_sent_orders} out of {self.num_clients}")
-            for user_id in self.users:
-                self.sendMessage(user_id,
-                                 Message({"msg": "SEND_ORDERS",  # Message requesting orders
-                                          "sender": self.id,
-                                          "total": self.num_clients}),
-                                 tag="comm_output_server")
-
-            # Wait for the next wakeup to check if orders have been received
-            self.setWakeup(currentTime + pd.Timedelta('1s'))  # Adjust timing as necessary
-            self.dt_protocol_start = pd.Timestamp('now')
-        else:
-            # Orders received, sort them and move to the matching phase
-            self.recordTime(self.dt_protocol_start, "PLACE")
-            self.total_orders = len(self.recv_user_orders)
-            self.buy_list, self.sell_list = create_sorted_lists(self.recv_user_orders)
-            if __debug__:
-                self.agent_print("Buy Orders:")
-                current = self.buy_list.head
-                while current:
-                    print(f"Price: {current.price}, Orders: {current.orders}")
-                    current = current.next
-
-                # Iterate through the sell list
-                print("Sell Orders:")
-                current = self.sell_list.head
-                while current:
-                    print(f"Price: {current.price}, Orders: {current.orders}")
-                    current = current.next
-
-            self.current_round = 1  # Move to matching round
-            self.setWakeup(currentTime + pd.Timedelta('1s'))
-            self.dt_protocol_start = pd.Timestamp('now')
+        super().initialize(currentTime)
 
     def match_orders(self, currentTime):
         dt_protocol_start = pd.Timestamp('now')
-        side_to_start = random.choice(["buy", "sell"])
 
-        # Initialize buy and sell prices based on starting side
+        # Initialize buy and sell prices based on starting side; the origins stay fixed until
+        # both current orders are gone.
         if self.current_sell_order is None and self.current_buy_order is None:
+            side_to_start = self.choose_side()
             if side_to_start == "buy":
                 self.current_buy_price = self.buy_list.head
                 self.current_buy_order_origin = "head"
@@ -211,12 +162,19 @@ class ServiceAgent(Agent):
                 self.current_buy_order_origin = "tail"
                 self.current_sell_price = self.sell_list.head
                 self.current_sell_order_origin = "head"
+            if self.persistent_book:
+                self.skip_resting_levels()
 
         # Handle current price orders
         self.update_current_price('buy')
         self.update_current_price('sell')
 
         while self.current_buy_price and self.current_sell_price:
+            if not self.current_buy_price.orders or not self.current_sell_price.orders:
+                # A purge or cancel emptied a level the cursor has reached.
+                self.update_current_price('buy')
+                self.update_current_price('sell')
+                continue
             if __debug__:
                 self.agent_print(f"Buy Price {self.current_buy_price.price} and Sell Price {self.current_sell_price.price}")
             self.current_buy_order = self.current_buy_price.orders[0]
@@ -227,24 +185,29 @@ class ServiceAgent(Agent):
 
             # Check for valid price matching
             if self.current_buy_price.price >= self.current_sell_price.price:
-                buy_id = self.current_buy_order[0]
-                sell_id = self.current_sell_order[0]
-                self.sendMessage(buy_id, Message({"msg": "MATCH", "buy_order": self.current_buy_order, "sell_order": self.current_sell_order, "sender": 0}), tag="comm_output_server")
-                self.sendMessage(sell_id, Message({"msg": "MATCH", "buy_order": self.current_buy_order, "sell_order": self.current_sell_order, "sender": 0}), tag="comm_output_server")
+                self.broadcastMessage((self.current_buy_order[0], self.current_sell_order[0]),
+                                      SharedMessage({"msg": "MATCH", "buy_order": self.current_buy_order, "sell_order": self.current_sell_order, "fused": self.fused_reveal, "sender": 0}),
+                                      tag="comm_output_server")
+                self.match_time = currentTime
                 self.current_round = 2
                 break
 
-            self.handle_price_removal(side_to_start)
+            self.discard_non_crossing()
 
-        server_comp_delay = pd.Timestamp('now') - dt_protocol_start
-        if not self.buy_list.head or not self.sell_list.head:
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        if self.persistent_book:
+            # The book is not emptied; the auction is over once no crossing pair is left.
+            finished = not self.current_buy_price or not self.current_sell_price
+        else:
+            finished = not self.buy_list.head or not self.sell_list.head
+        if finished and not self.select_symbol():
             self.recordTime(self.dt_protocol_start, "MATCH")
             self.agent_print("######## Iteration completion ########")
             self.agent_print(f"[Server] finished iteration {self.current_iteration} at {currentTime + server_comp_delay}")
             self.agent_print(f"Total orders received {self.total_orders} and orders executed {self.executed_orders}")
-            self.current_iteration += 1
+            self.end_iteration()
 
-        self.setWakeup(currentTime + server_comp_delay + pd.Timedelta('1s'))
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('1s')))
 
 
     def reveal_orders(self, currentTime):
@@ -254,6 +217,14 @@ class ServiceAgent(Agent):
         After processing, go back to matching to proceed with the next set of orders.
         """
         dt_protocol_start = pd.Timestamp('now')
+        if self.match_time is not None and currentTime - self.match_time >= self.match_timeout:
+            # A client that did not reveal its status in time is treated as fake.
+            if self.current_buy_order_status is None:
+                self.evict_client(self.current_buy_order[0], 'match')
+                self.current_buy_order_status = False
+            if self.current_sell_order_status is None:
+                self.evict_client(self.current_sell_order[0], 'match')
+                self.current_sell_order_status = False
 
         # Ensure both buy and sell statuses are available
         if self.current_buy_order_status is not None and self.current_sell_order_status is not None:
@@ -264,8 +235,17 @@ class ServiceAgent(Agent):
                 # Both orders are real - execute the trade
                 if __debug__:
                     self.agent_print(f"Executing trade: Buy {self.current_buy_order} and Sell {self.current_sell_order}")
-                self.execute_match(self.current_buy_order, self.current_sell_order, self.current_buy_price, self.current_sell_price)
-                self.current_round = 3
+                if self.fused_reveal:
+                    # The identities came with the statuses: open them and settle right away.
+                    self.execute_match(self.current_buy_order, self.current_sell_order, self.current_buy_price,
+                                       self.current_sell_price, notice=True)
+                    self.complete_execution(self.open_identity(self.current_buy_order_identity),
+                                            self.open_identity(self.current_sell_order_identity))
+                else:
+                    self.current_execution = self.execute_match(self.current_buy_order, self.current_sell_order,
+                                                                self.current_buy_price, self.current_sell_price)
+                    self.execute_time = currentTime
+                    self.current_round = 3
 
             elif self.current_buy_order_status and not self.current_sell_order_status:
                 # Buy is real, but sell is fake
@@ -297,29 +277,39 @@ class ServiceAgent(Agent):
                 self.current_sell_order = None
                 self.current_round = 1
 
-        server_comp_delay = pd.Timestamp('now') - dt_protocol_start
-        self.setWakeup(currentTime + server_comp_delay + pd.Timedelta('3s'))
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('3s')))
 
-    def execute_match(self, buy_order, sell_order, current_buy_price, current_sell_price):
+    def execute_match(self, buy_order, sell_order, current_buy_price, current_sell_price, pair=None, notice=False):
+        """
+        Tell both clients their orders executed.  With notice the server already knows their
+        names (fused reveal) and the clients do not answer.  Returns the id of the execution.
+        """
         self.executed_orders += 2
-        buy_id = buy_order[0]
-        sell_id = sell_order[0]
-        self.sendMessage(buy_id,
-                     Message({"msg": "EXECUTE",
-                              "buy_order": buy_order,
-                              "sell_order": sell_order,
-                              "buy_price" : current_buy_price,
-                              "sell_price" : current_sell_price,
-                              "sender": 0}),
-                     tag="comm_output_server")
-        self.sendMessage(sell_id,
-                         Message({"msg": "EXECUTE",
-                                  "buy_order": buy_order,
-                                  "sell_order": sell_order,
-                                  "buy_price" : current_buy_price,
-                                  "sell_price" : current_sell_price,
-                                  "sender": 0}),
-                         tag="comm_output_server")
+        execution = self.next_execution
+        self.next_execution += 1
+        self.broadcastMessage((buy_order[0], sell_order[0]),
+                              SharedMessage({"msg": "EXECUTE",
+                                             "buy_order": buy_order,
+                                             "sell_order": sell_order,
+                                             "buy_price" : current_buy_price,
+                                             "sell_price" : current_sell_price,
+                                             "pair": pair,
+                                             "execution": execution,
+                                             "notice": notice,
+                                             "sender": 0}),
+                              tag="comm_output_server")
+        return execution
+
+    def cancel_execution(self, execution, buy_order, sell_order):
+        """
+        Tell both clients of an aborted execution that it did not happen, so a client that
+        already counted its fill takes it back.
+        """
+        self.executed_orders -= 2
+        self.broadcastMessage((buy_order[0], sell_order[0]),
+                              SharedMessage({"msg": "EXECUTE_ABORT", "execution": execution, "sender": 0}),
+                              tag="comm_output_server")
 
     def execute_orders(self, currentTime):
         """
@@ -330,81 +320,346 @@ class ServiceAgent(Agent):
         # Ensure both buy and sell order names are available
         dt_protocol_start = pd.Timestamp('now')
         if self.current_buy_order_name is not None and self.current_sell_order_name is not None:
-            buy_order_client = self.current_buy_order_name  # Client name for the buy order
-            sell_order_client = self.current_sell_order_name  # Client name for the sell order
-            buy_price = self.current_buy_price.price
-            sell_price = self.current_sell_price.price
-
-            # Create a tuple to store the executed order details
-            executed_order_tuple = (
-                "Buy", buy_order_client, buy_price,
-                "Sell", sell_order_client, sell_price
-            )
-
-            # Store the executed order details in an array
-            self.execute_user_orders.append(executed_order_tuple)
+            self.complete_execution(self.current_buy_order_name, self.current_sell_order_name)
+        elif self.execute_time is not None and currentTime - self.execute_time >= self.execute_timeout:
+            self.abort_execution()
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('3s')))
+
+    def complete_execution(self, buy_order_client, sell_order_client):
+        """
+        Record the trade of the current pair under the clients' names, take both orders off
+        the book and go back to matching.
+        """
+        buy_price = self.current_buy_price.price
+        sell_price = self.current_sell_price.price
+
+        # Create a tuple to store the executed order details
+        executed_order_tuple = (
+            "Buy", buy_order_client, buy_price,
+            "Sell", sell_order_client, sell_price
+        )
+
+        # Store the executed order details in an array
+        self.execute_user_orders.append(executed_order_tuple)
+        self.blotter.record(self.current_iteration, self.currentTime, self.current_buy_order[0],
+                            self.current_sell_order[0], buy_price, sell_price, self.currentTime - self.match_time)
+        self.charge('trade')
+        if __debug__:
+            self.agent_print(f"Order executed and stored: {executed_order_tuple}")
+        # Remove executed orders from both the buy and sell lists
+        if self.current_buy_price.orders:
+            self.current_buy_price.orders.popleft()
+        if self.current_sell_price.orders:
+            self.current_sell_price.orders.popleft()
+
+        # Reset order statuses
+        self.current_buy_order_status = None
+        self.current_sell_order_status = None
+        self.current_buy_order = None
+        self.current_sell_order = None
+        self.current_buy_order_name = None
+        self.current_sell_order_name = None
+        self.current_buy_order_identity = None
+        self.current_sell_order_identity = None
+        self.current_round = 1
+
+    def abort_execution(self):
+        """
+        A client of the current pair did not reveal its name in time: the trade is not
+        recorded, both clients are told to take it back and the silent clients are evicted.
+        The orders of the pair were not taken off the book yet, so a remaining counterparty
+        order is matched again from the head of its level.
+        """
+        if self.current_buy_order_name is None:
+            self.evict_client(self.current_buy_order[0], 'execute')
+        if self.current_sell_order_name is None:
+            self.evict_client(self.current_sell_order[0], 'execute')
+        self.cancel_execution(self.current_execution, self.current_buy_order, self.current_sell_order)
+        self.current_execution = None
+        self.current_buy_order_status = None
+        self.current_sell_order_status = None
+        self.current_buy_order = None
+        self.current_sell_order = None
+        self.current_buy_order_name = None
+        self.current_sell_order_name = None
+        self.current_round = 1
+
+    def open_identity(self, identity):
+        """
+        Fused reveal: decrypt a client identity sent with a MATCH status.  Only called once
+        both orders of the pair are known to be real.
+        """
+        self.charge('decrypt')
+        return self.aes.decrypt_from_key(self.server_key.d, identity)
+
+    def open_identities(self, identities):
+        """
+        open_identity for a whole window of pairs.  Each decryption is an elliptic-curve
+        multiplication, so with parallel_mode > 1 they are spread over a process pool.  The
+        cost model still charges every decryption: a parallel speedup is not simulated until
+        it is measured on a multi-core host.
+        """
+        if self.parallel_mode < 2 or len(identities) <= 2:
+            return [self.open_identity(identity) for identity in identities]
+        if self.executor is None:
+            self.executor = create_executor(self.parallel_mode)
+        chunksize = -(-len(identities) // self.parallel_mode)
+        self.charge('decrypt', len(identities))
+        return list(self.executor.map(self.aes.decrypt_from_key, repeat(int(self.server_key.d)), identities,
+                                      chunksize=chunksize))
+
+    # ======================== PIPELINED MATCHING ========================
+    def match_pipelined(self, currentTime):
+        """
+        Pipelined matching (pipeline_depth > 1): send MATCH for up to pipeline_depth disjoint
+        candidate pairs at once instead of one.  The pairs are the ones the one-pair protocol
+        would reach next if every order turned out real and it kept the same side_to_start,
+        so a window of real orders completes in the round trips of a single pair.
+        """
+        dt_protocol_start = pd.Timestamp('now')
+        side_to_start = self.choose_side()
+        pairs, self.trailing_levels = self.plan_pairs(side_to_start)
+        for buy_node, buy_order, sell_node, sell_order, dropped in pairs:
+            entry = {"pair": self.next_pair,
+                     "buy_node": buy_node, "buy_order": buy_order, "buy_status": None, "buy_name": None,
+                     "buy_identity": None,
+                     "sell_node": sell_node, "sell_order": sell_order, "sell_status": None, "sell_name": None,
+                     "sell_identity": None, "dropped": dropped, "matched_at": currentTime}
+            self.pipeline.append(entry)
+            self.pipeline_pairs[self.next_pair] = entry
+            self.broadcastMessage((buy_order[0], sell_order[0]),
+                                  SharedMessage({"msg": "MATCH",
+                                                 "buy_order": buy_order,
+                                                 "sell_order": sell_order,
+                                                 "pair": self.next_pair,
+                                                 "fused": self.fused_reveal,
+                                                 "sender": 0}),
+                                  tag="comm_output_server")
+            self.next_pair += 1
+
+        if not self.pipeline:
+            self.drop_levels(self.trailing_levels)
+            self.trailing_levels = []
+
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        if self.pipeline:
             if __debug__:
-                self.agent_print(f"Order executed and stored: {executed_order_tuple}")
-            # Remove executed orders from both the buy and sell lists
-            if self.current_buy_price.orders:
-                self.current_buy_price.orders.pop(0)
-            if self.current_sell_price.orders:
-                self.current_sell_price.orders.pop(0)
-
-            # Reset order statuses
-            self.current_buy_order_status = None
-            self.current_sell_order_status = None
-            self.current_buy_order = None
-            self.current_sell_order = None
-            self.current_round = 1
-        server_comp_delay = pd.Timestamp('now') - dt_protocol_start
-        self.setWakeup(currentTime + server_comp_delay + pd.Timedelta('3s'))
+                self.agent_print(f"Sent {len(self.pipeline)} candidate pairs")
+            self.current_round = 2
+        elif not self.select_symbol():
+            self.recordTime(self.dt_protocol_start, "MATCH")
+            self.agent_print("######## Iteration completion ########")
+            self.agent_print(f"[Server] finished iteration {self.current_iteration} at {currentTime + server_comp_delay}")
+            self.agent_print(f"Total orders received {self.total_orders} and orders executed {self.executed_orders}")
+            self.end_iteration()
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('1s')))
 
-    # ======================== UTIL ========================
-    def update_current_price(self, side):
-        if side == 'buy' and self.current_buy_price is not None and not self.current_buy_price.orders:
-            self.buy_list.remove_price(self.current_buy_price)
-            self.current_buy_price = self.buy_list.head if self.current_buy_order_origin == "head" else self.buy_list.tail
-        elif side == 'sell' and self.current_sell_price is not None and not self.current_sell_price.orders:
-            self.sell_list.remove_price(self.current_sell_price)
-            self.current_sell_price = self.sell_list.head if self.current_sell_order_origin == "head" else self.sell_list.tail
-
-    def handle_price_removal(self, side_to_start):
+    def plan_pairs(self, side_to_start):
+        """
+        The next pipeline_depth crossing pairs of the cursor walk of match_orders, without
+        executing them: the side_to_start list is walked from its head, the other from its
+        tail, and a tail level that does not cross the current head level is skipped.  The
+        book is not changed.  match_orders removes a skipped level (unless the book is
+        persistent) and the emptied levels it meets, but a skip is only decided on the
+        assumption that the earlier pairs are real: a fake order rolls them back and moves
+        the head back up, where the skipped level may cross.  So each pair carries the levels
+        dropped on the way to it, for drop_levels once every pair before it has committed.
+        Returns ([(buy_node, buy_order, sell_node, sell_order, dropped)], trailing), where
+        trailing are the levels dropped after the last pair.
+        """
         if side_to_start == "buy":
-            if __debug__:
-                self.agent_print(f"Removing sell price {self.current_sell_price.price} as it cannot be matched with buy price {self.current_buy_price.price}.")
-            next_sell = self.current_sell_price.prev
-            self.sell_list.remove_price(self.current_sell_price)
-            self.current_sell_price = next_sell
+            head_list, tail_list = self.buy_list, self.sell_list
         else:
-            if __debug__:
-                self.agent_print(f"Removing buy price {self.current_buy_price.price} as it cannot be matched with sell price {self.current_sell_price.price}.")
-            next_buy = self.current_buy_price.prev
-            self.buy_list.remove_price(self.current_buy_price)
-            self.current_buy_price = next_buy
+            head_list, tail_list = self.sell_list, self.buy_list
+        head_node, tail_node = head_list.head, tail_list.tail
+        head_orders = tail_orders = None
+        pairs = []
+        dropped = []  # (price_list, node, skipped) of the levels passed since the last pair
+        while len(pairs) < self.pipeline_depth and head_node is not None and tail_node is not None:
+            if not head_node.orders or not tail_node.orders:
+                if not head_node.orders:
+                    dropped.append((head_list, head_node, False))
+                    head_node, head_orders = head_node.next, None
+                else:
+                    dropped.append((tail_list, tail_node, False))
+                    tail_node, tail_orders = tail_node.prev, None
+                self.charge('level')
+                continue
+            buy_node, sell_node = (head_node, tail_node) if side_to_start == "buy" else (tail_node, head_node)
+            if buy_node.price < sell_node.price:
+                if not self.persistent_book:
+                    dropped.append((tail_list, tail_node, True))
+                tail_node, tail_orders = tail_node.prev, None
+                self.charge('level')
+                continue
+
+            if head_orders is None:
+                head_orders = iter(head_node.orders)
+            if tail_orders is None:
+                tail_orders = iter(tail_node.orders)
+            head_order = next(head_orders, None)
+            tail_order = next(tail_orders, None)
+            if head_order is None or tail_order is None:
+                # One level is used up by earlier pairs; the other order goes with the next level.
+                if head_order is None:
+                    head_node, head_orders = head_node.next, None
+                    if tail_order is not None:
+                        tail_orders = chain([tail_order], tail_orders)
+                else:
+                    tail_node, tail_orders = tail_node.prev, None
+                    head_orders = chain([head_order], head_orders)
+                continue
+            if side_to_start == "buy":
+                pairs.append((head_node, head_order, tail_node, tail_order, dropped))
+            else:
+                pairs.append((tail_node, tail_order, head_node, head_order, dropped))
+            dropped = []
+        return pairs, dropped
 
-    def remove_fake_orders(self, price_list, client_name):
+    def drop_levels(self, levels):
         """
-        Remove all fake orders from the specified price list for the given client.
+        Remove the levels plan_pairs passed, as match_orders would have: a skipped level with
+        its remaining orders, an emptied level only if nothing was placed in it since.  Levels
+        a purge already removed are left alone.
         """
-        current = price_list.head
-        while current:
-            current.orders = [order for order in current.orders if order[0] != client_name or order[1] is True]
-            current = current.next
-
-    def recordTime(self, startTime, categoryName):
-        # Accumulate into time log.
-        dt_protocol_end = pd.Timestamp('now')
-        if __debug__:
-            self.agent_print(f"Category name: {categoryName}, end time {dt_protocol_end}")
-        self.elapsed_time[categoryName] += dt_protocol_end - startTime
+        for price_list, node, skipped in levels:
+            if price_list.find(node.price) is node and (skipped or not node.orders):
+                price_list.remove_price(node)
 
-    def agent_print(*args, **kwargs):
+    def reveal_pipelined(self, currentTime):
+        """
+        Commit the revealed pairs in book order.  A pair of two real orders is executed: both
+        leave the book and the clients are asked for their names.  At the first pair with a
+        fake order the fake clients are purged and every later pair is rolled back, since the
+        purge may have changed which orders they should have been; their replies are dropped
+        and the next matching round plans again from the book.  Pairs behind one whose
+        statuses are still missing wait for the next wakeup.  Once every pair before it has
+        committed, the levels the plan dropped on the way to a pair are removed, whatever the
+        pair's own statuses; those behind the last pair once all of them executed.
         """
-        Custom print function that adds a [Server] header before printing.
+        dt_protocol_start = pd.Timestamp('now')
+        if self.pipeline and currentTime - self.pipeline[0]["matched_at"] >= self.match_timeout:
+            # Silent clients of the first pair count as fake, which also rolls back the rest.
+            for side in ("buy", "sell"):
+                if self.pipeline[0][side + "_status"] is None:
+                    self.evict_client(self.pipeline[0][side + "_order"][0], 'match')
+                    self.pipeline[0][side + "_status"] = False
+        while self.pipeline and self.pipeline[0]["buy_status"] is not None \
+                and self.pipeline[0]["sell_status"] is not None:
+            entry = self.pipeline.pop(0)
+            self.drop_levels(entry["dropped"])
+            if entry["buy_status"] and entry["sell_status"]:
+                for side in ("buy", "sell"):
+                    # Where the order was, to put it back if the execution is aborted.
+                    entry[side + "_position"] = entry[side + "_node"].orders.head_position()
+                    entry[side + "_node"].orders.popleft()
+                entry["execution"] = self.execute_match(entry["buy_order"], entry["sell_order"], entry["buy_node"],
+                                                        entry["sell_node"], entry["pair"], notice=self.fused_reveal)
+                self.executing.append(entry)
+                continue
 
-        Args:
-            *args: Any positional arguments that the built-in print function accepts.
-            **kwargs: Any keyword arguments that the built-in print function accepts.
+            if __debug__:
+                self.agent_print(f"Pair {entry['pair']} has a fake order; rolling back {len(self.pipeline)} later pairs")
+            del self.pipeline_pairs[entry["pair"]]
+            if not entry["buy_status"]:
+                self.remove_fake_orders(self.buy_list, entry["buy_order"][0])
+            if not entry["sell_status"]:
+                self.remove_fake_orders(self.sell_list, entry["sell_order"][0])
+            for later in self.pipeline:
+                del self.pipeline_pairs[later["pair"]]
+            self.pipeline = []
+            self.trailing_levels = []
+
+        if not self.pipeline:
+            self.drop_levels(self.trailing_levels)
+            self.trailing_levels = []
+            self.execute_time = currentTime
+            if self.fused_reveal:
+                # The names came with the statuses: open them all at once and record the trades now.
+                names = self.open_identities([entry[side + "_identity"] for entry in self.executing
+                                              for side in ("buy", "sell")])
+                for i, entry in enumerate(self.executing):
+                    entry["buy_name"], entry["sell_name"] = names[2 * i], names[2 * i + 1]
+                self.execute_pipelined(currentTime)
+                return
+            self.current_round = 3 if self.executing else 1
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('3s')))
+
+    def execute_pipelined(self, currentTime):
+        """
+        Record the executed pairs of the round, in book order, once every client has revealed
+        its name.
         """
-        print(*args, **kwargs)
+        dt_protocol_start = pd.Timestamp('now')
+        if self.executing and currentTime - self.execute_time >= self.execute_timeout:
+            self.abort_pipelined()
+        if all(entry["buy_name"] is not None and entry["sell_name"] is not None for entry in self.executing):
+            for entry in self.executing:
+                executed_order_tuple = ("Buy", entry["buy_name"], entry["buy_node"].price,
+                                        "Sell", entry["sell_name"], entry["sell_node"].price)
+                self.execute_user_orders.append(executed_order_tuple)
+                self.blotter.record(self.current_iteration, self.currentTime, entry["buy_order"][0],
+                                    entry["sell_order"][0], entry["buy_node"].price, entry["sell_node"].price,
+                                    self.currentTime - entry["matched_at"])
+                self.charge('trade')
+                del self.pipeline_pairs[entry["pair"]]
+                if __debug__:
+                    self.agent_print(f"Order executed and stored: {executed_order_tuple}")
+            self.executing = []
+            self.current_round = 1
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('3s')))
+
+    def abort_pipelined(self):
+        """
+        Give up on the executed pairs of the round that still miss a name: the trade is not
+        recorded, both clients are told to take it back and the silent clients are evicted.
+        Both orders already left the book in reveal_pipelined, so the order of a counterparty
+        that is still around is put back at its old place in its level, as in the one-pair
+        protocol (or on a new level, if its level was removed meanwhile).
+        """
+        for entry in [entry for entry in self.executing if entry["buy_name"] is None or entry["sell_name"] is None]:
+            for side in ("buy", "sell"):
+                if entry[side + "_name"] is None and entry[side + "_order"][0] not in self.evicted:
+                    self.evict_client(entry[side + "_order"][0], 'execute')
+            for side, price_list, order_type in (("buy", self.buy_list, 'B'), ("sell", self.sell_list, 'S')):
+                node = entry[side + "_node"]
+                if entry[side + "_order"][0] in self.evicted:
+                    continue
+                if price_list.find(node.price) is node:
+                    price_list.restore_order(node, entry[side + "_position"], entry[side + "_order"])
+                else:
+                    price_list.insert_or_update_node(node.price, order_type, entry[side + "_order"], self.next_handle)
+                    self.next_handle += 1
+            self.cancel_execution(entry["execution"], entry["buy_order"], entry["sell_order"])
+            self.executing.remove(entry)
+            del self.pipeline_pairs[entry["pair"]]
+
+    # ======================== UTIL ========================
+    def expected_replies(self):
+        """
+        Client replies the current round waits for: two per pair in flight, the statuses of the
+        pipeline in round 2 and the names of the executed pairs in round 3.
+        """
+        if self.current_round == 3:
+            return 2 * max(len(self.executing), 1)
+        return 2 * max(len(self.pipeline), 1)
+
+    def in_flight(self, side, node, position):
+        if super().in_flight(side, node, position):
+            return True
+        order = node.orders.at(position)
+        return any(entry[side + "_node"] is node and entry[side + "_order"] == order for entry in self.pipeline)
+
+    def end_iteration(self):
+        super().end_iteration()
+        self.current_buy_order_name = None
+        self.current_sell_order_name = None
+        self.current_buy_order_identity = None
+        self.current_sell_order_identity = None
+        self.pipeline = []
+        self.pipeline_pairs = {}
+        self.trailing_levels = []
+        self.executing = []
@@ -14,7 +14,8 @@ class ClientAgent(Agent):
     def __str__(self):
         return "[client]"
 
-    def __init__(self, id, name, type, random_state, iterations=1):
+    def __init__(self, id, name, type, random_state, iterations=1, cancel_prob=0.0, modify_prob=0.0,
+                 symbol=None, dropout_prob=0.0):
 
         # Set logger
         super().__init__(id, name, type, random_state)
@@ -42,9 +43,19 @@ class ClientAgent(Agent):
         self.current_iteration = 1
         self.current_base = 0
         self.sent_orders = False
+        self.last_price = None  # price of the previous batch, to re-quote in a persistent book
+        self.side = None
+        self.symbol = symbol  # instrument this client trades; None for the single default book
+        self.order_handles = set()  # handles of this client's resting orders, from ORDER_ACK
+        self.cancel_prob = cancel_prob  # chance to cancel each acknowledged order
+        self.modify_prob = modify_prob  # chance to reprice each acknowledged order
+        self.rejected_amendments = 0
+        self.dropout_prob = dropout_prob  # chance to go silent for the rest of the auction at each request
+        self.dropped = False
         self.order_status = {}
         self.total_orders = 0
         self.matched_orders = 0
+        self.executed_orders = 0
         self.dt_protocol_start = None
 
         # State flag
@@ -91,16 +102,42 @@ class ClientAgent(Agent):
 
         if msg.body['msg'] == "SEND_ORDERS":
             self.dt_protocol_start = pd.Timestamp('now')
+            if msg.body.get('iteration', self.current_iteration) > self.current_iteration:
+                # A new auction: send a fresh batch.
+                self.current_iteration = msg.body['iteration']
+                self.sent_orders = False
+                self.matched_orders = 0
+                self.dropped = False
             if not self.sent_orders:
                 self.send_orders(currentTime,msg.body['total'])
             self.recordTime(self.dt_protocol_start, 'PLACE')
             self.dt_protocol_start = pd.Timestamp('now')
 
+        elif msg.body['msg'] == "MATCH" and self.drop_out():
+            return
+
         elif msg.body['msg'] == "MATCH":
             self.match_orders(msg.body['buy_order'],msg.body['sell_order'])
             if (self.matched_orders == self.total_orders):
                 self.recordTime(self.dt_protocol_start, 'MATCH')
 
+        elif msg.body['msg'] == "EXECUTION_REPORT":
+            # Batch clearing: all of this client's fills arrive in one report.
+            self.executed_orders += len(msg.body['fills'])
+            self.recordTime(self.dt_protocol_start, 'MATCH')
+
+        elif msg.body['msg'] == "ORDER_ACK":
+            self.order_handles.discard(msg.body.get('replaces'))
+            self.order_handles.update(msg.body['handles'])
+            if 'replaces' not in msg.body:
+                self.amend_orders(msg.body['handles'])
+
+        elif msg.body['msg'] == "CANCEL_ACK":
+            self.order_handles.discard(msg.body['handle'])
+
+        elif msg.body['msg'] == "ORDER_REJECT":
+            self.rejected_amendments += 1
+
     ###################################
     # Round logics
     ###################################
@@ -115,16 +152,23 @@ class ClientAgent(Agent):
             buy_sell = 'S'
             price = price_sell
         client_name = self.name
+        tag = (self.symbol,) if self.symbol is not None else ()
         orders = []
         for order_id in range(0, num_real):
-            order = (price, buy_sell, (self.id, client_name, True))
+            order = (price, buy_sell, (self.id, client_name, True)) + tag
             orders.append(order)
         self.total_orders = len(orders)
+        self.side = buy_sell
+        # A changed price withdraws whatever is still resting from earlier batches.
+        cancel = self.last_price is not None and self.last_price != price
+        self.last_price = price
         # Send the orders to the server
         self.sendMessage(self.serviceAgentID,
                          Message({"msg": "ORDER",
+                                  "sender": self.id,
                                   "iteration": self.current_iteration,
                                   "orders": orders,
+                                  "cancel": cancel,
                                   }),
                          tag="comm_order_generation")
         self.sent_orders = True
@@ -139,6 +183,7 @@ class ClientAgent(Agent):
                                  "iteration": self.current_iteration,
                                  "order": order,
                                  "type" : type,
+                                 "sender": self.id,
                                  "status": status  # Return the actual status of the order
                              }),
                              tag="comm_order_match")
@@ -151,6 +196,38 @@ class ClientAgent(Agent):
             send_execution_message(order2,"sell")
             self.matched_orders += 1
 
+    def amend_orders(self, handles):
+        """
+        Cancel or reprice a random share of freshly acknowledged orders, to generate cancel and
+        modify traffic.  A repriced order moves one tick away from the batch price.  Draws
+        nothing unless amendments are enabled, so runs without them keep their random stream.
+        """
+        if not self.cancel_prob and not self.modify_prob:
+            return
+        for handle in handles:
+            draw = self.random_state.rand()
+            if draw < self.cancel_prob:
+                body = {"msg": "CANCEL"}
+            elif draw < self.cancel_prob + self.modify_prob:
+                body = {"msg": "MODIFY", "price": self.last_price + int(self.random_state.choice([-1, 1]))}
+            else:
+                continue
+            body.update({"sender": self.id,
+                         "iteration": self.current_iteration,
+                         "handle": handle,
+                         "side": self.side,
+                         "symbol": self.symbol if self.symbol is not None else ""})
+            self.sendMessage(self.serviceAgentID, Message(body), tag="comm_order_amend")
+
+    def drop_out(self):
+        """
+        Whether the client ignores this request: once it drops out it stays silent until the
+        next auction asks for orders.
+        """
+        if not self.dropped and self.dropout_prob and self.random_state.rand() < self.dropout_prob:
+            self.dropped = True
+        return self.dropped
+
     # ======================== UTIL ========================
 
     def recordTime(self, startTime, categoryName):
@@ -1,12 +1,10 @@
-from agent.Agent import Agent
-from message.Message import Message
-import logging
+from agent.AuctionServiceAgent import AuctionServiceAgent
+from message.Message import Message, SharedMessage
 import pandas as pd
-import random
-from model.MatchingModel import BucketList, create_sorted_lists
-from util import util
+from model.SymbolModel import clear_symbols
+from util import param
 
-class ServiceAgent(Agent):
+class ServiceAgent(AuctionServiceAgent):
     def __init__(self, id, name, type,
                  random_state=None,
                  msg_fwd_delay=1000000,
@@ -15,51 +13,51 @@ class ServiceAgent(Agent):
                  num_clients=10,
                  parallel_mode=1,
                  debug_mode=0,
+                 book_engine="bucket",
+                 tick_ladder=(0, 1, 1024),
+                 persistent_book=False,
+                 order_quorum=1.0,
+                 order_deadline=None,
+                 max_poll_interval=pd.Timedelta("16s"),
+                 stream_orders=False,
+                 order_acks=False,
+                 snapshot_dir=None,
+                 warm_start=None,
+                 blotter_dir=None,
+                 blotter_chunk=65536,
+                 clearing_mode="continuous",
+                 cost_model=None,
+                 match_timeout=param.wt_auction_match,
+                 wait_times=None,
                  users={}):
 
-        # Base class init.
-        super().__init__(id, name, type, random_state)
-
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-
-        if debug_mode:
-            logging.basicConfig()
+        # Base class init: the order intake, book and iteration state.
+        super().__init__(id, name, type, random_state,
+                         msg_fwd_delay=msg_fwd_delay,
+                         round_time=round_time,
+                         iterations=iterations,
+                         num_clients=num_clients,
+                         parallel_mode=parallel_mode,
+                         debug_mode=debug_mode,
+                         book_engine=book_engine,
+                         tick_ladder=tick_ladder,
+                         persistent_book=persistent_book,
+                         order_quorum=order_quorum,
+                         order_deadline=order_deadline,
+                         max_poll_interval=max_poll_interval,
+                         stream_orders=stream_orders,
+                         order_acks=order_acks,
+                         snapshot_dir=snapshot_dir,
+                         warm_start=warm_start,
+                         blotter_dir=blotter_dir,
+                         blotter_chunk=blotter_chunk,
+                         cost_model=cost_model,
+                         match_timeout=match_timeout,
+                         wait_times=wait_times,
+                         users=users)
 
         # System parameters.
-        self.msg_fwd_delay = msg_fwd_delay  # time to forward a peer-to-peer client relay message
-        self.round_time = round_time        # default waiting time per round
-        self.no_of_iterations = iterations  # number of iterations
-        self.parallel_mode = parallel_mode  # parallel
-
-        # Input parameters.
-        self.num_clients = num_clients      # number of users per training round
-        self.users = users   # the list of user IDs
-        # Read keys.
-        self.server_key = util.read_key("pki_files/server_key.pem")
-        self.system_sk = util.read_sk("pki_files/system_pk.pem")
-
-        # agent accumulation of elapsed times by category of tasks
-        self.elapsed_time = {'PLACE': pd.Timedelta(0),
-                             'MATCH': pd.Timedelta(0),
-                             }
-
-        self.current_iteration = 1  # Single iteration
-        self.current_round = 0
-        self.recv_user_orders = []
-        self.buy_list = BucketList()
-        self.sell_list = BucketList()
-        self.total_orders = 0
-        self.executed_orders = 0
-        self.current_buy_price = None
-        self.current_sell_price = None
-        self.current_buy_order = None
-        self.current_sell_order = None
-        self.current_buy_order_status = None
-        self.current_sell_order_status = None
-        self.clients_sent_orders = 0  # Track clients who have sent their orders
-        self.dt_protocol_start = None
-        self.execute_user_orders = []
+        self.clearing_mode = clearing_mode  # "continuous" pair-by-pair matching or one "batch" clearing
 
         # Map the message processing functions
         self.aggProcessingMap = {
@@ -74,110 +72,32 @@ class ServiceAgent(Agent):
             2: "execute orders",
         }
 
-    def kernelStarting(self, startTime):
-
-        if __debug__:
-            self.agent_print(f"Initialize: {self.dt_protocol_start}")
-        self.kernel.custom_state['srv_place'] = pd.Timedelta(0)
-        self.kernel.custom_state['srv_match'] = pd.Timedelta(0)
-
-        self.setComputationDelay(0)
-        super().kernelStarting(startTime)
-
-    def kernelStopping(self):
-        self.kernel.custom_state['srv_place'] += (
-                self.elapsed_time['PLACE'] / self.no_of_iterations)
-        self.kernel.custom_state['srv_match'] += (
-                self.elapsed_time['MATCH'] / self.no_of_iterations)
-
-        super().kernelStopping()
-
-    def wakeup(self, currentTime):
-        """
-        The wakeup function is called at the end of each round to execute
-        the appropriate function based on the current round (initialize, match, or execute).
-        """
-        super().wakeup(currentTime)
-
-        # Check if we should process based on the current round
-        if self.current_iteration <= self.no_of_iterations and self.current_round < len(self.aggProcessingMap):
-            if __debug__:
-                self.agent_print(f"wakeup in iteration {self.current_iteration} at function {self.namedict[self.current_round]}; current time is {currentTime}")
-            self.aggProcessingMap[self.current_round](currentTime)
-        else:
-            if __debug__:
-                self.agent_print("All orders processed.")
-            self.kernelStopping()  # End simulation when all orders are processed
-
-    def receiveMessage(self, currentTime, msg):
-        """Receive client messages (ORDER)."""
-        super().receiveMessage(currentTime, msg)
-
-        if msg.body['msg'] == "ORDER":
-            new_orders = msg.body['orders']
-            self.recv_user_orders.extend(new_orders) # Store received orders
-            self.clients_sent_orders += 1
-            if self.clients_sent_orders == self.num_clients:
-                self.setWakeup(currentTime + pd.Timedelta('1s'))  # Proceed to matching quickly
-            if __debug__:
-                self.logger.info(f"Received order from client at {currentTime}")
-        elif msg.body['msg'] == "MATCH":
-            type = msg.body['type']
+    def receive_reply(self, currentTime, body):
+        """Receive client replies (MATCH)."""
+        if body['msg'] == "MATCH":
+            type = body['type']
+            if body.get('sender') in self.evicted or \
+                    body['order'] != (self.current_buy_order if type == "buy" else self.current_sell_order):
+                return  # late reply of an evicted client, or for a pair given up on
+            self.observe_reply(currentTime, self.match_time)
             if type == "buy":
-                self.current_buy_order_status = msg.body['status']
+                self.current_buy_order_status = body['status']
             elif type == "sell":
-                self.current_sell_order_status = msg.body['status']
+                self.current_sell_order_status = body['status']
             if __debug__:
-                self.agent_print(f"Received match from client {msg.body['order']} {msg.body['type']} {msg.body['status']}")
-
-    def initialize(self, currentTime):
-        """
-        This is the first phase where the server expects to receive all orders from clients.
-        Once all orders are received, the server sorts them and moves to the matching phase.
-        """
-        # Initialize custom state properties
-        if self.clients_sent_orders < self.num_clients:
-            if __debug__:
-                self.agent_print(f"Waiting for orders from clients. Received from {self.clients_sent_orders} out of {self.num_clients}")
-            for user_id in self.users:
-                self.sendMessage(user_id,
-                                 Message({"msg": "SEND_ORDERS",  # Message requesting orders
-                                          "sender": self.id,
-                                          "total": self.num_clients}),
-                                 tag="comm_output_server")
-
-            # Wait for the next wakeup to check if orders have been received
-            self.setWakeup(currentTime + pd.Timedelta('1s'))  # Adjust timing as necessary
-            self.dt_protocol_start = pd.Timestamp('now')
-        else:
-            # Orders received, sort them and move to the matching phase
-            self.recordTime(self.dt_protocol_start, "PLACE")
-            self.total_orders = len(self.recv_user_orders)
-            self.buy_list, self.sell_list = create_sorted_lists(self.recv_user_orders)
-            if __debug__:
-                self.agent_print("Buy Orders:")
-                current = self.buy_list.head
-                while current:
-                    print(f"Price: {current.price}, Orders: {current.orders}")
-                    current = current.next
-
-                # Iterate through the sell list
-                print("Sell Orders:")
-                current = self.sell_list.head
-                while current:
-                    print(f"Price: {current.price}, Orders: {current.orders}")
-                    current = current.next
-
-            self.current_round = 1  # Move to matching round
-            self.setWakeup(currentTime + pd.Timedelta('1s'))
-            self.dt_protocol_start = pd.Timestamp('now')
+                self.agent_print(f"Received match from client {body['order']} {body['type']} {body['status']}")
 
     def match_orders(self, currentTime):
+        if self.clearing_mode == "batch":
+            self.clear_orders(currentTime)
+            return
+
         dt_protocol_start = pd.Timestamp('now')
-        side_to_start = random.choice(["buy", "sell"])
 
-        # Initialize buy and sell prices based on starting side
+        # Initialize buy and sell prices based on starting side; the origins stay fixed until
+        # both current orders are gone.
         if self.current_sell_order is None and self.current_buy_order is None:
+            side_to_start = self.choose_side()
             if side_to_start == "buy":
                 self.current_buy_price = self.buy_list.head
                 self.current_buy_order_origin = "head"
@@ -188,12 +108,19 @@ class ServiceAgent(Agent):
                 self.current_buy_order_origin = "tail"
                 self.current_sell_price = self.sell_list.head
                 self.current_sell_order_origin = "head"
+            if self.persistent_book:
+                self.skip_resting_levels()
 
         # Handle current price orders
         self.update_current_price('buy')
         self.update_current_price('sell')
 
         while self.current_buy_price and self.current_sell_price:
+            if not self.current_buy_price.orders or not self.current_sell_price.orders:
+                # A purge or cancel emptied a level the cursor has reached.
+                self.update_current_price('buy')
+                self.update_current_price('sell')
+                continue
             if __debug__:
                 self.agent_print(f"Buy Price {self.current_buy_price.price} and Sell Price {self.current_sell_price.price}")
             self.current_buy_order = self.current_buy_price.orders[0]
@@ -204,25 +131,75 @@ class ServiceAgent(Agent):
 
             # Check for valid price matching
             if self.current_buy_price.price >= self.current_sell_price.price:
-                buy_id = self.current_buy_order[0]
-                sell_id = self.current_sell_order[0]
-                self.sendMessage(buy_id, Message({"msg": "MATCH", "buy_order": self.current_buy_order, "sell_order": self.current_sell_order, "sender": 0}), tag="comm_output_server")
-                self.sendMessage(sell_id, Message({"msg": "MATCH", "buy_order": self.current_buy_order, "sell_order": self.current_sell_order, "sender": 0}), tag="comm_output_server")
+                self.broadcastMessage((self.current_buy_order[0], self.current_sell_order[0]),
+                                      SharedMessage({"msg": "MATCH", "buy_order": self.current_buy_order, "sell_order": self.current_sell_order, "sender": 0}),
+                                      tag="comm_output_server")
+                if self.match_time is None:  # MATCH is repeated until both statuses are in
+                    self.match_time = currentTime
                 self.current_round = 2
                 break
 
-            self.handle_price_removal(side_to_start)
+            self.discard_non_crossing()
 
-        server_comp_delay = pd.Timestamp('now') - dt_protocol_start
-        if not self.buy_list.head or not self.sell_list.head:
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        if self.persistent_book:
+            # The book is not emptied; the auction is over once no crossing pair is left.
+            finished = not self.current_buy_price or not self.current_sell_price
+        else:
+            finished = not self.buy_list.head or not self.sell_list.head
+        if finished and not self.select_symbol():
             self.recordTime(self.dt_protocol_start, "MATCH")
             self.agent_print("######## Iteration completion ########")
             self.agent_print(f"[Server] finished iteration {self.current_iteration} at {currentTime + server_comp_delay}")
             self.agent_print(f"Total orders received {self.total_orders} and orders executed {self.executed_orders}")
-            self.current_iteration += 1
+            self.end_iteration()
+
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('1s')))
 
-        self.setWakeup(currentTime + server_comp_delay + pd.Timedelta('1s'))
 
+    def clear_orders(self, currentTime):
+        """
+        Batch clearing mode: every status is plaintext True, so the whole book is cleared in
+        one uniform-price auction without per-pair client round trips.  Each client then gets
+        a single execution report listing all of its fills.  Every symbol clears on its own.
+        """
+        dt_protocol_start = pd.Timestamp('now')
+        results = clear_symbols(self.books)
+
+        reports = {}
+        for symbol, clearing_price, buy_orders, sell_orders in results:
+            for buy_order, sell_order in zip(buy_orders, sell_orders):
+                self.execute_user_orders.append(("Buy", buy_order[1], clearing_price,
+                                                 "Sell", sell_order[1], clearing_price))
+                self.blotter.record(self.current_iteration, currentTime, buy_order[0], sell_order[0],
+                                    clearing_price, clearing_price)
+                reports.setdefault((buy_order[0], symbol), []).append(("buy", clearing_price))
+                reports.setdefault((sell_order[0], symbol), []).append(("sell", clearing_price))
+            self.executed_orders += len(buy_orders) + len(sell_orders)
+            self.charge('trade', len(buy_orders))
+
+        for (client_id, symbol), fills in reports.items():
+            self.sendMessage(client_id,
+                             Message({"msg": "EXECUTION_REPORT",
+                                      "symbol": symbol,
+                                      "price": fills[0][1],
+                                      "fills": fills,
+                                      "sender": 0}),
+                             tag="comm_output_server")
+
+        server_comp_delay = self.compute_delay(dt_protocol_start)
+        self.recordTime(self.dt_protocol_start, "MATCH")
+        self.agent_print("######## Iteration completion ########")
+        self.agent_print(f"[Server] finished iteration {self.current_iteration} at {currentTime + server_comp_delay}")
+        if len(results) == 1:
+            self.agent_print(f"Cleared at price {results[0][1]}")
+        else:
+            crossed = sum(1 for result in results if result[1] is not None)
+            self.agent_print(f"Cleared {crossed} of {len(results)} symbols")
+        self.agent_print(f"Total orders received {self.total_orders} and orders executed {self.executed_orders}")
+        self.end_iteration()
+
+        self.setWakeup(currentTime + server_comp_delay + self.round_wait(pd.Timedelta('1s')))
 
     def execute_orders(self, currentTime):
         """
@@ -241,13 +218,26 @@ class ServiceAgent(Agent):
 
                 # Remove executed orders from both the buy and sell lists
                 if self.current_buy_price.orders:
-                    self.current_buy_price.orders.pop(0)
+                    self.current_buy_price.orders.popleft()
                 if self.current_sell_price.orders:
-                    self.current_sell_price.orders.pop(0)
+                    self.current_sell_price.orders.popleft()
                 self.current_buy_order_status = None
                 self.current_sell_order_status = None
                 self.current_buy_order = None
                 self.current_sell_order = None
+                self.match_time = None
+
+        elif self.match_time is not None and currentTime - self.match_time >= self.match_timeout:
+            # Silent clients are evicted; a counterparty that answered is matched again.
+            if self.current_buy_order_status is None:
+                self.evict_client(self.current_buy_order[0], 'match')
+            if self.current_sell_order_status is None:
+                self.evict_client(self.current_sell_order[0], 'match')
+            self.current_buy_order_status = None
+            self.current_sell_order_status = None
+            self.current_buy_order = None
+            self.current_sell_order = None
+            self.match_time = None
 
         # Once the current pair is processed, move back to matching
         self.match_orders(currentTime)
@@ -267,52 +257,6 @@ class ServiceAgent(Agent):
 
         # Store the executed order details in an array
         self.execute_user_orders.append(executed_order_tuple)
-
-    # ======================== UTIL ========================
-    def update_current_price(self, side):
-        if side == 'buy' and self.current_buy_price is not None and not self.current_buy_price.orders:
-            self.buy_list.remove_price(self.current_buy_price)
-            self.current_buy_price = self.buy_list.head if self.current_buy_order_origin == "head" else self.buy_list.tail
-        elif side == 'sell' and self.current_sell_price is not None and not self.current_sell_price.orders:
-            self.sell_list.remove_price(self.current_sell_price)
-            self.current_sell_price = self.sell_list.head if self.current_sell_order_origin == "head" else self.sell_list.tail
-
-    def handle_price_removal(self, side_to_start):
-        if side_to_start == "buy":
-            if __debug__:
-                self.agent_print(f"Removing sell price {self.current_sell_price.price} as it cannot be matched with buy price {self.current_buy_price.price}.")
-            next_sell = self.current_sell_price.prev
-            self.sell_list.remove_price(self.current_sell_price)
-            self.current_sell_price = next_sell
-        else:
-            if __debug__:
-                self.agent_print(f"Removing buy price {self.current_buy_price.price} as it cannot be matched with sell price {self.current_sell_price.price}.")
-            next_buy = self.current_buy_price.prev
-            self.buy_list.remove_price(self.current_buy_price)
-            self.current_buy_price = next_buy
-
-    def remove_fake_orders(self, price_list, client_name):
-        """
-        Remove all fake orders from the specified price list for the given client.
-        """
-        current = price_list.head
-        while current:
-            current.orders = [order for order in current.orders if order[0] != client_name or order[1] is True]
-            current = current.next
-
-    def recordTime(self, startTime, categoryName):
-        # Accumulate into time log.
-        dt_protocol_end = pd.Timestamp('now')
-        if __debug__:
-            self.agent_print(f"Category name: {categoryName}, end time {dt_protocol_end}")
-        self.elapsed_time[categoryName] += dt_protocol_end - startTime
-
-    def agent_print(*args, **kwargs):
-        """
-        Custom print function that adds a [Server] header before printing.
-
-        Args:
-            *args: Any positional arguments that the built-in print function accepts.
-            **kwargs: Any keyword arguments that the built-in print function accepts.
-        """
-        print(*args, **kwargs)
+        self.blotter.record(self.current_iteration, self.currentTime, buy_order[0], sell_order[0],
+                            buy_price, sell_price, self.currentTime - self.match_time)
+        self.charge('trade')
@@ -0,0 +1,11 @@
+"""
+Standalone benchmarks of the server-side order book, run without the simulation Kernel.
+
+orders.py generates synthetic IDP-style order batches, driver.py runs the real ServiceAgent
+on them with an oracle in place of the clients, differential.py checks book engines and
+protocols against a reference, and run.py times book build, matching to completion and
+fake-order purges, and saves or checks JSON baselines:
+
+    python -m bench.run --sizes 1000 100000 --save baseline.json
+    python -m bench.run --check baseline.json
+"""
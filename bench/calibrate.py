@@ -0,0 +1,121 @@
+import argparse
+import platform
+import sys
+import time
+from collections import deque
+
+import pandas as pd
+
+from bench.orders import generate_orders
+from message.Message import Message
+from model.CostModel import OPERATIONS, CostModel
+from model.SymbolModel import SymbolBooks
+from util import util
+from util.aes import aes
+
+def best_of(repeat, setup, count):
+    """
+    Best wall time per operation, in nanoseconds, over `repeat` runs of the callable that
+    setup() returns; each run performs `count` operations.  Setup is not timed.
+    """
+    times = []
+    for _ in range(repeat):
+        run = setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times) / count * 1e9
+
+def calibrate_insert(size, engine, tick_ladder, repeat):
+    order_set = generate_orders(size)
+    return best_of(repeat, lambda: lambda: SymbolBooks(engine, tick_ladder).build(order_set.orders),
+                   len(order_set))
+
+def calibrate_level(size, engine, tick_ladder, repeat):
+    # One order per level, so removing the levels dominates.
+    order_set = generate_orders(size, orders_per_client=1, real_range=(1, 1), spread=size)
+
+    def setup():
+        buy_list, sell_list = SymbolBooks(engine, tick_ladder).create_lists(order_set.orders)
+
+        def run():
+            for price_list in (buy_list, sell_list):
+                while price_list.head is not None:
+                    price_list.remove_price(price_list.head)
+        return run
+    levels = len({(order[0], order[1]) for order in order_set.orders})
+    return best_of(repeat, setup, levels)
+
+def calibrate_purge(size, engine, tick_ladder, repeat):
+    order_set = generate_orders(size, real_range=(0, 0))
+
+    def setup():
+        books = SymbolBooks(engine, tick_ladder)
+        books.build(order_set.orders)
+        clients = order_set.fake_clients()
+        return lambda: [books.remove_client_orders(client_id) for client_id in clients]
+    return best_of(repeat, setup, len(order_set))
+
+def calibrate_decrypt(count, repeat):
+    cipher = aes()
+    key = util.read_key("pki_files/server_key.pem")
+    identities = [cipher.encrypt_to_key(key.pointQ, "client %d" % i) for i in range(count)]
+    return best_of(repeat, lambda: lambda: [cipher.decrypt_from_key(key.d, identity) for identity in identities],
+                   count)
+
+def calibrate_message(count, repeat):
+    order = (1, "name", "status")
+    return best_of(repeat, lambda: lambda: [Message({"msg": "MATCH", "buy_order": order, "sell_order": order,
+                                                     "sender": 0}) for _ in range(count)],
+                   count)
+
+def calibrate_trade(count, repeat):
+    def setup():
+        buy_orders, sell_orders, trades = deque(range(count)), deque(range(count)), []
+
+        def run():
+            for _ in range(count):
+                trades.append(("Buy", buy_orders.popleft(), 100, "Sell", sell_orders.popleft(), 99))
+        return run
+    return best_of(repeat, setup, count)
+
+def calibrate_step(count, repeat):
+    # The bookkeeping of a wakeup that does no protocol work: timestamps and the next wakeup.
+    now = pd.Timestamp('2020-01-01')
+    return best_of(repeat, lambda: lambda: [now + pd.Timedelta(0) + pd.Timedelta('1s') for _ in range(count)],
+                   count)
+
+def calibrate(size=100000, engine='bucket', tick_ladder=(0, 1, 1024), repeat=3):
+    """
+    Measure the cost of every CostModel operation on this host.  Returns the costs in
+    nanoseconds.
+    """
+    return {'step': calibrate_step(size // 10, repeat),
+            'insert': calibrate_insert(size, engine, tick_ladder, repeat),
+            'level': calibrate_level(size // 10, engine, tick_ladder, repeat),
+            'purge': calibrate_purge(size, engine, tick_ladder, repeat),
+            'decrypt': calibrate_decrypt(max(size // 1000, 10), repeat),
+            'message': calibrate_message(size // 10, repeat),
+            'trade': calibrate_trade(size, repeat)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate the server compute cost model on this host')
+    parser.add_argument('--size', type=float, default=1e5, help='Orders per measurement')
+    parser.add_argument('--book_engine', default='bucket', choices=['bucket', 'tick', 'columnar'])
+    parser.add_argument('--tick_ladder', type=int, nargs=3, default=[0, 1, 1024],
+                        metavar=('MIN', 'TICK', 'TICKS'))
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per operation (best is kept)')
+    parser.add_argument('--save', default='cost_model.json', help='Calibration file to write')
+    args = parser.parse_args(argv)
+
+    costs = calibrate(int(args.size), args.book_engine, tuple(args.tick_ladder), args.repeat)
+    for operation in OPERATIONS:
+        print(f"{operation:>8} {costs[operation]:>14,.0f} ns")
+    CostModel({operation: round(cost) for operation, cost in costs.items()}).save(
+        args.save, python=platform.python_version(), platform=platform.platform(),
+        book_engine=args.book_engine, size=int(args.size), date=str(pd.Timestamp('now')))
+    print(f"Saved to {args.save}; select it with --cost_model {args.save}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
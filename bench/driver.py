@@ -0,0 +1,165 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+import pandas as pd
+
+from agent.idp_auction.ServiceAgent import ServiceAgent
+from agent.non_private_auction.ServiceAgent import ServiceAgent as NonPrivateServiceAgent
+from message.Message import Message
+from util import util
+
+PROTOCOLS = ("one-pair", "pipelined", "fused", "batch")
+
+class BenchKernel:
+    """
+    The part of the Kernel a ServiceAgent talks to: sent messages are queued for the driver
+    and the last wakeup request is kept.  No latency or compute delay is simulated.
+    """
+    def __init__(self):
+        self.outbox = []
+        self.wakeup = None
+        self.custom_state = {}
+
+    def sendMessage(self, sender, recipient, msg, delay=0, tag="communication"):
+        self.outbox.append((recipient, msg))
+
+    def setWakeup(self, sender, requestedTime):
+        self.wakeup = requestedTime
+
+    def setAgentComputeDelay(self, sender=None, requestedDelay=0):
+        pass
+
+    def fmtTime(self, simulationTime):
+        return simulationTime
+
+class AuctionDriver:
+    """
+    One auction of the real ServiceAgent on a given book, without the Kernel: the agent's
+    round functions are called in turn, and the driver answers its MATCH and EXECUTE requests
+    for the clients.  is_real(details) is the status a client reveals for an order and the
+    order's name ciphertext stands for the client's name.
+
+    protocol is "one-pair" (match_orders of the IDP agent), "pipelined" (pipeline_depth
+    candidate pairs per round), "fused" (pipelined, with identities sent along with the
+    statuses) or "batch" (uniform-price clearing of the non-private agent).  side_to_start
+    fixes the side every fresh cursor walk starts from; None draws it from a random.Random
+    seeded with seed, as the agent does from the random module.
+    """
+    pipeline_depth = 4
+
+    def __init__(self, buy_list, sell_list, is_real, seed=0, protocol="one-pair", side_to_start=None):
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown protocol {protocol!r}, expected one of {', '.join(PROTOCOLS)}.")
+        self.buy_list = buy_list
+        self.sell_list = sell_list
+        self.is_real = is_real
+        self.protocol = protocol
+
+        kwargs = dict(random_state=np.random.RandomState(seed), users=[], num_clients=1)
+        if protocol == "batch":
+            self.agent = NonPrivateServiceAgent(0, "Service Agent", "ServiceAgent", clearing_mode="batch", **kwargs)
+        else:
+            self.agent = ServiceAgent(0, "Service Agent", "ServiceAgent",
+                                      pipeline_depth=1 if protocol == "one-pair" else self.pipeline_depth,
+                                      fused_reveal=protocol == "fused", **kwargs)
+        if side_to_start is None:
+            rng = random.Random(seed)
+            self.agent.choose_side = lambda: rng.choice(["buy", "sell"])
+        else:
+            self.agent.choose_side = lambda: side_to_start
+        self.kernel = self.agent.kernel = BenchKernel()
+        self.agent.books.books[""] = (buy_list, sell_list)
+        self.agent.symbol_queue = [""]
+        self.agent.select_symbol()
+        self.agent.current_round = 1
+        self.agent.dt_protocol_start = pd.Timestamp("now")
+
+        self.executed = self.agent.execute_user_orders  # end_iteration starts a new list
+        self.identities = {}  # name -> identity encrypted to the server key, for the fused reveal
+        self.rounds = 0
+
+    def run(self):
+        """
+        Run rounds until the auction ends.  A matching round that sends nothing and does not
+        end the iteration leaves the agent waking up without progress, so it ends the run too.
+        Returns the executed trades as the agent recorded them.
+        """
+        currentTime = pd.Timestamp(0)
+        step = pd.Timedelta("1s")
+        silent_mode, util.silent_mode = util.silent_mode, True  # as the configs run the Kernel
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                while self.agent.current_iteration == 1:
+                    self.rounds += 1
+                    current_round = self.agent.current_round
+                    self.agent.currentTime = currentTime
+                    self.agent.aggProcessingMap[current_round](currentTime)
+                    outbox, self.kernel.outbox = self.kernel.outbox, []
+                    if current_round == 1 and not outbox and self.agent.current_iteration == 1:
+                        break
+                    currentTime += step
+                    for body in self.replies(outbox):
+                        self.agent.receiveMessage(currentTime, Message(body))
+        finally:
+            util.silent_mode = silent_mode
+        return self.executed
+
+    def replies(self, outbox):
+        """
+        The answers of the clients to the messages the agent sent.  A broadcast is one
+        message to both clients of a pair, so it is answered once for each side.
+        """
+        answered = set()
+        for recipient, msg in outbox:
+            body = msg.body
+            if id(body) in answered or body['msg'] not in ("MATCH", "EXECUTE"):
+                continue
+            answered.add(id(body))
+            for side in ("buy", "sell"):
+                order = body[side + "_order"]
+                if body['msg'] == "MATCH":
+                    status = bool(self.is_real(order))
+                    yield {"msg": "MATCH", "iteration": 1, "order": order, "type": side,
+                           "pair": body.get('pair'), "sender": order[0], "status": status,
+                           "identity": self.identity(order[1]) if body.get('fused') and status else None}
+                elif not body.get('notice'):
+                    yield {"msg": "EXECUTE", "iteration": 1, "name": order[1], "type": side,
+                           "price": body[side + "_price"], "pair": body.get('pair'), "sender": order[0],
+                           "status": True}
+
+    def identity(self, name):
+        if name not in self.identities:
+            self.identities[name] = self.agent.aes.encrypt_to_key(self.agent.server_key.pointQ, name)
+        return self.identities[name]
+
+def clear_reference(buy_list, sell_list):
+    """
+    Uniform-price clearing written out order by order, as the frozen reference of the batch
+    protocol: every price in the book is tried, the one with the most executed orders wins,
+    then the smallest imbalance, then the lowest price.  The best orders of each side in
+    priority order execute at it.  Returns the trades as the agent records them.
+    """
+    bids = [(node.price, order) for node in buy_list for order in node.orders]
+    asks = [(node.price, order) for node in sell_list for order in node.orders]
+    best = None
+    for price in sorted({price for price, order in bids + asks}):
+        demand = sum(1 for bid, order in bids if bid >= price)
+        supply = sum(1 for ask, order in asks if ask <= price)
+        key = (-min(demand, supply), abs(demand - supply), price)
+        if best is None or key < best:
+            best = key
+    if best is None or best[0] == 0:
+        return []
+    volume, price = -best[0], best[2]
+    for price_list in (buy_list, sell_list):
+        taken = 0
+        while taken < volume:
+            node = price_list.head
+            if node.orders:
+                node.orders.popleft()
+                taken += 1
+            if not node.orders:
+                price_list.remove_price(node)
+    return [("Buy", bid[1], price, "Sell", ask[1], price) for (_, bid), (_, ask) in zip(bids[:volume], asks[:volume])]
@@ -0,0 +1,94 @@
+import numpy as np
+
+from model.SnapshotModel import read_snapshot, snapshot_orders
+from model.SymbolModel import order_symbol
+
+class OrderSet:
+    """
+    A synthetic batch of IDP-style orders and the ground truth the clients would reveal.
+
+    Like the ClientAgents, every client quotes one side at one price and sends
+    orders_per_client orders, some real and the rest fake.  Each client's name and status
+    "ciphertexts" are opaque per-client tokens shared by all its orders, so building a batch
+    stays cheap at 10^7 orders while the book sees the same tuple structure as in the
+    simulation.
+
+    'orders' is the list of (price, order_type, (client_id, enc_name, enc_status)) tuples in
+    arrival order, and 'real' maps each status token to True or False.
+    """
+    def __init__(self, orders, real, num_clients, seed):
+        self.orders = orders
+        self.real = real
+        self.num_clients = num_clients
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.orders)
+
+    def is_real(self, details):
+        return self.real[details]
+
+    def fake_clients(self):
+        """
+        Ids of the clients that sent at least one fake order.
+        """
+        return sorted({details[0] for details, real in self.real.items() if not real})
+
+def generate_orders(num_orders, orders_per_client=8, real_range=(5, 7), mid_price=100, spread=1,
+                    shuffle=True, seed=0, non_private=False):
+    """
+    Generate an OrderSet of about num_orders orders (rounded up to whole clients).
+
+    Clients in the first half buy and the rest sell.  A buyer quotes mid_price + U[-spread,
+    spread] and a seller one tick lower, as in the simulation (99-101 against 98-100).  Each
+    client has U[real_range] real orders.  With shuffle, the clients' orders arrive
+    interleaved instead of client by client.  With non_private, the details are the ones of
+    the non-private ClientAgent instead, (client_id, name, True), and every order is real.
+    """
+    rng = np.random.RandomState(seed)
+    num_clients = max(2, -(-num_orders // orders_per_client))
+    client_ids = np.arange(1, num_clients + 1)
+    buyer = client_ids <= num_clients // 2
+    prices = mid_price + rng.randint(-spread, spread + 1, size=num_clients) - np.where(buyer, 0, 1)
+    num_real = rng.randint(real_range[0], real_range[1] + 1, size=num_clients)
+
+    real = {}
+    details = []
+    for client_id, n in zip(client_ids.tolist(), num_real.tolist()):
+        name = "name-%d" % client_id
+        if non_private:
+            true = (client_id, name, True)
+            real[true] = True
+            details.append([true] * orders_per_client)
+            continue
+        true = (client_id, name, "real-%d" % client_id)
+        false = (client_id, name, "fake-%d" % client_id)
+        real[true] = True
+        real[false] = False
+        details.append([true] * n + [false] * (orders_per_client - n))
+
+    owner = np.repeat(np.arange(num_clients), orders_per_client)
+    slot = np.tile(np.arange(orders_per_client), num_clients)
+    if shuffle:
+        arrival = rng.permutation(len(owner))
+        owner, slot = owner[arrival], slot[arrival]
+
+    sides = np.where(buyer, 'B', 'S')
+    orders = [(price, side, details[client][k])
+              for price, side, client, k in zip(prices[owner].tolist(), sides[owner].tolist(),
+                                                owner.tolist(), slot.tolist())]
+    return OrderSet(orders, real, num_clients, seed)
+
+def load_order_set(path, symbol=None):
+    """
+    An OrderSet replaying the resting orders of one symbol of a book snapshot (the first
+    symbol by default), in priority order.  A snapshot does not record reveal outcomes, so
+    every order counts as real.
+    """
+    columns, meta = read_snapshot(path)
+    orders = snapshot_orders(columns, meta)
+    if symbol is None:
+        symbol = min((order_symbol(order) for order in orders), default="")
+    orders = [order[:3] for order in orders if order_symbol(order) == symbol]
+    real = {details: True for price, order_type, details in orders}
+    return OrderSet(orders, real, len({details[0] for details in real}), meta.get('iteration', 0))
@@ -0,0 +1,190 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench.driver import AuctionDriver
+from bench.orders import generate_orders, load_order_set
+from model.SymbolModel import SymbolBooks
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ENGINES = ['bucket', 'tick', 'columnar']
+STAGES = ['build', 'match', 'purge']
+
+def build_lists(order_set, engine, tick_ladder):
+    return SymbolBooks(engine, tick_ladder).create_lists(order_set.orders)
+
+def stage_build(order_set, engine, tick_ladder):
+    """
+    Returns a callable that builds both sides of the book from the batch.
+    """
+    return lambda: build_lists(order_set, engine, tick_ladder)
+
+def stage_match(order_set, engine, tick_ladder):
+    """
+    Returns a callable that matches a freshly built book to completion.
+    """
+    buy_list, sell_list = build_lists(order_set, engine, tick_ladder)
+    driver = AuctionDriver(buy_list, sell_list, order_set.is_real, seed=order_set.seed)
+    return driver.run
+
+def stage_purge(order_set, engine, tick_ladder):
+    """
+    Returns a callable that purges every client with fake orders from a freshly built book,
+    as the reveal round does when it meets their first fake order.
+    """
+    buy_list, sell_list = build_lists(order_set, engine, tick_ladder)
+    clients = order_set.fake_clients()
+
+    def purge():
+        for client_id in clients:
+            buy_list.remove_client_orders(client_id)
+            sell_list.remove_client_orders(client_id)
+    return purge
+
+STAGE_SETUP = {'build': stage_build, 'match': stage_match, 'purge': stage_purge}
+
+def measure(order_set, engine, stage, repeat, memory, tick_ladder):
+    """
+    Best wall time over `repeat` runs of one stage, plus peak traced memory of one more run
+    when memory is on.  Setup (generating and, for match and purge, building the book) is
+    not timed.
+    """
+    times = []
+    for _ in range(repeat):
+        run = STAGE_SETUP[stage](order_set, engine, tick_ladder)
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+        del run
+
+    result = {'engine': engine,
+              'stage': stage,
+              'size': len(order_set),
+              'seconds': min(times),
+              'throughput': len(order_set) / min(times) if min(times) > 0 else float('inf')}
+
+    if memory:
+        run = STAGE_SETUP[stage](order_set, engine, tick_ladder)
+        gc.collect()
+        tracemalloc.start()
+        run()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del run
+    if psutil is not None:
+        result['rss_bytes'] = psutil.Process().memory_info().rss
+    return result
+
+def run_suite(sizes, engines, stages, repeat=3, memory=True, seed=0, tick_ladder=(0, 1, 1024),
+              spread=1, orders_per_client=8, snapshot=None):
+    """
+    Measure every stage and engine on a generated batch of each size, or only on the orders
+    of a book snapshot if one is given.
+    """
+    results = []
+    for size in sizes if snapshot is None else [None]:
+        if snapshot is None:
+            order_set = generate_orders(size, orders_per_client=orders_per_client, spread=spread, seed=seed)
+        else:
+            order_set = load_order_set(snapshot)
+        for engine in engines:
+            for stage in stages:
+                result = measure(order_set, engine, stage, repeat, memory, tick_ladder)
+                results.append(result)
+                print(format_result(result))
+                sys.stdout.flush()
+        del order_set
+    return results
+
+def format_result(result, baseline=None):
+    line = (f"{result['engine']:>9} {result['stage']:>6} {result['size']:>10} "
+            f"{result['seconds']:>10.4f}s {result['throughput']:>14,.0f} orders/s")
+    if 'peak_bytes' in result:
+        line += f" {result['peak_bytes'] / 2**20:>9.1f} MiB peak"
+    if baseline is not None:
+        line += f"   x{result['seconds'] / baseline['seconds']:.2f} of baseline"
+    return line
+
+def metadata(args):
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'spread': args.spread,
+            'orders_per_client': args.orders_per_client,
+            'tick_ladder': list(args.tick_ladder)}
+
+def check(baseline_file, args):
+    """
+    Re-run every configuration in a baseline and report stages that got slower than
+    (1 + tolerance) times the baseline.  Returns the number of regressions.
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    meta = baseline['meta']
+    reference = {(r['engine'], r['stage'], r['size']): r for r in baseline['results']}
+
+    regressions = 0
+    for size in sorted({r['size'] for r in baseline['results']}):
+        order_set = generate_orders(size, orders_per_client=meta['orders_per_client'],
+                                    spread=meta['spread'], seed=meta['seed'])
+        for (engine, stage, ref_size), ref in sorted(reference.items()):
+            if ref_size != size:
+                continue
+            result = measure(order_set, engine, stage, meta['repeat'], False, tuple(meta['tick_ladder']))
+            slow = result['seconds'] > (1 + args.tolerance) * ref['seconds']
+            regressions += slow
+            print(format_result(result, ref) + ("   REGRESSION" if slow else ""))
+        del order_set
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Order book benchmarks without the simulation Kernel')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5],
+                        help='Numbers of orders per batch, e.g. 1e3 1e6 1e7')
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (best is kept)')
+    parser.add_argument('--no_memory', action='store_true', help='Skip the tracemalloc run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--spread', type=int, default=1,
+                        help='Client prices are mid +- spread ticks (number of levels ~ 2 * spread + 2)')
+    parser.add_argument('--orders_per_client', type=int, default=8)
+    parser.add_argument('--tick_ladder', type=int, nargs=3, default=[0, 1, 1024],
+                        metavar=('MIN', 'TICK', 'TICKS'))
+    parser.add_argument('--snapshot', help='Replay the book of this snapshot file instead of generating --sizes')
+    parser.add_argument('--save', help='Write the results to this JSON baseline')
+    parser.add_argument('--check', help='Compare against this JSON baseline instead of running --sizes')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown over the baseline for --check')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        regressions = check(args.check, args)
+        print(f"{regressions} regression(s)")
+        return 1 if regressions else 0
+
+    results = run_suite([int(size) for size in args.sizes], args.engines, args.stages,
+                        repeat=args.repeat, memory=not args.no_memory, seed=args.seed,
+                        tick_ladder=tuple(args.tick_ladder), spread=args.spread,
+                        orders_per_client=args.orders_per_client, snapshot=args.snapshot)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'meta': metadata(args), 'results': results}, f, indent=2)
+        print(f"Saved {len(results)} results to {args.save}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,12 +3,16 @@ from Kernel import Kernel
 from agent.idp_auction.ClientAgent import ClientAgent as ClientAgent
 from agent.idp_auction.ServiceAgent import ServiceAgent as ServiceAgent
 from model.LatencyModel import LatencyModel
+from model.QueueModel import QueueModel
+from model.CostModel import load_cost_model
+from model.WaitModel import WaitTimes
 from util import util
 from util import param
 
 # Standard modules.
 from datetime import timedelta
 import numpy as np
+import random
 import pandas as pd
 from sys import exit
 from time import time
@@ -36,10 +40,64 @@ parser.add_argument('-s', '--seed', type=int, default=None,
                     help='numpy.random.seed() for simulation')
 parser.add_argument('-v', '--verbose', action='store_true',
                     help='Maximum verbosity!')
-parser.add_argument('-p', '--parallel_mode', type=bool, default=True,
-                    help='turn on parallel mode at server side')
+parser.add_argument('-p', '--parallel_mode', type=int, default=1,
+                    help='worker processes that open fused-reveal identities with --pipeline_depth > 1, '
+                         'the only server work that runs in parallel (1 runs serially)')
 parser.add_argument('-d', '--debug_mode', type=bool, default=False,
                     help='print debug info')
+parser.add_argument('--service_rate', type=float, default=None,
+                    help='Messages per second the server can process (default: unlimited)')
+parser.add_argument('--service_dist', default='exponential',
+                    help='Server processing time distribution: deterministic, exponential or uniform')
+parser.add_argument('--queue_discipline', default='fifo',
+                    help='Server ingress queue discipline: fifo, lifo or random')
+parser.add_argument('--book_engine', default='bucket', choices=['bucket', 'tick', 'columnar'],
+                    help='Server order book implementation')
+parser.add_argument('--tick_size', type=int, default=1,
+                    help='Price increment of the tick-ladder order book')
+parser.add_argument('--ladder_min', type=int, default=0,
+                    help='Lowest price on the tick ladder')
+parser.add_argument('--ladder_ticks', type=int, default=1024,
+                    help='Number of price levels on the tick ladder')
+parser.add_argument('--persistent_book', action='store_true',
+                    help='Keep the residual order book between iterations')
+parser.add_argument('--pipeline_depth', type=int, default=1,
+                    help='Candidate pairs the server keeps in flight per matching round')
+parser.add_argument('--fused_reveal', action='store_true',
+                    help='Clients send their identity encrypted to the server key with the MATCH status, dropping the EXECUTE round')
+parser.add_argument('--order_quorum', type=float, default=1.0,
+                    help='Share of clients whose orders are enough to start matching')
+parser.add_argument('--order_deadline', type=float, default=None,
+                    help='Seconds after soliciting orders to start matching with whatever arrived')
+parser.add_argument('--stream_orders', action='store_true',
+                    help='Insert orders into the book as they arrive instead of building it from the whole batch')
+parser.add_argument('--snapshot_dir', default=None,
+                    help='Write a binary snapshot of the book and trades here after every iteration')
+parser.add_argument('--warm_start', default=None,
+                    help='Start the first iteration from the book in this snapshot file')
+parser.add_argument('--blotter_dir', default=None,
+                    help='Write every executed trade to columnar chunk files here')
+parser.add_argument('--blotter_chunk', type=int, default=65536,
+                    help='Trades kept in memory before the blotter writes a chunk')
+parser.add_argument('--cost_model', default=None,
+                    help="Server compute delays from calibrated operation costs instead of wall time: "
+                         "'default' or a file written by bench/calibrate.py")
+parser.add_argument('--match_timeout', type=float, default=None,
+                    help='Seconds to wait for MATCH statuses before evicting a silent client (default: util/param.py)')
+parser.add_argument('--execute_timeout', type=float, default=None,
+                    help='Seconds to wait for EXECUTE names before evicting a silent client (default: util/param.py)')
+parser.add_argument('--wait_dropout', type=float, default=None,
+                    help='Derive round waits from the latency model for this target probability of a missed reply, instead of fixed 1s/3s waits')
+parser.add_argument('--wait_retune', action='store_true',
+                    help='With --wait_dropout, re-tune the waits from observed reply latencies')
+parser.add_argument('--dropout_prob', type=float, default=0.0,
+                    help='Chance that a client goes silent for the rest of the auction at each server request')
+parser.add_argument('--cancel_prob', type=float, default=0.0,
+                    help='Chance that a client cancels each of its acknowledged orders')
+parser.add_argument('--modify_prob', type=float, default=0.0,
+                    help='Chance that a client reprices each of its acknowledged orders')
+parser.add_argument('--symbols', type=int, default=1,
+                    help='Number of instruments; clients are spread over them round-robin')
 parser.add_argument('--config_help', action='store_true',
                     help='Print argument options for this config file')
 
@@ -49,6 +107,13 @@ if args.config_help:
     parser.print_help()
     exit()
 
+# Opening a window of fused-reveal identities is the only server work that runs in parallel.
+# The book build, purges, reports and messages stay serial: the books are Python objects
+# owned by the agent process, and shipping them to workers costs more than the work.
+if args.parallel_mode > 1 and not (args.fused_reveal and args.pipeline_depth > 1):
+    print("-p/--parallel_mode only applies to --fused_reveal with --pipeline_depth > 1; running serially")
+    args.parallel_mode = 1
+
 # Historical date to simulate.  Required even if not relevant.
 historical_date = pd.to_datetime('2023-01-01')
 
@@ -72,6 +137,7 @@ skip_log = args.skip_log
 seed = args.seed
 if not seed: seed = int(pd.Timestamp.now().timestamp() * 1000000) % (2**32 - 1)
 np.random.seed(seed)
+random.seed(seed)  # clients draw their orders and the server its side_to_start from random
 
 # Config parameter that causes util.util.print to suppress most output.
 util.silent_mode = not args.verbose
@@ -145,6 +211,22 @@ agents.extend([ ServiceAgent(
     num_clients = num_clients,
     parallel_mode = parallel_mode,
     debug_mode = debug_mode,
+    book_engine = args.book_engine,
+    tick_ladder = (args.ladder_min, args.tick_size, args.ladder_ticks),
+    persistent_book = args.persistent_book,
+    order_quorum = args.order_quorum,
+    order_deadline = None if args.order_deadline is None else pd.Timedelta(seconds=args.order_deadline),
+    stream_orders = args.stream_orders,
+    order_acks = args.cancel_prob > 0 or args.modify_prob > 0,  # handles are only needed to amend orders
+    snapshot_dir = args.snapshot_dir,
+    warm_start = args.warm_start,
+    blotter_dir = args.blotter_dir,
+    blotter_chunk = args.blotter_chunk,
+    cost_model = load_cost_model(args.cost_model),
+    match_timeout = param.wt_auction_match if args.match_timeout is None else pd.Timedelta(seconds=args.match_timeout),
+    execute_timeout = param.wt_auction_execute if args.execute_timeout is None else pd.Timedelta(seconds=args.execute_timeout),
+    pipeline_depth = args.pipeline_depth,
+    fused_reveal = args.fused_reveal,
 ) ])
 
 agent_types.extend(["ServiceAgent"])
@@ -163,6 +245,10 @@ for i in range (a+1, b+1):
                               name = "DarkPool Client Agent {}".format(i),
                               type = "ClientAgent",
                               iterations = num_iterations,
+                              cancel_prob = args.cancel_prob,
+                              modify_prob = args.modify_prob,
+                              dropout_prob = args.dropout_prob,
+                              symbol = f"SYM{i % args.symbols}" if args.symbols > 1 else None,
                               random_state = np.random.RandomState(seed=np.random.randint(low=0,high=2**32,  dtype='uint64'))))
 
 agent_types.extend([ "ClientAgent" for i in range(a+1,b+1) ])
@@ -194,12 +280,31 @@ latency_model = LatencyModel ( latency_model = 'cubic',
                                random_state = latency_rstate,
                                kwargs = model_args )
 
+### Optionally model the server's ingress capacity.  All clients talk to
+### agent 0, so a finite service rate exposes the auctioneer's fan-in bottleneck.
+queue_models = None
+if args.service_rate:
+    queue_rstate = np.random.RandomState(seed=np.random.randint(low=0,high=2**32, dtype='uint64'))
+    queue_models = { a : QueueModel(service_rate = args.service_rate,
+                                    distribution = args.service_dist,
+                                    discipline = args.queue_discipline,
+                                    random_state = queue_rstate) }
+
+### Optionally size the server's round waits from the latency model instead of fixed 1s/3s.
+if args.wait_dropout is not None:
+    wait_rstate = np.random.RandomState(seed=np.random.randint(low=0,high=2**32, dtype='uint64'))
+    agents[a].wait_times = WaitTimes(latency_model, a, range(a+1, b+1),
+                                     dropout = args.wait_dropout,
+                                     retune = args.wait_retune,
+                                     random_state = wait_rstate)
+
 
 # Start the kernel running.
 results = kernel.runner(agents = agents,
                         startTime = kernelStartTime,
                         stopTime = kernelStopTime,
                         agentLatencyModel = latency_model,
+                        agentQueueModels = queue_models,
                         defaultComputationDelay = defaultComputationDelay,
                         skip_log = skip_log,
                         log_dir = log_dir)
@@ -215,6 +320,10 @@ print ()
 print ("Service Agent mean time per iteration (except setup)...")
 print (f"    Place step:         {results['srv_place']}")
 print (f"    Match step:     {results['srv_match']}")
+print (f"    Dropouts:       " + ", ".join(f"{phase} {count}" for phase, count in results['srv_dropouts'].items()))
+if queue_models:
+    queue_stats = results['kernel_queue_stats'][a]
+    print (f"    Ingress queue:  served {queue_stats['served']}, mean wait {queue_stats['mean_wait']}, max wait {queue_stats['max_wait']}, max length {queue_stats['max_queue_length']}")
 print ()
 print ("Client Agent mean time per iteration (except setup)...")
 print (f"    Place step:         {results['clt_place'] / num_clients}")
@@ -0,0 +1,126 @@
+"""
+Columnar trade blotter.
+
+Executed trades are appended to fixed-size NumPy column buffers:
+
+    iteration     auction iteration of the trade
+    time          simulation time the trade was recorded (ns since the epoch)
+    buy_client    client id of the buyer
+    sell_client   client id of the seller
+    buy_price     price of the buy order's level
+    sell_price    price of the sell order's level
+    latency       time from the pair's MATCH request to the trade (ns)
+
+When a buffer is full it is written as one chunk file in the snapshot format of
+model/SnapshotModel.py, <directory>/<prefix>_trades_<chunk>.snap, and reused, so a run of
+millions of trades keeps at most one chunk in memory.  Without a directory, full chunks are
+dropped.  Either way the blotter keeps running aggregates (volume, VWAP per side, fill rate,
+match latency, fills per client) that cover every trade.
+"""
+
+import glob
+import os
+
+import numpy as np
+
+from model.SnapshotModel import read_snapshot, write_snapshot
+
+COLUMNS = np.dtype([('iteration', '<i4'), ('time', '<i8'), ('buy_client', '<i8'), ('sell_client', '<i8'),
+                    ('buy_price', '<f8'), ('sell_price', '<f8'), ('latency', '<i8')])
+
+class TradeBlotter:
+    def __init__(self, directory=None, prefix="trades", chunk_size=65536):
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk = np.zeros(chunk_size, dtype=COLUMNS)
+        self.size = 0    # rows in the current chunk
+        self.chunks = 0  # chunks written (or dropped) so far
+
+        self.trades = 0
+        self.orders = 0  # orders received, for the fill rate
+        self.buy_notional = 0.0
+        self.sell_notional = 0.0
+        self.latency_total = 0
+        self.latency_max = 0
+        self.client_fills = {}  # client id -> [buy fills, sell fills]
+
+    def __len__(self):
+        return self.trades
+
+    def record(self, iteration, time, buy_client, sell_client, buy_price, sell_price, latency=0):
+        """
+        Add one executed pair.  time and latency are pd.Timestamp / pd.Timedelta or
+        nanoseconds.
+        """
+        time = getattr(time, 'value', time)
+        latency = getattr(latency, 'value', latency)
+        self.chunk[self.size] = (iteration, time, buy_client, sell_client, buy_price, sell_price, latency)
+        self.size += 1
+
+        self.trades += 1
+        self.buy_notional += buy_price
+        self.sell_notional += sell_price
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.client_fills.setdefault(buy_client, [0, 0])[0] += 1
+        self.client_fills.setdefault(sell_client, [0, 0])[1] += 1
+        if self.size == len(self.chunk):
+            self.flush()
+
+    def add_orders(self, count):
+        self.orders += count
+
+    def flush(self):
+        """
+        Write the rows of the current chunk out and start a new one.
+        """
+        if self.size == 0:
+            return
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            rows = self.chunk[:self.size]
+            write_snapshot(self.chunk_path(self.chunks), {name: rows[name] for name in COLUMNS.names},
+                           {'trades': self.size, 'chunk': self.chunks})
+        self.chunks += 1
+        self.size = 0
+
+    def chunk_path(self, chunk):
+        return os.path.join(self.directory, f"{self.prefix}_trades_{chunk:05d}.snap")
+
+    def summary(self):
+        """
+        Aggregates over every trade recorded.  Orders trade one unit each, so a side's VWAP
+        is its mean execution price and the fill rate is the share of received orders that
+        executed.
+        """
+        trades = self.trades
+        return {'trades': trades,
+                'orders': self.orders,
+                'fill_rate': 2 * trades / self.orders if self.orders else None,
+                'buy_vwap': self.buy_notional / trades if trades else None,
+                'sell_vwap': self.sell_notional / trades if trades else None,
+                'mean_latency_ns': self.latency_total / trades if trades else None,
+                'max_latency_ns': self.latency_max,
+                'clients_filled': len(self.client_fills)}
+
+def read_blotter(directory, prefix="trades"):
+    """
+    The trades of every chunk a TradeBlotter wrote to directory, as one array per column.
+    Chunks are memory-mapped and only concatenated here.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, f"{prefix}_trades_*.snap")))
+    chunks = [read_snapshot(path)[0] for path in paths]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.zeros(0, dtype=COLUMNS[name])
+            for name in COLUMNS.names}
+
+def client_fills(columns):
+    """
+    Per-client fills of a read_blotter() result: client id -> (buy fills, sell fills).
+    """
+    buys = np.bincount(columns['buy_client'])
+    sells = np.bincount(columns['sell_client'])
+    fills = {}
+    for client_id in np.union1d(np.flatnonzero(buys), np.flatnonzero(sells)).tolist():
+        fills[client_id] = (int(buys[client_id]) if client_id < len(buys) else 0,
+                            int(sells[client_id]) if client_id < len(sells) else 0)
+    return fills
@@ -0,0 +1,658 @@
+import binascii
+
+from operator import is_not, itemgetter, ne
+
+import numpy as np
+
+from model.MatchingModel import BucketList, order_types
+
+# Kinds of the name and status fields of a detail, so that a lookup gives back equal values.
+FIELD_KINDS = ('str', 'bytes', 'bool', 'int', 'base64')
+
+def encode_field(value):
+    """
+    (kind, bytes) of a name or status field.  Base64 text (the ciphertexts of util.aes) is
+    stored decoded, other strings as UTF-8, bytes as they are, bools as one byte or none and
+    ints as their decimal digits.
+    """
+    if isinstance(value, str):
+        if value and len(value) % 4 == 0:
+            # Only text that encodes back to itself, so the lookup gives the same string.
+            try:
+                raw = binascii.a2b_base64(value)
+            except (binascii.Error, ValueError):
+                raw = None
+            if raw is not None and binascii.b2a_base64(raw, newline=False).decode() == value:
+                return 4, raw
+        return 0, value.encode()
+    if isinstance(value, bytes):
+        return 1, value
+    if isinstance(value, (bool, np.bool_)):
+        return 2, b'\x01' if value else b''
+    if isinstance(value, (int, np.integer)):
+        return 3, str(int(value)).encode()
+    raise TypeError(f"The columnar order book cannot store order details of type {type(value).__name__}.")
+
+def decode_field(kind, raw):
+    if kind == 0:
+        return raw.decode()
+    if kind == 1:
+        return bytes(raw)
+    if kind == 2:
+        return bool(raw)
+    if kind == 3:
+        return int(raw)
+    return binascii.b2a_base64(raw, newline=False).decode()
+
+def detail_dtype(count):
+    """
+    Smallest unsigned dtype that indexes count details and still has a value left for DEAD.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if count <= np.iinfo(dtype).max:
+            return dtype
+    raise OverflowError("The columnar order book holds at most 2^32 - 1 distinct order details.")
+
+class DetailBuffer:
+    """
+    The distinct (client_id, enc_name, enc_status) order details of a book, kept as bytes.
+
+    Names and statuses are fields: field f is data[ends[f - 1]:ends[f]] (ends[-1] read as 0),
+    stored by the kind kinds[f] (see FIELD_KINDS).  Detail i has client id client[i], name
+    field name[i] and status field status[i]; a detail whose name equals the one of the
+    detail added just before it (the true and false status details of an IDP client) shares
+    its field.  Orders refer to details by index and get an equal tuple back on lookup.  The
+    book keeps no tuple or string alive: interning goes through a dict from the tuple's hash
+    to its index, built on the first intern() since a bulk build adds details that are
+    already distinct.
+    """
+    __slots__ = ('data', 'ends', 'kinds', 'fields', 'client', 'name', 'status', 'size', 'index',
+                 'collisions')
+
+    def __init__(self, capacity=64):
+        self.data = bytearray()
+        self.ends = np.zeros(2 * capacity, dtype=np.uint32)
+        self.kinds = np.zeros(2 * capacity, dtype=np.uint8)
+        self.fields = 0
+        self.client = np.zeros(capacity, dtype=np.int32)
+        self.name = np.zeros(capacity, dtype=np.uint32)
+        self.status = np.zeros(capacity, dtype=np.uint32)
+        self.size = 0
+        self.index = None     # hash of the details -> index
+        self.collisions = {}  # details -> index, for the rare hash shared by other details
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        return int(self.client[i]), self.field(int(self.name[i])), self.field(int(self.status[i]))
+
+    def field(self, f):
+        return decode_field(int(self.kinds[f]), self.raw(f))
+
+    def add(self, details):
+        """
+        Append details without checking whether they are already in the buffer.
+        """
+        client_id, name, status = details
+        if self.size == len(self.client):
+            for column in ('client', 'name', 'status'):
+                setattr(self, column, np.concatenate([getattr(self, column), np.zeros_like(getattr(self, column))]))
+        i = self.size
+        kind, raw = encode_field(name)
+        previous = int(self.name[i - 1]) if i else None
+        if previous is not None and self.kinds[previous] == kind and self.raw(previous) == raw:
+            self.name[i] = previous
+        else:
+            self.name[i] = self.add_field(kind, raw)
+        self.status[i] = self.add_field(*encode_field(status))
+        self.client[i] = client_id
+        self.size += 1
+        if self.index is not None:
+            self.index_add(details, i)
+        return i
+
+    def extend(self, details):
+        """
+        Append many details at once, as add() does one by one: the fields are laid out with
+        NumPy and joined into the data buffer in one copy.
+        """
+        if not details:
+            return
+        n = len(details)
+        clients = np.fromiter(map(itemgetter(0), details), dtype=np.int64, count=n)
+        names = list(map(itemgetter(1), details))
+        statuses = list(map(itemgetter(2), details))
+        # A name equal (and of the same type) to the one of the detail before shares its field.
+        before = [self.field(int(self.name[self.size - 1])) if self.size else None] + names[:-1]
+        new_name = np.fromiter(map(ne, names, before), dtype=bool, count=n)
+        new_name |= np.fromiter(map(is_not, map(type, names), map(type, before)), dtype=bool, count=n)
+        if not self.size:
+            new_name[0] = True
+
+        # Field layout: each detail adds its name field (if new), then its status field.
+        status_fields = self.fields + np.cumsum(new_name.astype(np.int64) + 1) - 1
+        name_fields = np.maximum.accumulate(np.where(new_name, status_fields - 1, -1))
+        if self.size:
+            name_fields[name_fields < 0] = self.name[self.size - 1]
+        values = np.empty(int(status_fields[-1]) + 1 - self.fields, dtype=object)
+        values[status_fields[new_name] - 1 - self.fields] = np.fromiter(names, dtype=object, count=n)[new_name]
+        values[status_fields - self.fields] = np.fromiter(statuses, dtype=object, count=n)
+        encoded = list(map(encode_field, values))
+        kinds = np.fromiter(map(itemgetter(0), encoded), dtype=np.uint8, count=len(encoded))
+        raws = list(map(itemgetter(1), encoded))
+        del encoded
+
+        size = self.size + n
+        for column, column_values in (('client', clients), ('name', name_fields), ('status', status_fields)):
+            grown = np.zeros(max(size, len(getattr(self, column))), dtype=getattr(self, column).dtype)
+            grown[:self.size] = getattr(self, column)[:self.size]
+            grown[self.size:size] = column_values
+            setattr(self, column, grown)
+        ends = np.cumsum(np.fromiter(map(len, raws), dtype=np.int64, count=len(raws))) + len(self.data)
+        self.data += b''.join(raws)
+        fields = self.fields
+        count = fields + len(raws)
+        ends_dtype = np.uint32 if len(self.data) <= np.iinfo(np.uint32).max else np.int64
+        for column, column_values, dtype in (('ends', ends, ends_dtype), ('kinds', kinds, np.uint8)):
+            grown = np.zeros(max(count, len(getattr(self, column))), dtype=dtype)
+            grown[:fields] = getattr(self, column)[:fields]
+            grown[fields:count] = column_values
+            setattr(self, column, grown)
+        self.fields = count
+        if self.index is not None:
+            for i, details_i in enumerate(details, self.size):
+                self.index_add(details_i, i)
+        self.size = size
+
+    def raw(self, f):
+        start = int(self.ends[f - 1]) if f else 0
+        return self.data[start:int(self.ends[f])]
+
+    def add_field(self, kind, raw):
+        f = self.fields
+        if f == len(self.ends):
+            self.ends = np.concatenate([self.ends, np.zeros_like(self.ends)])
+            self.kinds = np.concatenate([self.kinds, np.zeros_like(self.kinds)])
+        self.data += raw
+        if len(self.data) > np.iinfo(self.ends.dtype).max:
+            self.ends = self.ends.astype(np.int64)
+        self.ends[f] = len(self.data)
+        self.kinds[f] = kind
+        self.fields += 1
+        return f
+
+    def intern(self, details):
+        """
+        Index of these details, added if new.
+        """
+        if self.index is None:
+            self.index = {}
+            for i in range(self.size):
+                self.index_add(self[i], i)
+        i = self.index.get(hash(details))
+        if i is not None and self[i] != details:
+            i = self.collisions.get(details)
+        return self.add(details) if i is None else i
+
+    def index_add(self, details, i):
+        key = hash(details)
+        if key in self.index:
+            self.collisions[details] = i
+        else:
+            self.index[key] = i
+
+    def nbytes(self):
+        return (len(self.data) + self.ends[:self.fields].nbytes + self.kinds[:self.fields].nbytes
+                + self.client[:self.size].nbytes + self.name[:self.size].nbytes + self.status[:self.size].nbytes)
+
+class ColumnarNode:
+    """
+    A price level whose orders live in the owning book's detail column.  The level owns the
+    row range [base, base + capacity); its orders occupy [start, end) in arrival order, with
+    removed rows set to DEAD.  Like an OrderQueue slot, row r holds the order at the absolute
+    position first + (r - base), which stays the same when the level moves.
+    """
+    __slots__ = ('book', 'price', 'order_type', 'base', 'capacity', 'start', 'end', 'count', 'first',
+                 'next', 'prev')
+
+    def __init__(self, book, price, order_type, base, capacity, count):
+        self.book = book
+        self.price = price
+        self.order_type = order_type
+        self.base = base
+        self.capacity = capacity
+        self.start = base
+        self.end = base + count
+        self.count = count  # live orders
+        self.first = 0      # absolute position of row base
+        self.next = None
+        self.prev = None
+
+    @property
+    def orders(self):
+        return ColumnarOrders(self)
+
+class ColumnarOrders:
+    """
+    List-like FIFO view of one ColumnarNode's live orders.  Orders are returned as
+    (client_id, enc_name, enc_status) tuples equal to the ones the clients submitted, decoded
+    from the book's DetailBuffer.
+    """
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def __len__(self):
+        return self.node.count
+
+    def __bool__(self):
+        return self.node.count > 0
+
+    def __iter__(self):
+        book = self.node.book
+        for detail in book.detail[self.rows()].tolist():
+            yield book.details[detail]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __getitem__(self, i):
+        book = self.node.book
+        return book.details[int(book.detail[self.row(i)])]
+
+    def append(self, order):
+        self.node.book.append(self.node, order)
+
+    def peek(self, k):
+        """
+        The next k live orders from the head, without removing them.  Scans a window of rows
+        that doubles until it holds k live orders, so the cost does not depend on level depth.
+        """
+        node = self.node
+        book = node.book
+        width = max(k, 8)
+        while True:
+            stop = min(node.start + width, node.end)
+            window = book.detail[node.start:stop]
+            details = window[window != book.dead]
+            if len(details) >= k or stop == node.end:
+                return [book.details[detail] for detail in details[:k].tolist()]
+            width *= 2
+
+    def popleft(self):
+        return self.pop(0)
+
+    def popleft_many(self, k):
+        """
+        Remove and return the first k live orders (fewer if the level is shallower).
+        """
+        node = self.node
+        book = node.book
+        rows = self.rows()[:k]
+        orders = [book.details[detail] for detail in book.detail[rows].tolist()]
+        book.detail[rows] = book.dead
+        node.count -= len(rows)
+        book.count -= len(rows)
+        if len(rows):
+            node.start = int(rows[-1]) + 1
+        book.maybe_compact()
+        return orders
+
+    def pop(self, i=0):
+        book = self.node.book
+        row = self.row(i)
+        order = book.details[int(book.detail[row])]
+        book.kill(self.node, row)
+        return order
+
+    def at(self, position):
+        """
+        The live order at an absolute position, or None if it is gone.
+        """
+        row = self.find(position)
+        if row is None:
+            return None
+        book = self.node.book
+        return book.details[int(book.detail[row])]
+
+    def discard(self, position):
+        """
+        Remove the order at an absolute position.  Returns False if it is already gone.
+        """
+        row = self.find(position)
+        if row is None:
+            return False
+        self.node.book.kill(self.node, row)
+        return True
+
+    def find(self, position):
+        """
+        Row of the live order at an absolute position, or None.
+        """
+        node = self.node
+        row = node.base + position - node.first
+        if row < node.start or row >= node.end or node.book.detail[row] == node.book.dead:
+            return None
+        return row
+
+    def last_position(self):
+        node = self.node
+        return node.first + node.end - 1 - node.base
+
+    def head_position(self):
+        node = self.node
+        return node.first + self.row(0) - node.base
+
+    def positions(self):
+        """
+        (absolute position, order) for every live order, front to back.
+        """
+        node = self.node
+        book = node.book
+        rows = self.rows()
+        for row, detail in zip(rows.tolist(), book.detail[rows].tolist()):
+            yield node.first + row - node.base, book.details[detail]
+
+    def rows(self):
+        node = self.node
+        return node.start + np.flatnonzero(node.book.detail[node.start:node.end] != node.book.dead)
+
+    def row(self, i):
+        node = self.node
+        if i == 0:
+            # Skip rows removed since the head last moved.
+            detail, dead = node.book.detail, node.book.dead
+            while node.start < node.end and detail[node.start] == dead:
+                node.start += 1
+            if node.start == node.end:
+                raise IndexError("pop from empty price level")
+            return node.start
+        return int(self.rows()[i])
+
+class ColumnarBucketList(BucketList):
+    """
+    BucketList whose orders are stored in a NumPy column instead of per-order tuples.
+
+    Every order is one row of the detail column: the index of its (client_id, enc_name,
+    enc_status) in the DetailBuffer of distinct details shared by both sides of the book, in
+    the narrowest unsigned dtype that can index all of them.  The column's largest value, DEAD,
+    marks a removed order.  The price is the level's, the client id the details' and the queue
+    position follows from the row, as in an OrderQueue.  Clients reuse their ciphertexts for
+    all their orders, so the buffer holds two details per IDP client and an order takes one
+    byte (up to 127 clients), two bytes (up to 32767) or four.  An object book pays at least an
+    8-byte list slot per order, plus the detail tuple wherever a client's orders do not share
+    one.
+
+    Each level owns a contiguous row range and grows by moving to a range twice as large at the
+    end of the column.  The linked-list head/tail/prev/next and price index are inherited from
+    BucketList, so the ServiceAgent matching code works on either implementation.
+
+    Fake-order purges go through a per-client index of rows, kept as one int32 array per
+    client.  Once more than half of the rows past the tombstones left inside levels are dead,
+    the column is compacted: every level keeps its rows from the head on.
+    """
+    def __init__(self, order_type=None, capacity=1024, dtype=np.uint8):
+        super().__init__(order_type)
+        self.detail = np.full(capacity, np.iinfo(dtype).max, dtype=dtype)
+        self.dead = np.iinfo(dtype).max
+        self.size = 0          # rows allocated so far
+        self.count = 0         # live orders
+        self.floor = 0         # dead rows inside levels that the last compaction kept
+        self.details = DetailBuffer()  # detail index -> (client_id, enc_name, enc_status)
+        self.client_rows = None   # client id -> int32 rows, built on first purge
+        self.client_extra = {}    # client id -> [row] of orders added since client_rows was built
+        self.owners = None        # (level bases ascending, levels in the same order), built on purge
+
+    def intern(self, order):
+        """
+        Detail index of an order, widening the column if the index reaches DEAD.
+        """
+        detail = self.details.intern(order)
+        if detail >= self.dead:
+            dtype = detail_dtype(detail + 1)
+            widened = self.detail.astype(dtype)
+            widened[self.detail == self.dead] = np.iinfo(dtype).max
+            self.detail, self.dead = widened, np.iinfo(dtype).max
+        return detail
+
+    def clients(self, rows):
+        """
+        Client ids of the live orders in these rows.
+        """
+        return self.details.client[self.detail[rows]]
+
+    def allocate(self, rows):
+        """
+        Reserve a contiguous range of rows at the end of the column and return its first row.
+        """
+        base = self.size
+        if base + rows > len(self.detail):
+            grown = np.full(max(2 * len(self.detail), base + rows), self.dead, dtype=self.detail.dtype)
+            grown[:base] = self.detail[:base]
+            self.detail = grown
+        self.size = base + rows
+        self.owners = None
+        return base
+
+    def new_node(self, price, order_type, order):
+        node = ColumnarNode(self, price, order_type, self.allocate(4), 4, 0)
+        self.append(node, order)
+        return node
+
+    def append(self, node, order):
+        if node.end == node.base + node.capacity:
+            self.relocate(node, max(4, 2 * (node.end - node.start)))
+        detail = self.intern(order)
+        row = node.end
+        self.detail[row] = detail
+        self.count += 1
+        node.end += 1
+        node.count += 1
+        if self.client_rows is not None:
+            self.client_extra.setdefault(order[0], []).append(row)
+
+    def relocate(self, node, capacity, first=None):
+        """
+        Move a level's rows from its head on to a fresh range with room for `capacity` rows.
+        With first, the range starts at that earlier position instead, with dead rows in front.
+        """
+        head = node.first + node.start - node.base
+        first = head if first is None else min(first, head)
+        base = self.allocate(capacity)
+        start = base + head - first
+        end = start + node.end - node.start
+        self.detail[start:end] = self.detail[node.start:node.end]
+        self.detail[node.base:node.end] = self.dead
+        moved = start + np.flatnonzero(self.detail[start:end] != self.dead)
+        node.base = node.start = base
+        node.end = end
+        node.capacity = capacity
+        node.first = first
+
+        # The moved orders keep their old rows in the client index as dead entries.
+        if self.client_rows is not None:
+            for row, client_id in zip(moved.tolist(), self.clients(moved).tolist()):
+                self.client_extra.setdefault(client_id, []).append(row)
+
+    def kill(self, node, row):
+        self.detail[row] = self.dead
+        node.count -= 1
+        self.count -= 1
+        self.maybe_compact()
+
+    def remove_price(self, node):
+        if node is None or self.levels.get(node.price) is not node:
+            return
+        super().remove_price(node)
+        self.detail[node.base:node.end] = self.dead
+        self.count -= node.count
+        node.count = 0
+
+    def truncate(self, node):
+        removed = super().truncate(node)
+        for level in removed:
+            self.detail[level.base:level.end] = self.dead
+            self.count -= level.count
+            level.count = 0
+        return removed
+
+    def restore_order(self, node, position, order):
+        """
+        Put an order removed from the head of node back at its position, ahead of the orders
+        that arrived after it.  If compaction or relocation already dropped its row, the level
+        moves to a fresh range that starts at that position.
+        """
+        row = node.base + position - node.first
+        if row < node.base:
+            self.relocate(node, max(4, 2 * (node.end - row)), first=position)
+            row = node.base
+        self.detail[row] = self.intern(order)
+        node.start = min(node.start, row)
+        node.count += 1
+        self.count += 1
+        if self.client_rows is not None:
+            self.client_extra.setdefault(order[0], []).append(row)
+
+    def remove_client_orders(self, client_id):
+        if self.client_rows is None:
+            self.build_client_index()
+        rows = self.client_rows.pop(client_id, ())
+        extra = self.client_extra.pop(client_id, ())
+        entries = len(rows) + len(extra)
+        # A restored order's row can be listed twice.
+        rows = np.unique(np.concatenate([np.asarray(rows, dtype=np.int64), np.asarray(extra, dtype=np.int64)]))
+        rows = rows[self.detail[rows] != self.dead]
+        rows = rows[self.clients(rows) == client_id]
+        if len(rows) == 0:
+            return entries
+        self.detail[rows] = self.dead
+        self.count -= len(rows)
+        if self.owners is None:
+            nodes = sorted(self.levels.values(), key=lambda node: node.base)
+            self.owners = (np.array([node.base for node in nodes], dtype=np.int64), nodes)
+        bases, nodes = self.owners
+        owners, counts = np.unique(np.searchsorted(bases, rows, side='right') - 1, return_counts=True)
+        for owner, count in zip(owners.tolist(), counts.tolist()):
+            nodes[owner].count -= count
+        self.maybe_compact()
+        return entries
+
+    def prune_indexes(self):
+        super().prune_indexes()
+        if self.client_rows is not None:
+            self.build_client_index()
+
+    def build_client_index(self):
+        rows = np.flatnonzero(self.detail[:self.size] != self.dead)
+        clients = self.clients(rows)
+        ranks = np.argsort(clients, kind='stable')
+        rows, clients = rows[ranks].astype(np.int32), clients[ranks]
+        bounds = np.flatnonzero(clients[1:] != clients[:-1]) + 1
+        self.client_rows = {int(group_clients[0]): group_rows
+                            for group_clients, group_rows in zip(np.split(clients, bounds), np.split(rows, bounds))
+                            if len(group_rows)}
+        self.client_extra = {}
+
+    def maybe_compact(self):
+        if self.size - self.floor > 1024 and 2 * self.count < self.size - self.floor:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the column with every level's rows from its head on, levels in list order.
+        Positions stay valid because the levels move with their first position.  Row numbers
+        change, so the client index is rebuilt on the next purge.
+        """
+        nodes = list(self)
+        for node in nodes:
+            if node.count:
+                ColumnarOrders(node).row(0)
+            else:
+                node.start = node.end
+        spans = [node.end - node.start for node in nodes]
+        compacted = np.full(max(sum(spans), 1), self.dead, dtype=self.detail.dtype)
+        start = 0
+        for node, span in zip(nodes, spans):
+            compacted[start:start + span] = self.detail[node.start:node.end]
+            node.first += node.start - node.base
+            node.base = node.start = start
+            node.end = start + span
+            node.capacity = span
+            start += span
+        self.detail = compacted
+        self.size = start
+        self.floor = self.size - self.count
+        self.client_rows = None
+        self.client_extra = {}
+        self.owners = None
+
+    def nbytes(self):
+        """
+        Bytes held by the order column (excluding the shared DetailBuffer).
+        """
+        return self.detail[:self.size].nbytes
+
+def create_columnar_lists(orders, handles=None):
+    """
+    Columnar counterpart of create_sorted_lists: stable-sorts each side by price and lays the
+    orders out level by level in the detail column, in arrival order within each level.  Both
+    sides share one DetailBuffer.  Order i gets handles[i] as its handle, or i if no handles
+    are given.
+    """
+    prices = np.array(list(map(itemgetter(0), orders)))
+    types = order_types(orders)
+
+    # Intern the details in arrival order: detail_index[i] indexes the buffer.
+    batch_details = list(map(itemgetter(2), orders))
+    seen = dict(zip(dict.fromkeys(batch_details), range(len(orders))))
+    detail_index = np.fromiter(map(seen.__getitem__, batch_details), dtype=np.int64, count=len(orders))
+    details = DetailBuffer(max(len(seen), 1))
+    details.extend(list(seen))
+    dtype = detail_dtype(len(seen))
+    del seen, batch_details
+
+    sides = []
+    for order_type in ('B', 'S'):
+        index = np.flatnonzero(types == order_type.encode('ascii'))
+        book = ColumnarBucketList(order_type, capacity=max(len(index), 1), dtype=dtype)
+        book.details = details
+        build_columnar_list(book, prices, detail_index, index)
+        if book.arrivals is not None:
+            # The handles of the bulk-built orders, kept as int32 when they fit.
+            nodes, bounds, arrivals = book.arrivals
+            if handles is not None:
+                arrivals = np.asarray(handles)[arrivals]
+            if len(arrivals) and 0 <= arrivals.min() and arrivals.max() <= np.iinfo(np.int32).max:
+                arrivals = arrivals.astype(np.int32)
+            book.arrivals = (nodes, bounds, arrivals)
+        sides.append(book)
+
+    return sides[0], sides[1]
+
+def build_columnar_list(book, prices, detail_index, index):
+    """
+    Lay out one side's orders, given by their positions in the batch, level by level.
+    """
+    if len(index) == 0:
+        return book
+
+    side_prices = prices[index]
+    ranks = np.argsort(-side_prices if book.order_type == 'B' else side_prices, kind='stable')
+    index = index[ranks]
+    side_prices = side_prices[ranks]
+
+    n = len(index)
+    book.allocate(n)
+    book.detail[:n] = detail_index[index]
+    book.count = n
+
+    bounds = [0] + (np.flatnonzero(side_prices[1:] != side_prices[:-1]) + 1).tolist() + [n]
+    level_prices = side_prices[bounds[:-1]].tolist()
+    nodes = [ColumnarNode(book, price, book.order_type, start, end - start, end - start)
+             for price, start, end in zip(level_prices, bounds[:-1], bounds[1:])]
+
+    book.link_nodes(nodes)
+    book.arrivals = (nodes, bounds, index)
+    return book
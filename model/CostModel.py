@@ -0,0 +1,79 @@
+"""
+Deterministic server compute costs.
+
+Without a cost model the ServiceAgents measure the wall time of each protocol step and
+advance their next wakeup by it, so the simulated protocol time depends on the host, its
+load and the Python version.  A CostModel instead charges a fixed calibrated cost per
+operation the server performs, and the step's compute delay is the sum of its charges:
+
+    step      fixed overhead of one server wakeup
+    insert    one order added to the book
+    level     one price level visited and removed by the matching walk
+    purge     one client-index entry visited while purging or cancelling orders
+    decrypt   one client identity opened with the server key (fused reveal)
+    message   one message built and handed to the Kernel
+    trade     one executed pair recorded and taken off the book
+
+Charges made outside a timed step (the book build while orders arrive, order amendments)
+are added to the next one.  Costs are in nanoseconds; bench/calibrate.py measures them on
+the current host and saves them as JSON for load_cost_model().
+"""
+
+import json
+
+import pandas as pd
+
+OPERATIONS = ('step', 'insert', 'level', 'purge', 'decrypt', 'message', 'trade')
+
+# Nanoseconds per operation, measured with bench/calibrate.py (bucket book, CPython 3.11).
+DEFAULT_COSTS = {'step': 7000, 'insert': 250, 'level': 450, 'purge': 1000, 'decrypt': 1100000,
+                 'message': 650, 'trade': 150}
+
+class CostModel:
+    """
+    Accumulates the cost of the operations charged since the last take().  'costs' maps
+    operation names to nanoseconds and overrides DEFAULT_COSTS.  counts keeps the number of
+    operations charged over the whole run.
+    """
+    def __init__(self, costs=None):
+        unknown = set(costs or ()) - set(OPERATIONS)
+        if unknown:
+            raise ValueError(f"Unknown cost model operations: {sorted(unknown)}")
+        self.costs = dict(DEFAULT_COSTS)
+        self.costs.update(costs or {})
+        self.pending = 0
+        self.counts = dict.fromkeys(OPERATIONS, 0)
+
+    def charge(self, operation, count=1):
+        self.pending += self.costs[operation] * count
+        self.counts[operation] += count
+
+    def take(self):
+        """
+        The compute delay of one server step: its fixed cost plus everything charged since the
+        last take, as a pd.Timedelta.  Starts a new tally.
+        """
+        self.charge('step')
+        delay = pd.Timedelta(int(round(self.pending)), unit='ns')
+        self.pending = 0
+        return delay
+
+    def save(self, path, **meta):
+        with open(path, 'w') as f:
+            json.dump({'costs': self.costs, 'meta': meta}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)['costs'])
+
+def load_cost_model(spec):
+    """
+    The cost model selected on the command line: None (or 'wall') keeps wall-clock delays,
+    'default' uses DEFAULT_COSTS and anything else is a calibration file.
+    """
+    if spec is None or spec == 'wall':
+        return None
+    if spec == 'default':
+        return CostModel()
+    return CostModel.load(spec)
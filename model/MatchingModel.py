@@ -1,28 +1,261 @@
+import math
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+
+class OrderQueue:
+    """
+    FIFO of the orders resting at one price level.
+
+    Removed orders are tombstoned (replaced by None) rather than deleted, so every order keeps
+    a stable absolute position for as long as it rests in the queue.  Positions are what the
+    per-client index in BucketList refers to.  Once the dead prefix in front of the head grows
+    past half the slots it is compacted away; positions stay valid because they are absolute.
+
+    Appending and removing the head are O(1) amortized, so draining a level of k orders costs
+    O(k) in total.
+    """
+    __slots__ = ('items', 'head', 'base', 'count')
+
+    def __init__(self, orders=()):
+        self.items = list(orders)
+        self.head = 0              # slot of the first possibly-live order
+        self.base = 0              # absolute position of items[0]
+        self.count = len(self.items)  # live orders
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __iter__(self):
+        for i in range(self.head, len(self.items)):
+            if self.items[i] is not None:
+                yield self.items[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __getitem__(self, i):
+        return self.items[self.slot(i)]
+
+    def slot(self, i):
+        """
+        Slot of the i-th live order.  The head is found by skipping tombstones once.
+        """
+        items = self.items
+        if i == 0:
+            while self.head < len(items) and items[self.head] is None:
+                self.head += 1
+            if self.head == len(items):
+                raise IndexError("empty price level")
+            return self.head
+        live = [j for j in range(self.head, len(items)) if items[j] is not None]
+        return live[i]
+
+    def append(self, order):
+        """
+        Add an order at the back and return its absolute position.
+        """
+        self.items.append(order)
+        self.count += 1
+        return self.base + len(self.items) - 1
+
+    def peek(self, k):
+        """
+        The next k live orders from the head, without removing them.
+        """
+        return list(islice(self, k))
+
+    def popleft(self):
+        return self.pop(0)
+
+    def popleft_many(self, k):
+        """
+        Remove and return the first k live orders (fewer if the level is shallower).
+        """
+        items = self.items
+        if self.count:
+            self.slot(0)
+        chunk = items[self.head:self.head + k]
+        if len(chunk) == k and None not in chunk:
+            items[self.head:self.head + k] = [None] * k
+            self.head += k
+            self.count -= k
+            if self.head > 32 and 2 * self.head > len(items):
+                self.compact()
+            return chunk
+        return [self.popleft() for _ in range(min(k, self.count))]
+
+    def pop(self, i=0):
+        slot = self.slot(i)
+        order = self.items[slot]
+        self.items[slot] = None
+        if i == 0:
+            self.head = slot + 1
+        self.count -= 1
+        if self.head > 32 and 2 * self.head > len(self.items):
+            self.compact()
+        return order
+
+    def discard(self, position):
+        """
+        Tombstone the order at an absolute position.  Returns False if it is already gone.
+        """
+        slot = position - self.base
+        if slot < self.head or slot >= len(self.items) or self.items[slot] is None:
+            return False
+        self.items[slot] = None
+        self.count -= 1
+        return True
+
+    def restore(self, position, order):
+        """
+        Put a removed order back at its absolute position.  If compaction already dropped its
+        slot, the dead prefix is regrown in front so that the position is valid again.
+        """
+        slot = position - self.base
+        if slot < 0:
+            self.items[:0] = [None] * -slot
+            self.base = position
+            self.head -= slot
+            slot = 0
+        self.items[slot] = order
+        self.head = min(self.head, slot)
+        self.count += 1
+
+    def at(self, position):
+        """
+        The live order at an absolute position, or None if it is gone.
+        """
+        slot = position - self.base
+        if slot < self.head or slot >= len(self.items):
+            return None
+        return self.items[slot]
+
+    def last_position(self):
+        return self.base + len(self.items) - 1
+
+    def head_position(self):
+        return self.base + self.slot(0)
+
+    def positions(self):
+        """
+        (absolute position, order) for every live order, front to back.
+        """
+        for i in range(self.head, len(self.items)):
+            if self.items[i] is not None:
+                yield self.base + i, self.items[i]
+
+    def compact(self):
+        """
+        Drop the dead prefix in front of the head.
+        """
+        del self.items[:self.head]
+        self.base += self.head
+        self.head = 0
+
 class Node:
+    __slots__ = ('price', 'order_type', 'orders', 'next', 'prev')
+
     def __init__(self, price, order_type, orders):
         self.price = price
         self.order_type = order_type
-        self.orders = orders  # list of (person, real/fake)
+        self.orders = OrderQueue(orders)  # FIFO of (client_id, name, status)
         self.next = None
         self.prev = None
 
 class BucketList:
-    def __init__(self):
+    """
+    Doubly-linked list of price levels, best price at the head.  Buy lists are sorted by
+    descending price and sell lists by ascending price.
+
+    Alongside the links, the list keeps a price-level index: a dict from price to Node and
+    an ascending array of the occupied prices.  Lookup of an existing level is O(1) and a new
+    level finds its neighbours by binary search, so insertion and removal cost O(log L)
+    instead of a walk from the head.
+
+    Orders inserted with a handle (an integer unique within the book, chosen by the caller)
+    can later be cancelled or repriced through it.  The handle index maps each handle to its
+    level and queue position and is built on first use; orders of a bulk-built list use their
+    arrival index in the batch as handle.
+    """
+    def __init__(self, order_type=None):
         self.head = None
         self.tail = None
+        self.order_type = order_type
+        self.levels = {}  # price -> Node
+        self.prices = []  # occupied prices, ascending
+        self.client_orders = None  # client id -> [(Node, position)], built on first purge
+        self.order_handles = None  # handle -> (Node, position), built on first use
+        self.arrivals = None       # (nodes, level bounds, arrival indices) of a bulk build
 
-    def insert_or_update_node(self, price, order_type, order):
-        current = self.head
+    @classmethod
+    def from_nodes(cls, order_type, nodes):
+        """
+        Build a list from price levels that are already in list order (best price first),
+        linking them in one pass.
+        """
+        bucket_list = cls(order_type)
+        bucket_list.link_nodes(nodes)
+        return bucket_list
+
+    def link_nodes(self, nodes):
+        """
+        Replace the contents of this list with nodes given in list order.
+        """
+        previous = None
+        for node in nodes:
+            node.prev = previous
+            node.next = None
+            if previous is not None:
+                previous.next = node
+            previous = node
+        self.head = nodes[0] if nodes else None
+        self.tail = nodes[-1] if nodes else None
+        self.index_nodes(nodes)
+
+    def index_nodes(self, nodes):
+        """
+        Rebuild the price-level index from nodes given in list order.
+        """
+        self.levels = {node.price: node for node in nodes}
+        self.prices = [node.price for node in nodes]
+        if self.order_type == 'B':
+            self.prices.reverse()
+
+    def __len__(self):
+        return len(self.levels)
 
+    def __iter__(self):
+        current = self.head
         while current is not None:
-            if current.price == price and current.order_type == order_type:
-                current.orders.append(order)
-                return
-            elif (order_type == 'B' and current.price < price) or (order_type == 'S' and current.price > price):
-                break
+            yield current
             current = current.next
 
-        new_node = Node(price, order_type, [order])
+    def find(self, price):
+        """
+        Return the Node for the given price, or None if the level is empty.
+        """
+        return self.levels.get(price)
+
+    def insert_or_update_node(self, price, order_type, order, handle=None):
+        node = self.levels.get(price)
+        if node is not None:
+            node.orders.append(order)
+            self.index_order(node, order, handle)
+            return node
+
+        if self.order_type is None:
+            self.order_type = order_type
+
+        new_node = self.new_node(price, order_type, order)
+        self.index_order(new_node, order, handle)
+        current = self.successor(price)
 
         if self.head is None:  # List is empty
             self.head = self.tail = new_node
@@ -41,13 +274,113 @@ class BucketList:
             new_node.next = current
             current.prev = new_node
 
+        self.index_add(price, new_node)
+        return new_node
+
+    def new_node(self, price, order_type, order):
+        return Node(price, order_type, [order])
+
+    def index_order(self, node, order, handle):
+        """
+        Record the order just appended to node in the client index and, if it has a handle,
+        in the handle index.
+        """
+        if self.client_orders is not None:
+            self.client_orders.setdefault(order[0], []).append((node, node.orders.last_position()))
+        if handle is not None:
+            if self.order_handles is None:
+                self.build_handle_index()
+            self.order_handles[handle] = (node, node.orders.last_position())
+
+    def locate(self, handle):
+        """
+        Return (node, position) of the resting order with this handle, or None if it has
+        executed, been cancelled or purged, or was never in this list.
+        """
+        if self.order_handles is None:
+            self.build_handle_index()
+        entry = self.order_handles.get(handle)
+        if entry is None:
+            return None
+        node, position = entry
+        if self.levels.get(node.price) is not node or node.orders.at(position) is None:
+            del self.order_handles[handle]
+            return None
+        return entry
+
+    def cancel(self, handle):
+        """
+        Remove the order with this handle and return it, or None if it is not resting here.
+        The order is tombstoned in its level's queue; an emptied level stays linked until the
+        matching cursor reaches it, as after a purge.
+        """
+        entry = self.locate(handle)
+        if entry is None:
+            return None
+        node, position = entry
+        order = node.orders.at(position)
+        node.orders.discard(position)
+        del self.order_handles[handle]
+        return order
+
+    def modify(self, handle, price, new_handle):
+        """
+        Move the order with this handle to a new price.  It loses its time priority and is
+        re-inserted under new_handle.  Returns the order, or None if it is not resting here.
+        """
+        order = self.cancel(handle)
+        if order is not None:
+            self.insert_or_update_node(price, self.order_type, order, new_handle)
+        return order
+
+    def build_handle_index(self):
+        self.order_handles = {}
+        if self.arrivals is None:
+            return
+        nodes, bounds, index = self.arrivals
+        for node, start, end in zip(nodes, bounds[:-1], bounds[1:]):
+            for position, handle in enumerate(index[start:end].tolist()):
+                self.order_handles[handle] = (node, position)
+        self.arrivals = None
+
+    def successor(self, price):
+        """
+        Return the existing level a new level at this price must be linked in front of,
+        or None if it belongs at the tail.
+        """
+        i = bisect_left(self.prices, price)
+        if self.order_type == 'B':
+            return self.levels[self.prices[i - 1]] if i > 0 else None
+        return self.levels[self.prices[i]] if i < len(self.prices) else None
+
+    def last_crossing(self, price):
+        """
+        Return the last level, in list order, that trades against an opposite order at this
+        price (the highest ask at or below it, or the lowest bid at or above it), or None.
+        """
+        node = self.levels.get(price)
+        if node is None:
+            following = self.successor(price)
+            node = following.prev if following is not None else self.tail
+        return node
+
+    def index_add(self, price, node):
+        insort(self.prices, price)
+        self.levels[price] = node
+
+    def index_remove(self, price):
+        del self.levels[price]
+        del self.prices[bisect_left(self.prices, price)]
+
     def remove_price(self, node):
         """
         Remove a node (price level) from the list.
         """
-        if node is None:
+        if node is None or self.levels.get(node.price) is not node:
             return
 
+        self.index_remove(node.price)
+
         if node == self.head and node == self.tail:  # Only one node in the list
             self.head = self.tail = None
         elif node == self.head:  # Node is the head
@@ -64,15 +397,305 @@ class BucketList:
 
         node.next = node.prev = None  # Disconnect the node completely
 
-def create_sorted_lists(orders):
-    buy_list = BucketList()
-    sell_list = BucketList()
+    def truncate(self, node):
+        """
+        Remove every level after node, in list order, with one cut: node becomes the tail.
+        With node None the list is emptied.  The removed levels are not unlinked from each
+        other one by one; returns them, best price first.
+        """
+        cut = self.head if node is None else node.next
+        removed = []
+        while cut is not None:
+            removed.append(cut)
+            cut = cut.next
+        if not removed:
+            return removed
+
+        removed[0].prev = None
+        if node is None:
+            self.head = self.tail = None
+        else:
+            node.next = None
+            self.tail = node
+        self.index_truncate(None if node is None else node.price, removed)
+        return removed
+
+    def index_truncate(self, price, nodes):
+        """
+        Drop the index entries of the levels cut off behind the level at price (all of them if
+        price is None).  Those are the prices on one end of the sorted array.
+        """
+        for node in nodes:
+            del self.levels[node.price]
+        if price is None:
+            self.prices = []
+        elif self.order_type == 'B':
+            del self.prices[:bisect_left(self.prices, price)]
+        else:
+            del self.prices[bisect_right(self.prices, price):]
+
+    def level_arrays(self):
+        """
+        Prices and live order counts of the levels that hold live orders, in list order, as
+        NumPy arrays.  Levels emptied by cancels stay linked until a walk drops them; their
+        prices must not become clearing price candidates.
+        """
+        nodes = [node for node in self if node.orders]
+        prices = np.array([node.price for node in nodes])
+        counts = np.array([len(node.orders) for node in nodes], dtype=np.int64)
+        return prices, counts
+
+    def popleft_many(self, k):
+        """
+        Remove the k best orders of the list in priority order (price, then arrival), dropping
+        levels that are emptied.  Returns the removed orders.
+        """
+        orders = []
+        while len(orders) < k and self.head is not None:
+            node = self.head
+            orders.extend(node.orders.popleft_many(k - len(orders)))
+            if not node.orders:
+                self.remove_price(node)
+        return orders
+
+    def restore_order(self, node, position, order):
+        """
+        Put an order removed from the head of node back at its position, ahead of the orders
+        that arrived after it.  The node must still be in the list.
+        """
+        node.orders.restore(position, order)
+        if self.client_orders is not None:
+            self.client_orders.setdefault(order[0], []).append((node, position))
+
+    def remove_client_orders(self, client_id):
+        """
+        Remove every order of the given client from all price levels.  Emptied levels stay
+        linked until the matching cursor reaches them.
+
+        Uses the per-client index, so only the client's own entries are touched: each is
+        tombstoned in its level's queue and other orders are never moved.  Entries of orders
+        that have since executed are skipped.  Returns the number of index entries visited.
+        """
+        if self.client_orders is None:
+            self.build_client_index()
+        entries = self.client_orders.pop(client_id, ())
+        for node, position in entries:
+            node.orders.discard(position)
+        return len(entries)
+
+    def prune_indexes(self):
+        """
+        Drop the index entries of orders that are no longer resting (executed, cancelled,
+        purged, or on a removed level), so that across the iterations of a persistent book the
+        indexes follow the resting orders instead of the total order flow, and removed levels
+        are not kept alive.  Entries are otherwise only removed when they are used.
+        """
+        if self.arrivals is not None:
+            self.build_handle_index()
+        if self.order_handles is not None:
+            self.order_handles = {handle: (node, position) for handle, (node, position) in self.order_handles.items()
+                                  if self.levels.get(node.price) is node and node.orders.at(position) is not None}
+        if self.client_orders is not None:
+            self.build_client_index()
+
+    def build_client_index(self):
+        """
+        Index every resting order by client id.  Built once, on the first purge, and kept
+        up to date by insert_or_update_node afterwards.
+        """
+        self.client_orders = {}
+        for node in self:
+            for position, order in node.orders.positions():
+                self.client_orders.setdefault(order[0], []).append((node, position))
+
+class TickBucketList(BucketList):
+    """
+    BucketList over an integer tick ladder.
+
+    Prices min_price + i * tick_size for 0 <= i < num_ticks map directly to slot i of a dense
+    ladder, and an occupancy bitmap (a Python int, bit i set when slot i holds a level) finds
+    the neighbouring level of a new price with a single bit scan instead of a binary search
+    and list insertion.  Prices off the ladder (out of band, or not on a tick) fall back to the
+    sorted price index of BucketList; neighbour searches consult both.
+    """
+    def __init__(self, order_type=None, min_price=0, tick_size=1, num_ticks=1024):
+        super().__init__(order_type)
+        self.min_price = min_price
+        self.tick_size = tick_size
+        self.num_ticks = num_ticks
+        self.ladder = [None] * num_ticks
+        self.occupied = 0
+
+    def tick(self, price):
+        """
+        Ladder slot of a price, or None if the price is off the ladder.
+        """
+        offset = price - self.min_price
+        if offset % self.tick_size:
+            return None
+        i = int(offset // self.tick_size)
+        return i if 0 <= i < self.num_ticks else None
+
+    def successor(self, price):
+        offset = (price - self.min_price) / self.tick_size
+        fallback = super().successor(price)
+
+        if self.order_type == 'B':
+            # Highest occupied slot priced below price.
+            bound = min(max(math.ceil(offset), 0), self.num_ticks)
+            below = self.occupied & ((1 << bound) - 1)
+            node = self.ladder[below.bit_length() - 1] if below else None
+            if fallback is not None and (node is None or fallback.price > node.price):
+                node = fallback
+            return node
+
+        # Lowest occupied slot priced above price.
+        bound = min(max(math.floor(offset) + 1, 0), self.num_ticks)
+        above = self.occupied >> bound
+        node = self.ladder[bound + (above & -above).bit_length() - 1] if above else None
+        if fallback is not None and (node is None or fallback.price < node.price):
+            node = fallback
+        return node
+
+    def index_add(self, price, node):
+        i = self.tick(price)
+        if i is None:
+            return super().index_add(price, node)
+        self.ladder[i] = node
+        self.occupied |= 1 << i
+        self.levels[price] = node
+
+    def index_remove(self, price):
+        i = self.tick(price)
+        if i is None:
+            return super().index_remove(price)
+        self.ladder[i] = None
+        self.occupied &= ~(1 << i)
+        del self.levels[price]
+
+    def index_truncate(self, price, nodes):
+        cleared = 0
+        for node in nodes:
+            i = self.tick(node.price)
+            if i is not None:
+                self.ladder[i] = None
+                cleared |= 1 << i
+        self.occupied &= ~cleared
+        # The levels dict and the prices off the ladder.
+        super().index_truncate(price, nodes)
+
+    def index_nodes(self, nodes):
+        self.levels = {}
+        self.prices = []
+        self.ladder = [None] * self.num_ticks
+        self.occupied = 0
+        for node in nodes:
+            self.index_add(node.price, node)
+
+def create_sorted_lists(orders, tick_ladder=None, handles=None):
+    """
+    Build the buy and sell lists from a whole batch of (price, order_type, details) orders.
+
+    Each side is stable-sorted by price with NumPy (descending for buys, ascending for sells),
+    runs of equal price are grouped into levels in one pass and the nodes are linked at the end.
+    The stable sort keeps arrival (FIFO) order within every level.
+
+    If tick_ladder is given as (min_price, tick_size, num_ticks), both sides are TickBucketLists.
+    Order i gets handles[i] as its handle, or i if no handles are given.
+    """
+    # One pass per column over the order tuples is the bulk of the build.
+    prices = np.array(list(map(itemgetter(0), orders)))
+    types = order_types(orders)
+    details = np.fromiter(map(itemgetter(2), orders), dtype=object, count=len(orders))
+
+    sides = []
+    for order_type in ('B', 'S'):
+        if tick_ladder is not None:
+            bucket_list = TickBucketList(order_type, *tick_ladder)
+        else:
+            bucket_list = BucketList(order_type)
+        sides.append(build_bucket_list(bucket_list, prices, details, np.flatnonzero(types == order_type.encode('ascii'))))
+        if handles is not None and sides[-1].arrivals is not None:
+            nodes, bounds, index = sides[-1].arrivals
+            sides[-1].arrivals = (nodes, bounds, np.asarray(handles)[index])
+
+    return sides[0], sides[1]
+
+def order_types(orders):
+    """
+    The order types of a batch as a NumPy 'S1' array.  They are joined into a byte string
+    rather than boxed one by one into a NumPy str array, which only lines up with the orders
+    if every type is one of the one-letter sides, so anything else is rejected first.
+    """
+    unknown = set(map(itemgetter(1), orders)) - {'B', 'S'}
+    if unknown:
+        raise ValueError(f"Unknown order types {sorted(map(repr, unknown))}, expected 'B' or 'S'.")
+    return np.frombuffer(''.join(map(itemgetter(1), orders)).encode('ascii'), dtype='S1')
+
+def build_bucket_list(bucket_list, prices, details, index):
+    """
+    Fill an empty BucketList with one side's orders, given by their positions in prices/details.
+    """
+    order_type = bucket_list.order_type
+    if len(index) == 0:
+        return bucket_list
+
+    side_prices = prices[index]
+    ranks = np.argsort(-side_prices if order_type == 'B' else side_prices, kind='stable')
+    side_prices = side_prices[ranks]
+    side_details = details[index[ranks]]
+
+    # Level boundaries are where the sorted price changes.
+    bounds = [0] + (np.flatnonzero(side_prices[1:] != side_prices[:-1]) + 1).tolist() + [len(index)]
+    level_prices = side_prices[bounds[:-1]].tolist()
+
+    nodes = [Node(price, order_type, side_details[start:end].tolist())
+             for price, start, end in zip(level_prices, bounds[:-1], bounds[1:])]
+
+    bucket_list.link_nodes(nodes)
+    bucket_list.arrivals = (nodes, bounds, index[ranks])
+    return bucket_list
+
+def clear_uniform_price(buy_list, sell_list):
+    """
+    Clear the whole book in one uniform-price batch auction.
+
+    Builds cumulative demand (bid volume at or above each price) and supply (ask volume at or
+    below each price) over all candidate prices with NumPy and picks the price that maximizes
+    the executable volume; ties go to the smallest demand/supply imbalance, then to the lowest
+    price.  Every order is one unit.  The executed orders are the best `volume` orders of each
+    side in priority order (price, then arrival), so fills are FIFO within a level.
+
+    Removes the executed orders from both lists and returns (price, buy_orders, sell_orders),
+    where the i-th buy order trades with the i-th sell order at the clearing price.  Returns
+    (None, [], []) if the book does not cross.
+    """
+    if buy_list.head is None or sell_list.head is None:
+        return None, [], []
+
+    price, volume = uniform_price(*buy_list.level_arrays(), *sell_list.level_arrays())
+    if price is None:
+        return None, [], []
+    return price, buy_list.popleft_many(volume), sell_list.popleft_many(volume)
+
+def uniform_price(bid_prices, bid_counts, ask_prices, ask_counts):
+    """
+    Clearing price and volume of a book given as level arrays (bids descending, asks
+    ascending), as in clear_uniform_price.  Returns (None, 0) if the book does not cross.
+    """
+    if len(bid_prices) == 0 or len(ask_prices) == 0:
+        return None, 0
+    candidates = np.union1d(bid_prices, ask_prices)
+
+    # Demand at p: bids priced >= p.  Supply at p: asks priced <= p.
+    bid_prices, bid_counts = bid_prices[::-1], bid_counts[::-1]
+    bid_above = np.concatenate(([0], np.cumsum(bid_counts[::-1])))[::-1]
+    demand = bid_above[np.searchsorted(bid_prices, candidates, side='left')]
+    supply = np.concatenate(([0], np.cumsum(ask_counts)))[np.searchsorted(ask_prices, candidates, side='right')]
 
-    for order in orders:
-        price, order_type, order_details = order
-        if order_type == 'B':
-            buy_list.insert_or_update_node(price, order_type, order_details)
-        elif order_type == 'S':
-            sell_list.insert_or_update_node(price, order_type, order_details)
+    volume = np.minimum(demand, supply)
+    best = np.lexsort((candidates, np.abs(demand - supply), -volume))[0]
+    if volume[best] == 0:
+        return None, 0
+    return candidates[best].item(), int(volume[best])
 
-    return buy_list, sell_list
\ No newline at end of file
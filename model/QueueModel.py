@@ -0,0 +1,146 @@
+import pandas as pd
+import sys
+
+from collections import deque
+
+class QueueModel:
+
+  """
+  QueueModel provides an optional ingress service-queue model for a single agent in the ABIDES
+  simulation.  Without it, an agent with zero computation delay can absorb any number of
+  concurrent messages at the same simulated instant, which hides the fan-in bottleneck of a
+  central agent (e.g. the auction ServiceAgent that every client talks to).
+
+  When a QueueModel is attached to an agent, the Kernel admits at most one message at a time
+  into that agent.  Each admitted message occupies the server for a processing time drawn from
+  the configured distribution.  Messages that arrive while the server is busy wait in a buffer
+  and are released one by one according to the queue discipline.  Wakeup calls are not queued.
+
+  'service_rate' is the mean number of messages the agent can process per second.  Float.
+  Required unless 'service_time' is given.
+
+  'service_time' is the mean processing time per message.  pd.Timedelta or integer nanoseconds.
+  Overrides 'service_rate' when both are given.
+
+  'distribution' selects the processing time distribution around the mean.  One of
+  'deterministic' (every message takes exactly the mean), 'exponential' (M/M/1-style service),
+  or 'uniform' (uniform on [0, 2 * mean]).  Default is 'exponential'.
+
+  'discipline' selects which waiting message is served next.  One of 'fifo', 'lifo' or
+  'random'.  Default is 'fifo'.
+
+  Wait statistics are accumulated as the simulation runs and returned by stats().
+  """
+
+
+  def __init__(self, service_rate = None, service_time = None, distribution = 'exponential',
+               discipline = 'fifo', random_state = None):
+
+    if service_time is not None:
+      self.mean_service_ns = int(pd.Timedelta(service_time).value)
+    elif service_rate is not None and service_rate > 0:
+      self.mean_service_ns = int(1e9 / service_rate)
+    else:
+      print ("Config error: QueueModel requires a positive 'service_rate' or a 'service_time'.")
+      sys.exit()
+
+    self.distribution = distribution.lower()
+    self.discipline = discipline.lower()
+    self.random_state = random_state
+
+    if self.distribution not in ('deterministic', 'exponential', 'uniform'):
+      print (f"Config error: unknown service time distribution requested ({self.distribution})")
+      sys.exit()
+
+    if self.discipline not in ('fifo', 'lifo', 'random'):
+      print (f"Config error: unknown queue discipline requested ({self.discipline})")
+      sys.exit()
+
+    if self.distribution != 'deterministic' and random_state is None:
+      print ("Config error: a stochastic QueueModel requires an np.random.RandomState object.")
+      sys.exit()
+
+    # Time until which the server is processing the last admitted message.
+    self.busy_until = None
+
+    # Messages waiting for the server, as (arrival time, message) tuples in arrival order.
+    self.buffer = deque()
+
+    # Accumulated statistics.
+    self.served = 0
+    self.delayed = 0
+    self.total_wait = pd.Timedelta(0)
+    self.max_wait = pd.Timedelta(0)
+    self.total_service = pd.Timedelta(0)
+    self.max_queue_length = 0
+
+
+  def is_busy(self, currentTime):
+    """ Returns True if the server is still processing a previously admitted message. """
+    return self.busy_until is not None and self.busy_until > currentTime
+
+
+  def enqueue(self, currentTime, msg):
+    """ Buffer a message that arrived while the server was busy. """
+    self.buffer.append((currentTime, msg))
+    if len(self.buffer) > self.max_queue_length:
+      self.max_queue_length = len(self.buffer)
+
+
+  def dequeue(self):
+    """ Remove and return the next waiting (arrival time, message) per the discipline, or None. """
+    if not self.buffer: return None
+
+    if self.discipline == 'fifo':
+      return self.buffer.popleft()
+    elif self.discipline == 'lifo':
+      return self.buffer.pop()
+
+    # Random service order: rotate the chosen entry to the front and pop it.
+    i = self.random_state.randint(low = 0, high = len(self.buffer))
+    self.buffer.rotate(-i)
+    entry = self.buffer.popleft()
+    self.buffer.rotate(i)
+    return entry
+
+
+  def admit(self, currentTime, arrivalTime):
+    """
+    Start serving one message at currentTime.  Records the time it waited since arrivalTime
+    and returns the time at which the server will be free again.
+    """
+    wait = currentTime - arrivalTime
+    service = pd.Timedelta(self.draw_service_time())
+
+    self.served += 1
+    if wait > pd.Timedelta(0): self.delayed += 1
+    self.total_wait += wait
+    if wait > self.max_wait: self.max_wait = wait
+    self.total_service += service
+
+    self.busy_until = currentTime + service
+    return self.busy_until
+
+
+  def draw_service_time(self):
+    """ Sample one processing time in integer nanoseconds. """
+    if self.distribution == 'deterministic':
+      return self.mean_service_ns
+    elif self.distribution == 'exponential':
+      return int(self.random_state.exponential(self.mean_service_ns))
+
+    return int(self.random_state.uniform(low = 0, high = 2 * self.mean_service_ns))
+
+
+  def stats(self):
+    """ Summary of queue behaviour so far, suitable for Kernel.custom_state. """
+    mean_wait = self.total_wait / self.served if self.served else pd.Timedelta(0)
+
+    return { 'served' : self.served,
+             'delayed' : self.delayed,
+             'mean_wait' : mean_wait,
+             'max_wait' : self.max_wait,
+             'total_wait' : self.total_wait,
+             'utilization_time' : self.total_service,
+             'max_queue_length' : self.max_queue_length,
+             'still_queued' : len(self.buffer) }
@@ -0,0 +1,204 @@
+"""
+Fixed-layout binary snapshots of order books and trade blotters.
+
+A snapshot file is a header, a segment table and the segments, each a 1-D little-endian
+array starting on a 64-byte boundary:
+
+    header          magic b'IDPSNAP1', version (u4), number of segments (u4)
+    segment table   per segment: name (S32), dtype (S8), byte offset (u8), length (u8)
+    segments        raw column data
+
+read_snapshot() maps every segment with np.memmap, so opening a snapshot of 10^7 orders
+costs a few page faults and nothing is copied until a column is touched.  One segment named
+'meta' holds a JSON document describing the rest.
+"""
+
+import json
+
+import numpy as np
+
+from model.SymbolModel import SymbolBooks
+
+MAGIC = b'IDPSNAP1'
+VERSION = 1
+ALIGN = 64
+
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('segments', '<u4')])
+SEGMENT = np.dtype([('name', 'S32'), ('dtype', 'S8'), ('offset', '<u8'), ('length', '<u8')])
+
+def write_snapshot(path, columns, meta=None):
+    """
+    Write 1-D arrays (name -> array) and a JSON-serializable meta dict to path.
+    """
+    columns = dict(columns)
+    columns['meta'] = np.frombuffer(json.dumps(meta or {}).encode(), dtype=np.uint8)
+    columns = {name: np.ascontiguousarray(column).ravel() for name, column in columns.items()}
+
+    table = np.zeros(len(columns), dtype=SEGMENT)
+    offset = aligned(HEADER.itemsize + table.nbytes)
+    for entry, (name, column) in zip(table, columns.items()):
+        column = columns[name] = column.astype(column.dtype.newbyteorder('<'), copy=False)
+        entry['name'] = name.encode()
+        entry['dtype'] = column.dtype.str.encode()
+        entry['offset'] = offset
+        entry['length'] = len(column)
+        offset = aligned(offset + column.nbytes)
+
+    header = np.array([(MAGIC, VERSION, len(columns))], dtype=HEADER)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(table.tobytes())
+        for entry, column in zip(table, columns.values()):
+            f.seek(int(entry['offset']))
+            f.write(column.tobytes())
+        f.truncate(offset)
+
+def read_snapshot(path):
+    """
+    Map a snapshot.  Returns (columns, meta) where columns maps each segment name to a
+    read-only np.memmap view.
+    """
+    header = np.fromfile(path, dtype=HEADER, count=1)[0]
+    if header['magic'] != MAGIC or header['version'] != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} order book snapshot")
+    table = np.fromfile(path, dtype=SEGMENT, count=int(header['segments']), offset=HEADER.itemsize)
+
+    columns = {}
+    for entry in table:
+        dtype = np.dtype(entry['dtype'].decode())
+        length = int(entry['length'])
+        if length == 0:
+            columns[entry['name'].decode()] = np.zeros(0, dtype=dtype)
+        else:
+            columns[entry['name'].decode()] = np.memmap(path, dtype=dtype, mode='r',
+                                                        offset=int(entry['offset']), shape=(length,))
+    meta = json.loads(bytes(columns.pop('meta')).decode() or '{}')
+    return columns, meta
+
+def aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+def encode_values(prefix, values):
+    """
+    Store a list of bools, ints, strs or bytes as columns named after prefix.  Strings and
+    bytes become one data segment plus an offsets segment.  Returns (columns, kind).
+    """
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return {prefix: np.array(values, dtype=bool)}, 'bool'
+    if all(isinstance(value, (int, np.integer)) for value in values):
+        return {prefix: np.array(values, dtype=np.int64)}, 'int'
+    kind = 'bytes' if all(isinstance(value, bytes) for value in values) else 'str'
+    encoded = [value if kind == 'bytes' else str(value).encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return {prefix + '_data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            prefix + '_offsets': offsets}, kind
+
+def decode_values(columns, prefix, kind):
+    if kind in ('bool', 'int'):
+        return columns[prefix].tolist()
+    data = bytes(columns[prefix + '_data'])
+    offsets = columns[prefix + '_offsets'].tolist()
+    values = [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    return values if kind == 'bytes' else [value.decode() for value in values]
+
+def book_columns(registry):
+    """
+    Columns of every resting order of a SymbolBooks registry, in priority order: symbols
+    sorted, buys (best first) then sells (best first), FIFO within a level.  Orders refer to
+    a table of their distinct (client_id, enc_name, enc_status) tuples.
+    """
+    symbols = registry.symbols()
+    prices, sides, symbol_ids, blob_ids = [], [], [], []
+    blob_index = {}
+    for symbol_id, symbol in enumerate(symbols):
+        for side, price_list in enumerate(registry[symbol]):
+            for node in price_list:
+                for order in node.orders:
+                    prices.append(node.price)
+                    sides.append(side)
+                    symbol_ids.append(symbol_id)
+                    blob_ids.append(blob_index.setdefault(order, len(blob_index)))
+
+    blobs = list(blob_index)
+    columns = {'price': np.array(prices, dtype=np.float64 if any(isinstance(p, float) for p in prices) else np.int64),
+               'side': np.array(sides, dtype=np.int8),
+               'symbol': np.array(symbol_ids, dtype=np.int32),
+               'blob': np.array(blob_ids, dtype=np.int32),
+               'blob_client': np.array([blob[0] for blob in blobs], dtype=np.int64)}
+    name_columns, name_kind = encode_values('blob_name', [blob[1] for blob in blobs])
+    status_columns, status_kind = encode_values('blob_status', [blob[2] for blob in blobs])
+    symbol_columns, symbol_kind = encode_values('symbols', symbols)
+    columns.update(name_columns)
+    columns.update(status_columns)
+    columns.update(symbol_columns)
+    meta = {'orders': len(prices), 'symbols': len(symbols),
+            'name_kind': name_kind, 'status_kind': status_kind, 'symbol_kind': symbol_kind}
+    return columns, meta
+
+def trade_columns(trades):
+    """
+    Columns of a trade blotter of ("Buy", buyer, buy price, "Sell", seller, sell price)
+    tuples, with client names interned in a table.
+    """
+    name_index = {}
+    buyers = [name_index.setdefault(trade[1], len(name_index)) for trade in trades]
+    sellers = [name_index.setdefault(trade[4], len(name_index)) for trade in trades]
+    names, name_kind = encode_values('trade_names', list(name_index))
+    prices = [trade[2] for trade in trades] + [trade[5] for trade in trades]
+    dtype = np.float64 if any(isinstance(p, float) for p in prices) else np.int64
+    columns = {'trade_buyer': np.array(buyers, dtype=np.int32),
+               'trade_seller': np.array(sellers, dtype=np.int32),
+               'trade_buy_price': np.array([trade[2] for trade in trades], dtype=dtype),
+               'trade_sell_price': np.array([trade[5] for trade in trades], dtype=dtype)}
+    columns.update(names)
+    return columns, {'trades': len(trades), 'trade_name_kind': name_kind}
+
+def save_snapshot(path, registry, trades=(), **meta):
+    """
+    Snapshot a SymbolBooks registry and, optionally, a trade blotter to path.
+    """
+    columns, book_meta = book_columns(registry)
+    blotter, blotter_meta = trade_columns(list(trades))
+    columns.update(blotter)
+    meta.update(book_meta)
+    meta.update(blotter_meta)
+    write_snapshot(path, columns, meta)
+
+def snapshot_orders(columns, meta):
+    """
+    The resting orders of a mapped snapshot as (price, order_type, details[, symbol]) tuples in
+    priority order.  Symbols are only attached when the snapshot has more than the default one.
+    """
+    clients = columns['blob_client'].tolist()
+    names = decode_values(columns, 'blob_name', meta['name_kind'])
+    statuses = decode_values(columns, 'blob_status', meta['status_kind'])
+    blobs = list(zip(clients, names, statuses))
+    symbols = decode_values(columns, 'symbols', meta['symbol_kind'])
+
+    sides = np.array(['B', 'S'])[columns['side']].tolist()
+    details = [blobs[i] for i in columns['blob'].tolist()]
+    prices = columns['price'].tolist()
+    if symbols == [""]:
+        return list(zip(prices, sides, details))
+    tags = [symbols[i] for i in columns['symbol'].tolist()]
+    return list(zip(prices, sides, details, tags))
+
+def snapshot_trades(columns, meta):
+    names = decode_values(columns, 'trade_names', meta['trade_name_kind'])
+    return [("Buy", names[buyer], buy_price, "Sell", names[seller], sell_price)
+            for buyer, seller, buy_price, sell_price in zip(columns['trade_buyer'].tolist(),
+                                                             columns['trade_seller'].tolist(),
+                                                             columns['trade_buy_price'].tolist(),
+                                                             columns['trade_sell_price'].tolist())]
+
+def load_books(path, book_engine="bucket", tick_ladder=None):
+    """
+    Rebuild a SymbolBooks registry from a snapshot.  Returns (registry, meta).  The orders are
+    rebuilt in priority order, so the stable bulk build restores every level's FIFO order;
+    order i of the snapshot gets handle i.
+    """
+    columns, meta = read_snapshot(path)
+    registry = SymbolBooks(book_engine, tick_ladder)
+    registry.build(snapshot_orders(columns, meta))
+    return registry, meta
@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model.MatchingModel import create_sorted_lists, uniform_price
+from model.ColumnarModel import create_columnar_lists
+
+def order_symbol(order):
+    """
+    Symbol of a (price, order_type, details[, symbol]) order.  Untagged orders trade the
+    default symbol "".
+    """
+    return order[3] if len(order) > 3 else ""
+
+class SymbolBooks:
+    """
+    Registry of per-symbol order books: symbol -> (buy_list, sell_list), all built with the
+    same book engine ("bucket", "tick" or "columnar").
+
+    Handles are unique across symbols: a batch build gives every order its arrival index in
+    the whole batch, and later inserts take the caller's handle.  Symbols are always visited
+    in sorted order, so anything derived from the registry is deterministic.
+    """
+    def __init__(self, book_engine="bucket", tick_ladder=None):
+        self.book_engine = book_engine
+        self.tick_ladder = tick_ladder
+        self.books = {}
+
+    def __len__(self):
+        return len(self.books)
+
+    def __contains__(self, symbol):
+        return symbol in self.books
+
+    def __getitem__(self, symbol):
+        return self.books[symbol]
+
+    def symbols(self):
+        return sorted(self.books)
+
+    def create_lists(self, orders, handles=None):
+        if self.book_engine == "columnar":
+            return create_columnar_lists(orders, handles)
+        elif self.book_engine == "tick":
+            return create_sorted_lists(orders, self.tick_ladder, handles)
+        return create_sorted_lists(orders, handles=handles)
+
+    def build(self, orders):
+        """
+        Replace all books with ones built from a whole batch of orders.
+        """
+        self.books = {}
+        lengths = np.fromiter(map(len, orders), dtype=np.int64, count=len(orders))
+        if len(orders) == 0 or lengths.max() < 4:
+            self.books[""] = self.create_lists(orders)
+            return
+
+        groups = {}
+        for i, order in enumerate(orders):
+            groups.setdefault(order_symbol(order), []).append(i)
+        for symbol, index in groups.items():
+            self.books[symbol] = self.create_lists([orders[i] for i in index], index)
+
+    def get(self, symbol):
+        """
+        The (buy_list, sell_list) of a symbol, created empty if it has no book yet.
+        """
+        lists = self.books.get(symbol)
+        if lists is None:
+            lists = self.books[symbol] = self.create_lists([])
+        return lists
+
+    def insert(self, order, handle):
+        buy_list, sell_list = self.get(order_symbol(order))
+        price, order_type, details = order[:3]
+        price_list = buy_list if order_type == 'B' else sell_list
+        price_list.insert_or_update_node(price, order_type, details, handle)
+
+    def remove_client_orders(self, client_id):
+        entries = 0
+        for buy_list, sell_list in self.books.values():
+            entries += buy_list.remove_client_orders(client_id)
+            entries += sell_list.remove_client_orders(client_id)
+        return entries
+
+    def prune_indexes(self):
+        for buy_list, sell_list in self.books.values():
+            buy_list.prune_indexes()
+            sell_list.prune_indexes()
+
+def clear_symbols(registry):
+    """
+    Uniform-price batch clearing of every symbol in the registry, one after another in sorted
+    symbol order.  Symbols are independent, but a clearing price only takes uniform_price on
+    a few small level arrays: most of the work is taking the executed orders out of the
+    books, which live in this process.  A process pool that only computed the prices cost
+    more in packing and shipping the arrays than it saved (512 symbols of 2000 orders:
+    0.21 s serially, 2.4 s and 0.56 s with 2 and 4 workers), so there is none.
+
+    Returns [(symbol, price, buy_orders, sell_orders)] in sorted symbol order, including
+    symbols that did not cross (price None, no orders).
+    """
+    results = []
+    for symbol in registry.symbols():
+        buy_list, sell_list = registry[symbol]
+        price, volume = uniform_price(*(buy_list.level_arrays() + sell_list.level_arrays()))
+        if price is None or volume == 0:
+            results.append((symbol, None, [], []))
+        else:
+            results.append((symbol, price, buy_list.popleft_many(volume), sell_list.popleft_many(volume)))
+    return results
+
+def create_executor(workers):
+    """
+    Process pool for the server work that runs in parallel, or None when running single-process.
+    """
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
@@ -0,0 +1,81 @@
+"""
+Round waiting times derived from the latency model.
+
+A server round sends requests to some clients and sleeps until their replies should be in.
+With a fixed wait (1 s or 3 s per round) the protocol time has nothing to do with the
+network, whose latencies are in the tens of microseconds.  WaitTimes instead waits for a
+high quantile of the request/reply round trip: for a round that needs k replies and a
+target dropout probability p, the wait w satisfies P(all k round trips <= w) = 1 - p, so w
+is the (1 - p)^(1/k) quantile of one round trip.
+
+A round trip is the sum of two cubic (or deterministic) legs over different agent pairs,
+which has no closed form, so its distribution is sampled once at construction: a vectorized
+Monte-Carlo draw over random clients with the latency model's own parameters.
+
+With retune, observed reply latencies replace the sample once enough of them arrived, so
+the waits follow the network as simulated, including ingress queueing at the server.
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+class WaitTimes:
+    def __init__(self, latency_model, server_id, client_ids, dropout=0.01, samples=100000,
+                 step=pd.Timedelta('1us'), retune=False, window=1024, min_observations=64,
+                 random_state=None):
+        self.latency_model = latency_model
+        self.server_id = server_id
+        self.client_ids = np.asarray(client_ids)
+        self.dropout = dropout
+        self.step = step  # wait between server steps that expect no replies
+        self.retune = retune
+        self.observed = deque(maxlen=window)  # observed round trips (ns)
+        self.min_observations = min_observations
+        self.random_state = random_state if random_state is not None else np.random.RandomState(0)
+        self.sample = np.sort(self.sample_round_trips(samples))
+        self.cache = {}
+
+    def sample_round_trips(self, samples):
+        """
+        Round trips server -> random client -> server drawn from the latency model (ns).
+        """
+        clients = self.random_state.choice(self.client_ids, size=samples)
+        return self.leg_sample(self.server_id, clients) + self.leg_sample(clients, self.server_id)
+
+    def leg_sample(self, sender_ids, recipient_ids):
+        model = self.latency_model
+        sender_ids, recipient_ids = np.broadcast_arrays(sender_ids, recipient_ids)
+
+        def extract(param):
+            param = model.kwargs[param]
+            if np.isscalar(param):
+                return np.full(len(sender_ids), param, dtype=float)
+            return param[sender_ids] if param.ndim == 1 else param[sender_ids, recipient_ids]
+
+        min_latency = extract('min_latency')
+        if model.latency_model == 'deterministic':
+            return min_latency
+        clip = extract('jitter_clip')
+        x = self.random_state.uniform(low=clip, high=1.0)
+        return min_latency + (extract('jitter') / x**3) * (min_latency / extract('jitter_unit'))
+
+    def wait(self, replies=1):
+        """
+        Time to wait for `replies` replies to requests sent now, so that all of them are in
+        with probability 1 - dropout.
+        """
+        level = (1.0 - self.dropout) ** (1.0 / max(replies, 1))
+        if self.retune and len(self.observed) >= self.min_observations:
+            return pd.Timedelta(int(np.quantile(self.observed, level)), unit='ns')
+        if level not in self.cache:
+            self.cache[level] = pd.Timedelta(int(np.quantile(self.sample, level)), unit='ns')
+        return self.cache[level]
+
+    def observe(self, latency):
+        """
+        Record the round trip of one reply (pd.Timedelta or ns) for retuning.
+        """
+        if self.retune:
+            self.observed.append(getattr(latency, 'value', latency))
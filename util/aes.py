@@ -1,4 +1,6 @@
 from Cryptodome.Cipher import AES
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import ECC
 from Cryptodome.Random import get_random_bytes
 import base64
 
@@ -33,4 +35,27 @@ class aes:
             decrypted_text = self.unpad(cipher.decrypt(ciphertext))  # Decrypt and unpad
             return decrypted_text.decode('utf-8')  # Return the decoded plaintext
         except (UnicodeDecodeError, ValueError) as e:
-            return None  # Return None or simply omit this line to do nothing
\ No newline at end of file
+            return None  # Return None or simply omit this line to do nothing
+
+    def encrypt_to_key(self, public_key, plaintext):
+        # ECIES: an ephemeral P-256 key agrees an AES key with the recipient's public point,
+        # and the ephemeral public point travels in front of the AES ciphertext.
+        ephemeral = ECC.generate(curve='P-256')
+        aes_key = self.shared_aes_key(ephemeral.d, public_key)
+        point = ephemeral.public_key().export_key(format='SEC1')
+        encrypted = base64.b64decode(self.encrypt_with_aes(aes_key, plaintext))
+        return base64.b64encode(point + encrypted).decode('utf-8')
+
+    def decrypt_from_key(self, secret_key, encrypted_text):
+        try:
+            encrypted_text = base64.b64decode(encrypted_text.encode('utf-8'))
+            point = ECC.import_key(encrypted_text[:65], curve_name='P-256').pointQ
+        except (ValueError, TypeError):
+            return None
+        aes_key = self.shared_aes_key(secret_key, point)
+        return self.decrypt_with_aes(aes_key, base64.b64encode(encrypted_text[65:]).decode('utf-8'))
+
+    def shared_aes_key(self, secret_key, public_key):
+        # ECDH on P-256, hashed into a 256-bit AES key
+        shared_point = public_key * secret_key
+        return SHA256.new(int(shared_point.x).to_bytes(32, 'big')).digest()
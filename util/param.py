@@ -25,6 +25,9 @@ wt_google_collection = pd.Timedelta('10s')
 wt_google_crosscheck = pd.Timedelta('3s')
 wt_google_recontruction = pd.Timedelta('2s') 
 
+wt_auction_match = pd.Timedelta('10s')     # MATCH status replies of a candidate pair
+wt_auction_execute = pd.Timedelta('10s')   # EXECUTE name reveals of an executed pair
+
 # WARNING: 
 # this should be a random seed from beacon service;
 # we use a fixed one for simplicity